@@ -0,0 +1,40 @@
+"""add bundle_search
+
+Revision ID: 4c8e1f2a9b7d
+Revises: db3ca94867b3
+Create Date: 2026-10-19 01:12:40.512310
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4c8e1f2a9b7d'
+down_revision = 'db3ca94867b3'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'bundle_search',
+        sa.Column('bundle_uuid', sa.String(length=63), nullable=False),
+        sa.Column('name', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['bundle_uuid'], ['bundle.uuid'],),
+        sa.PrimaryKeyConstraint('bundle_uuid'),
+        mysql_charset='utf8',
+    )
+    op.execute(
+        "INSERT INTO bundle_search (bundle_uuid, name) "
+        "SELECT bundle.uuid, MIN(bundle_metadata.metadata_value) FROM bundle "
+        "LEFT JOIN bundle_metadata ON bundle_metadata.bundle_uuid = bundle.uuid "
+        "AND bundle_metadata.metadata_key = 'name' GROUP BY bundle.uuid"
+    )
+    # Building the index after the backfill is much faster than updating it row by row.
+    op.execute('SET SESSION innodb_ft_enable_stopword = OFF')
+    op.execute(
+        'CREATE FULLTEXT INDEX bundle_search_name_index ON bundle_search (name) WITH PARSER ngram'
+    )
+
+
+def downgrade():
+    op.drop_table('bundle_search')
@@ -0,0 +1,68 @@
+"""add typed search metadata
+
+Revision ID: 9d2b6e0c5a13
+Revises: 4c8e1f2a9b7d
+Create Date: 2026-10-19 02:05:18.204117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9d2b6e0c5a13'
+down_revision = '4c8e1f2a9b7d'
+
+from alembic import op
+import sqlalchemy as sa
+
+INDEXED_COLUMNS = ['data_size', 'created', 'time', 'request_queue']
+# Expressions converting the text of bundle_metadata.metadata_value to the type of each new column.
+# Values that don't fit the column, which old clients could have set, are left out, since strict
+# mode would otherwise abort the migration on them. MySQL only evaluates the branch of IF it takes.
+BACKFILL_VALUES = {
+    'data_size': "IF(%(v)s REGEXP '^-?[0-9]{1,18}$', CAST(%(v)s AS SIGNED), NULL)",
+    'created': (
+        "IF(%(v)s REGEXP '^-?[0-9]{1,10}$', "
+        "IF(CAST(%(v)s AS SIGNED) BETWEEN -2147483648 AND 2147483647, CAST(%(v)s AS SIGNED), NULL), "
+        "NULL)"
+    ),
+    'time': (
+        "IF(%(v)s REGEXP '^-?[0-9]{1,20}([.][0-9]{0,20})?([eE][-+]?[0-9]{1,2})?$', %(v)s + 0E0, "
+        "NULL)"
+    ),
+    'request_queue': "LEFT(%(v)s, 255)",
+    'staged_status': "%(v)s",
+}
+
+
+def upgrade():
+    op.add_column('bundle_search', sa.Column('data_size', sa.BigInteger(), nullable=True))
+    op.add_column('bundle_search', sa.Column('created', sa.Integer(), nullable=True))
+    op.add_column('bundle_search', sa.Column('time', sa.Float(precision=53), nullable=True))
+    op.add_column('bundle_search', sa.Column('request_queue', sa.String(length=255), nullable=True))
+    op.add_column('bundle_search', sa.Column('staged_status', sa.Text(), nullable=True))
+    # Backfill the new columns from bundle_metadata, where the values are text.
+    for key, value in BACKFILL_VALUES.items():
+        op.execute(
+            "UPDATE bundle_search JOIN bundle_metadata "
+            "ON bundle_metadata.bundle_uuid = bundle_search.bundle_uuid "
+            "AND bundle_metadata.metadata_key = '%s' "
+            "SET bundle_search.%s = %s"
+            % (key, key, value % {'v': 'bundle_metadata.metadata_value'})
+        )
+    op.create_index('bundle_search_name_prefix_index', 'bundle_search', ['name'], mysql_length=63)
+    op.create_index(
+        'bundle_search_staged_status_prefix_index',
+        'bundle_search',
+        ['staged_status'],
+        mysql_length=63,
+    )
+    for column in INDEXED_COLUMNS:
+        op.create_index('bundle_search_%s_index' % column, 'bundle_search', [column])
+
+
+def downgrade():
+    for column in INDEXED_COLUMNS:
+        op.drop_index('bundle_search_%s_index' % column, table_name='bundle_search')
+    op.drop_index('bundle_search_staged_status_prefix_index', table_name='bundle_search')
+    op.drop_index('bundle_search_name_prefix_index', table_name='bundle_search')
+    for column in ['staged_status', 'request_queue', 'time', 'created', 'data_size']:
+        op.drop_column('bundle_search', column)
@@ -0,0 +1,23 @@
+"""index dependency parent uuid
+
+Revision ID: 1f7a3c9e4d25
+Revises: 9d2b6e0c5a13
+Create Date: 2026-10-19 03:21:47.601982
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f7a3c9e4d25'
+down_revision = '9d2b6e0c5a13'
+
+from alembic import op
+
+
+def upgrade():
+    # MySQL already indexes child_uuid for its foreign key, which new databases name
+    # dependency_child_uuid_index.
+    op.create_index('dependency_parent_uuid_index', 'bundle_dependency', ['parent_uuid'])
+
+
+def downgrade():
+    op.drop_index('dependency_parent_uuid_index', table_name='bundle_dependency')
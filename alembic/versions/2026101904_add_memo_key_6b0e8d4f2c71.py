@@ -0,0 +1,76 @@
+"""add memo key
+
+Revision ID: 6b0e8d4f2c71
+Revises: 1f7a3c9e4d25
+Create Date: 2026-10-19 04:02:33.871540
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b0e8d4f2c71'
+down_revision = '1f7a3c9e4d25'
+
+from collections import defaultdict
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+# Number of bundles to compute memo keys for at once.
+BATCH_SIZE = 10000
+
+
+def get_memo_key(owner_id, command, dependencies):
+    """
+    A copy of codalab.model.bundle_model.get_memo_key as of this revision, so that the migration
+    keeps computing the same keys if it changes later.
+    """
+    value = json.dumps([owner_id, command, sorted([list(dep) for dep in dependencies])])
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def upgrade():
+    op.add_column('bundle_search', sa.Column('memo_key', sa.String(length=64), nullable=True))
+    # Compute the memo keys of existing bundles with commands, in batches ordered by id.
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        bundles = connection.execute(
+            sa.text(
+                "SELECT id, uuid, owner_id, command FROM bundle "
+                "WHERE command IS NOT NULL AND id > :last_id ORDER BY id LIMIT :limit"
+            ),
+            last_id=last_id,
+            limit=BATCH_SIZE,
+        ).fetchall()
+        if not bundles:
+            break
+        last_id = bundles[-1].id
+        dependencies = defaultdict(list)
+        for row in connection.execute(
+            sa.text(
+                "SELECT child_uuid, child_path, parent_uuid FROM bundle_dependency "
+                "WHERE child_uuid IN :uuids"
+            ).bindparams(sa.bindparam('uuids', expanding=True)),
+            uuids=[bundle.uuid for bundle in bundles],
+        ):
+            dependencies[row.child_uuid].append((row.child_path, row.parent_uuid))
+        connection.execute(
+            sa.text("UPDATE bundle_search SET memo_key = :memo_key WHERE bundle_uuid = :uuid"),
+            [
+                {
+                    'uuid': bundle.uuid,
+                    'memo_key': get_memo_key(
+                        bundle.owner_id, bundle.command, dependencies[bundle.uuid]
+                    ),
+                }
+                for bundle in bundles
+            ],
+        )
+    op.create_index('bundle_search_memo_key_index', 'bundle_search', ['memo_key'])
+
+
+def downgrade():
+    op.drop_index('bundle_search_memo_key_index', table_name='bundle_search')
+    op.drop_column('bundle_search', 'memo_key')
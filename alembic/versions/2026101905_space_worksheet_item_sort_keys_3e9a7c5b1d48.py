@@ -0,0 +1,55 @@
+"""space worksheet item sort keys
+
+Revision ID: 3e9a7c5b1d48
+Revises: 6b0e8d4f2c71
+Create Date: 2026-10-19 05:12:36.284017
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e9a7c5b1d48'
+down_revision = '6b0e8d4f2c71'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Same as codalab.objects.worksheet.SORT_KEY_GAP.
+SORT_KEY_GAP = 2 ** 16
+
+
+def upgrade():
+    op.alter_column(
+        'worksheet_item',
+        'sort_key',
+        type_=sa.BigInteger(),
+        existing_type=sa.Integer(),
+        existing_nullable=True,
+    )
+    # Items without a sort key now sort as if it were SORT_KEY_GAP times their id, so scaling
+    # the existing sort keys by the same factor keeps the order of all items.
+    op.execute(
+        'UPDATE worksheet_item SET sort_key = sort_key * %d WHERE sort_key IS NOT NULL'
+        % SORT_KEY_GAP
+    )
+    op.create_index(
+        'worksheet_item_worksheet_uuid_sort_key_index',
+        'worksheet_item',
+        ['worksheet_uuid', 'sort_key'],
+    )
+
+
+def downgrade():
+    op.drop_index('worksheet_item_worksheet_uuid_sort_key_index', table_name='worksheet_item')
+    # Items that were inserted between others since the upgrade may end up with the same sort
+    # key as their neighbors.
+    op.execute(
+        'UPDATE worksheet_item SET sort_key = FLOOR(sort_key / %d) WHERE sort_key IS NOT NULL'
+        % SORT_KEY_GAP
+    )
+    op.alter_column(
+        'worksheet_item',
+        'sort_key',
+        type_=sa.Integer(),
+        existing_type=sa.BigInteger(),
+        existing_nullable=True,
+    )
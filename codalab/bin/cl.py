@@ -2,9 +2,11 @@
 import sys
 from codalab.lib.bundle_cli import BundleCLI
 from codalab.lib.codalab_manager import CodaLabManager
+from codalab.worker import compression
 
 
 def main():
+    compression.use_all_cores()
     cli = BundleCLI(CodaLabManager())
     try:
         cli.do_command(sys.argv[1:])
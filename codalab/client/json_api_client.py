@@ -7,6 +7,7 @@ import urllib.parse
 import urllib.error
 
 from codalab.common import http_error_to_exception, precondition, ensure_str, UsageError
+from codalab.worker.compression import accept_encoding_header
 from codalab.worker.rest_client import RestClient, RestClientException
 from codalab.worker.download_util import BundleTarget
 
@@ -434,6 +435,36 @@ class JsonApiClient(RestClient):
         else:
             return results[0]
 
+    @wrap_exception('Unable to search bundles')
+    def fetch_bundles_page(self, keywords, cursor='', params=None):
+        """
+        Request to fetch the page of bundles matching the given search keywords after the given
+        cursor ('' for the first page), using keyset pagination.
+
+        :param keywords: list of search keywords, which may include .limit to set the page size
+        :param cursor: cursor returned for the previous page
+        :param params: dict of other query parameters
+        :return: the bundles of the page, and the cursor of the next page (None if it is the
+                 last page)
+        """
+        params = dict(params or {}, keywords=list(keywords) + ['.cursor=' + cursor])
+        document = self._make_request(
+            method='GET',
+            path=self._get_resource_path('bundles'),
+            query_params=self._pack_params(params),
+        )
+        return self._unpack_document(document), document.get('meta', {}).get('next_cursor')
+
+    def iter_bundles(self, keywords, params=None):
+        """
+        Generator over the bundles matching the given search keywords, which are fetched a page
+        at a time (see fetch_bundles_page).
+        """
+        cursor = ''
+        while cursor is not None:
+            bundles, cursor = self.fetch_bundles_page(keywords, cursor, params)
+            yield from bundles
+
     @wrap_exception('Unable to netcat {1}')
     def netcat(self, bundle_id, port, data):
         """
@@ -618,7 +649,7 @@ class JsonApiClient(RestClient):
             target.bundle_uuid,
             urllib.parse.quote(target.subpath),
         )
-        headers = {'Accept-Encoding': 'gzip'}
+        headers = {'Accept-Encoding': accept_encoding_header()}
         if range_ is not None:
             headers['Range'] = 'bytes=%d-%d' % range_
         params = {'support_redirect': 1}
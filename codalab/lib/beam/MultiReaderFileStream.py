@@ -1,20 +1,40 @@
-from io import BytesIO
-from threading import Lock
-
-from codalab.worker.un_gzip_stream import BytesBuffer
+from collections import deque
+from io import BytesIO, SEEK_CUR, SEEK_SET
+from threading import Condition
 
 
 class MultiReaderFileStream(BytesIO):
     """
-    FileStream that support multiple readers
+    FileStream that support multiple readers, each of which reads the whole contents of fileobj.
+
+    The readers share a single bounded buffer that holds the bytes between the slowest and the
+    fastest reader. A reader that gets max_buffer_size bytes ahead of the slowest reader blocks
+    until the slowest reader catches up, so memory use stays bounded no matter how large fileobj
+    is. A reader that is done reading must be closed so that it doesn't hold back the others.
+
+    Readers can seek forward, and back by up to lookbehind_size bytes before the position of the
+    slowest reader. The buffer keeps that much more data.
     """
+
     NUM_READERS = 2
+    DEFAULT_MAX_BUFFER_SIZE = 64 * 1024 * 1024
+    READ_CHUNK_SIZE = 1024 * 1024
 
-    def __init__(self, fileobj):
-        self._bufs = [BytesBuffer() for _ in range(0, self.NUM_READERS)]
-        self._pos = [0 for _ in range(0, self.NUM_READERS)]
+    def __init__(self, fileobj, max_buffer_size=DEFAULT_MAX_BUFFER_SIZE, lookbehind_size=0):
         self._fileobj = fileobj
-        self._lock = Lock()  # lock to ensure one does not concurrently read self._fileobj / write to the buffers.
+        self._max_buffer_size = max_buffer_size
+        self._lookbehind_size = lookbehind_size
+        self._chunks = deque()  # type: deque  # (offset in fileobj, bytes) of the buffered data
+        self._end = 0  # offset in fileobj of the end of the buffered data
+        self._eof = False
+        self._filling = False  # whether a reader is currently reading from self._fileobj
+        self._pos = [0 for _ in range(0, self.NUM_READERS)]
+        self._closed = [False for _ in range(0, self.NUM_READERS)]
+        # Condition to ensure one does not concurrently read self._fileobj / modify the buffer,
+        # and to wake up readers waiting for buffer space or data.
+        self._cond = Condition()
+        # Maximum number of bytes held in the buffer at any time
+        self.high_water_mark = 0
 
         class FileStreamReader(BytesIO):
             def __init__(s, index):
@@ -26,32 +46,133 @@ class MultiReaderFileStream(BytesIO):
             def peek(s, num_bytes):
                 return self.peek(s._index, num_bytes)
 
+            def seek(s, offset, whence=SEEK_SET):
+                return self.seek(s._index, offset, whence)
+
+            def tell(s):
+                return self.tell(s._index)
+
+            def close(s):
+                self.close_reader(s._index)
+
         self.readers = [FileStreamReader(i) for i in range(0, self.NUM_READERS)]
 
-    def _fill_buf_bytes(self, index: int, num_bytes=None):
-        with self._lock:
-            while num_bytes is None or len(self._bufs[index]) < num_bytes:
-                s = self._fileobj.read(num_bytes)
+    def _min_pos(self):
+        """Position of the slowest reader that is still reading."""
+        positions = [pos for pos, closed in zip(self._pos, self._closed) if not closed]
+        return min(positions) if positions else self._end
+
+    def _trim(self):
+        """Drop the buffered chunks that every open reader has read past, except for the
+        lookbehind. Must hold self._cond."""
+        min_pos = self._min_pos() - self._lookbehind_size
+        while self._chunks and self._chunks[0][0] + len(self._chunks[0][1]) <= min_pos:
+            self._chunks.popleft()
+        self._cond.notify_all()
+
+    def _fill_buf_bytes(self, end: int):
+        """Read from self._fileobj until the buffer holds the data up to offset end (or EOF).
+        Blocks while the buffer is full, i.e., until the slowest reader makes room.
+        """
+        with self._cond:
+            while not self._eof and self._end < end:
+                space = self._max_buffer_size - (self._end - self._min_pos())
+                if self._filling or space <= 0:
+                    self._cond.wait()
+                    continue
+                self._filling = True
+                self._cond.release()
+                try:
+                    s = self._fileobj.read(min(space, self.READ_CHUNK_SIZE))
+                finally:
+                    self._cond.acquire()
+                    self._filling = False
+                    self._cond.notify_all()
                 if not s:
+                    self._eof = True
                     break
-                for i in range(0, self.NUM_READERS):
-                    self._bufs[i].write(s)
+                self._chunks.append((self._end, s))
+                self._end += len(s)
+                self.high_water_mark = max(self.high_water_mark, self._end - self._chunks[0][0])
+
+    def _copy(self, start: int, end: int):
+        """Return the buffered bytes between offsets start and end. Must hold self._cond."""
+        parts = []
+        for offset, chunk in self._chunks:
+            if offset >= end:
+                break
+            if offset + len(chunk) <= start:
+                continue
+            parts.append(chunk[max(start - offset, 0) : end - offset])
+        return b''.join(parts)
+
+    def _read_at_most(self, index: int, num_bytes: int):
+        self._fill_buf_bytes(self._pos[index] + num_bytes)
+        with self._cond:
+            start = self._pos[index]
+            self._check_buffered(start)
+            s = self._copy(start, min(start + num_bytes, self._end))
+            self._pos[index] += len(s)
+            self._trim()
+        return s
+
+    def _check_buffered(self, pos: int):
+        """Raise if the data at pos was already dropped from the buffer. Must hold self._cond."""
+        buffer_start = self._chunks[0][0] if self._chunks else self._end
+        if pos < buffer_start:
+            raise OSError(
+                "Cannot read at offset %d, which is no longer buffered (buffer starts at %d)"
+                % (pos, buffer_start)
+            )
 
     def read(self, index: int, num_bytes=None):  # type: ignore
         """Read the specified number of bytes from the associated file.
         index: index that specifies which reader is reading.
         """
-        self._fill_buf_bytes(index, num_bytes)
-        if num_bytes is None:
-            num_bytes = len(self._bufs[index])
-        s = self._bufs[index].read(num_bytes)
-        self._pos[index] += len(s)
-        return s
+        parts = []
+        while num_bytes is None or num_bytes > 0:
+            to_read = (
+                self._max_buffer_size
+                if num_bytes is None
+                else min(num_bytes, self._max_buffer_size)
+            )
+            s = self._read_at_most(index, to_read)
+            if not s:
+                break
+            parts.append(s)
+            if num_bytes is not None:
+                num_bytes -= len(s)
+        return b''.join(parts)
 
-    def peek(self, index: int, num_bytes):   # type: ignore
-        self._fill_buf_bytes(index, num_bytes)
-        s = self._bufs[index].peek(num_bytes)
-        return s
+    def peek(self, index: int, num_bytes):  # type: ignore
+        num_bytes = min(num_bytes, self._max_buffer_size)
+        self._fill_buf_bytes(self._pos[index] + num_bytes)
+        with self._cond:
+            start = self._pos[index]
+            self._check_buffered(start)
+            return self._copy(start, min(start + num_bytes, self._end))
+
+    def seek(self, index: int, offset: int, whence=SEEK_SET):  # type: ignore
+        """Move the position of the given reader. The new position is only checked on the next
+        read, so that a reader can seek through positions that are no longer buffered."""
+        with self._cond:
+            if whence == SEEK_SET:
+                self._pos[index] = offset
+            elif whence == SEEK_CUR:
+                self._pos[index] += offset
+            # The size of the stream isn't known until it has been read to the end, so, like the
+            # BytesIO that readers used to be, treat seeking relative to the end as a no-op.
+            self._cond.notify_all()
+            return self._pos[index]
+
+    def tell(self, index: int):  # type: ignore
+        return self._pos[index]
+
+    def close_reader(self, index: int):
+        """Stop reading with the given reader, so that it no longer holds back the other readers."""
+        with self._cond:
+            self._closed[index] = True
+            self._trim()
 
     def close(self):
-        self.__input.close()
+        self._fileobj.close()
@@ -5,9 +5,15 @@ from azure.storage.blob import (
 )
 from apache_beam.io.azure.blobstorageio import parse_azfs_path
 import base64
+import logging
+import time
+from codalab.lib.formatting import size_str
 from codalab.worker.un_gzip_stream import BytesBuffer
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 
+logger = logging.getLogger(__name__)
+
 class BlobStorageUploader(Uploader):
   """An improved version of apache_beam.io.azure.blobstorageio.BlobStorageUploader
   that handles multipart streaming (block-by-block) uploads.
@@ -24,6 +30,11 @@ class BlobStorageUploader(Uploader):
   # Maximum block size is 4000 MiB (https://docs.microsoft.com/en-us/rest/api/storageservices/put-block#remarks).
   # Set MAX_WRITE_SIZE to 50 MiB to prevent first put blob request timeout when uploading (https://github.com/Azure/azure-sdk-for-python/issues/12166)
   MAX_WRITE_SIZE = 50 * 1024 * 1024
+  # Number of blocks staged in parallel.
+  MAX_CONCURRENCY = 8
+  # Maximum number of blocks being staged or waiting to be staged. put() blocks once this many
+  # blocks are pending, so that at most MAX_PENDING_BLOCKS * MAX_WRITE_SIZE bytes are held in memory.
+  MAX_PENDING_BLOCKS = 16
 
   def __init__(self, client, path, mime_type='application/octet-stream'):
     self._client = client
@@ -37,8 +48,10 @@ class BlobStorageUploader(Uploader):
     self.block_number = 1
     self.buffer = BytesBuffer()
     self.block_list = []
-    self.thread_pool = ThreadPoolExecutor(8)
-    self.all_tasks = []
+    self.thread_pool = ThreadPoolExecutor(self.MAX_CONCURRENCY)
+    self.pending_tasks = deque()
+    self.bytes_written = 0
+    self.start_time = time.time()
 
   def put(self, data):
     self.buffer.write(data.tobytes())
@@ -51,13 +64,27 @@ class BlobStorageUploader(Uploader):
   def _write_to_blob(self, data):
     # block_id's have to be base-64 strings normalized to have the same length.
     block_id = base64.b64encode('{0:-32d}'.format(self.block_number).encode()).decode()
+    # Wait for the oldest block if too many are pending. result() raises if staging failed.
+    while len(self.pending_tasks) >= self.MAX_PENDING_BLOCKS:
+      self.pending_tasks.popleft().result()
     # put the blob content to server in parallel, but blob is uncommitted
-    self.all_tasks.append(self.thread_pool.submit(self._blob_to_upload.stage_block, block_id, data))
+    self.pending_tasks.append(self.thread_pool.submit(self._blob_to_upload.stage_block, block_id, data))
     self.block_list.append(BlobBlock(block_id))
     self.block_number = self.block_number + 1
+    self.bytes_written += len(data)
 
   def finish(self):
     # The buffer will have a size smaller than MIN_WRITE_SIZE, so its contents can fit into memory.
     self._write_to_blob(self.buffer.read())
-    self.thread_pool.shutdown(wait=True)
+    try:
+      # Make sure every block was staged before committing the block list.
+      while self.pending_tasks:
+        self.pending_tasks.popleft().result()
+    finally:
+      self.thread_pool.shutdown(wait=True)
     self._blob_to_upload.commit_block_list(self.block_list, content_settings=self._content_settings)
+    elapsed = time.time() - self.start_time
+    logger.info(
+        "Uploaded %s to %s in %d blocks in %.1f seconds (%s/s)",
+        size_str(self.bytes_written), self._path, len(self.block_list), elapsed,
+        size_str(self.bytes_written / max(elapsed, 1e-3)))
@@ -95,6 +95,7 @@ from codalab.lib.completers import (
 )
 from codalab.lib.bundle_store import MultiDiskBundleStore
 from codalab.lib.print_util import FileTransferProgress
+from codalab.worker.compression import codec_for_content_type
 from codalab.worker.un_tar_directory import un_tar_directory
 from codalab.worker.download_util import BundleTarget
 from codalab.worker.bundle_state import State, LinkFormat
@@ -1535,12 +1536,12 @@ class BundleCLI(object):
         )
 
         progress = FileTransferProgress('Received ', f=self.stderr)
-        contents = file_util.tracked(
-            client.fetch_contents_blob(target_info['resolved_target']), progress.update
-        )
+        response = client.fetch_contents_blob(target_info['resolved_target'])
+        contents = file_util.tracked(response, progress.update)
         with progress, closing(contents):
             if target_info['type'] == 'directory':
-                un_tar_directory(contents, final_path, 'gz', force=args.force)
+                codec = codec_for_content_type(response.headers.get('Content-Type'))
+                un_tar_directory(contents, final_path, codec.tar_compression, force=args.force)
             elif target_info['type'] == 'file':
                 with open(final_path, 'wb') as out:
                     shutil.copyfileobj(contents, out)
@@ -1650,14 +1651,14 @@ class BundleCLI(object):
 
         # Collect information about how server should unpack
         filename = nested_dict_get(source_info, 'metadata', 'name')
-        # Zip bundle directory if there is any
+        # Fetch bundle content from source client
+        source_file = source_client.fetch_contents_blob(BundleTarget(source_bundle_uuid, ''))
+        # Directories are sent as compressed archives, which the destination unpacks
         if target_info['type'] == 'directory':
-            filename += '.tar.gz'
+            filename += codec_for_content_type(source_file.headers.get('Content-Type')).archive_ext
             unpack = True
         else:
             unpack = False
-        # Fetch bundle content from source client
-        source_file = source_client.fetch_contents_blob(BundleTarget(source_bundle_uuid, ''))
         # Send file over
         progress = FileTransferProgress('Copied ', f=self.stderr)
         with closing(source_file), progress:
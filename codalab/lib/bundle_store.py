@@ -9,6 +9,7 @@ from codalab.lib import path_util, spec_util
 from codalab.worker.bundle_state import State
 from functools import reduce
 from codalab.common import StorageType, StorageFormat
+from codalab.worker.directory_manifest import MANIFEST_SUFFIX, remove_manifest
 
 
 def require_partitions(f: Callable[['MultiDiskBundleStore', Any], Any]):
@@ -233,6 +234,7 @@ class _MultiDiskBundleStoreBase(BundleStore):
         print("cleanup: data %s" % bundle_location, file=sys.stderr)
         if dry_run:
             return False
+        remove_manifest(bundle_location)
         return path_util.remove(bundle_location)
 
     def health_check(self, model, force=False):
@@ -305,6 +307,8 @@ class _MultiDiskBundleStoreBase(BundleStore):
                 ends_with_ext = (
                     path.endswith('.cid') or path.endswith('.status') or path.endswith('.sh')
                 )
+                if path.endswith(MANIFEST_SUFFIX):
+                    continue
                 if bundle.state in [State.READY, State.FAILED]:
                     if ends_with_ext:
                         to_delete += [path]
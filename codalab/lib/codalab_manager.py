@@ -367,6 +367,7 @@ class CodaLabManager(object):
 
             model = MySQLModel(
                 engine_url=self.config['server']['engine_url'],
+                replica_engine_url=self.config['server'].get('replica_engine_url'),
                 default_user_info=self.default_user_info(),
                 root_user_id=self.root_user_id(),
                 system_user_id=self.system_user_id(),
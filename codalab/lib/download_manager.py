@@ -11,6 +11,7 @@ from codalab.common import (
 )
 from codalab.worker import download_util
 from codalab.worker.bundle_state import State
+from codalab.worker.compression import GZIP
 from codalab.worker.un_gzip_stream import un_gzip_stream
 
 logger = logging.getLogger(__name__)
@@ -156,6 +157,39 @@ class DownloadManager(object):
             finally:
                 self._worker_model.deallocate_socket(response_socket_id)
 
+    def stream_tarred_compressed_directory(self, target, codec):
+        """
+        Returns a file-like object containing a tarred archive of the given
+        directory, along with the codec it is compressed with. That is the given
+        codec if the directory is in a bundle on local disk, and gzip otherwise,
+        since bundles on blob storage are stored gzipped and workers send
+        directories gzipped.
+        """
+        if codec is not GZIP and self._bundle_model.get_bundle_state(target.bundle_uuid) not in (
+            State.PREPARING,
+            State.RUNNING,
+        ):
+            directory_path = self._get_target_path(target)
+            if not parse_linked_bundle_url(directory_path).uses_beam:
+                return self.file_util.tar_compress_directory(directory_path, codec), codec
+        return self.stream_tarred_gzipped_directory(target), GZIP
+
+    def stream_tarred_directory(self, target):
+        """
+        Returns a file-like object containing an uncompressed tarred archive of
+        the given directory and the size of the archive, or None if the
+        directory isn't in a bundle in a final state on local disk. Only then
+        are its contents known not to change, so that the size of the archive
+        can be computed before it is generated.
+        """
+        if self._bundle_model.get_bundle_state(target.bundle_uuid) not in State.FINAL_STATES:
+            return None
+        directory_path = self._get_target_path(target)
+        if parse_linked_bundle_url(directory_path).uses_beam:
+            return None
+        stream = self.file_util.tar_directory(directory_path)
+        return stream, stream.compute_size()
+
     @retry_if_no_longer_running
     def stream_tarred_gzipped_directory(self, target):
         """
@@ -195,6 +229,32 @@ class DownloadManager(object):
                 self._worker_model.deallocate_socket(response_socket_id)
                 raise
 
+    def get_local_file_path(self, target):
+        """
+        Returns the path of the given file target if it is a regular file on the local disk
+        that can be sent as it is, without going through Python, or None otherwise. Files on
+        blob storage and in bundles that are still being prepared or running are not.
+        """
+        if self._bundle_model.get_bundle_state(target.bundle_uuid) in (
+            State.PREPARING,
+            State.RUNNING,
+        ):
+            return None
+        file_path = self._get_target_path(target)
+        if parse_linked_bundle_url(file_path).uses_beam or not os.path.isfile(file_path):
+            return None
+        return file_path
+
+    def gzipping_requires_recompression(self, target):
+        """
+        Returns whether gzipping the given file target means decompressing it from a
+        gzipped archive on blob storage and compressing it again. That is the case for
+        files within directory bundles on blob storage; single-file bundles on blob
+        storage are stored gzipped and are passed through as they are.
+        """
+        linked_bundle_path = parse_linked_bundle_url(self._get_target_path(target))
+        return linked_bundle_path.uses_beam and linked_bundle_path.is_archive_dir
+
     @retry_if_no_longer_running
     def stream_file(self, target, gzipped):
         """
@@ -397,6 +457,41 @@ class DownloadManager(object):
             return fileobj.read()
 
 
+class FileSection(object):
+    """
+    A section of a file on local disk, as a response body.
+
+    The underlying file is positioned at the start of the section, and fileno() returns its
+    descriptor. This lets a WSGI server with a sendfile-capable wsgi.file_wrapper, like
+    gunicorn, send the section straight from the page cache to the socket with os.sendfile
+    (it sends Content-Length bytes from the current offset, so the response must have a
+    Content-Length of len(section)). Other servers read() it, which stops at the end of the
+    section.
+    """
+
+    def __init__(self, path, offset=0, length=None):
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        offset = min(offset, size)
+        # Number of bytes in the section.
+        self.length = size - offset if length is None else max(0, min(length, size - offset))
+        self._remaining = self.length
+        self._file.seek(offset)
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, num_bytes=None):
+        if num_bytes is None or num_bytes < 0 or num_bytes > self._remaining:
+            num_bytes = self._remaining
+        data = self._file.read(num_bytes)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
 class Deallocating(object):
     """
     Deallocates the socket when closed.
@@ -1,6 +1,8 @@
+import logging
 import os
 import shutil
 import tempfile
+import time
 
 from apache_beam.io.filesystem import CompressionTypes
 from apache_beam.io.filesystems import FileSystems
@@ -8,8 +10,8 @@ from typing import Any, Dict, Union, Tuple, IO, cast
 from codalab.lib.beam.SQLiteIndexedTar import SQLiteIndexedTar  # type: ignore
 from codalab.lib.beam.MultiReaderFileStream import MultiReaderFileStream
 from contextlib import closing
-from codalab.worker.upload_util import upload_with_chunked_encoding
-from threading import Thread
+from codalab.worker.upload_util import DiskUsageReporter, upload_with_chunked_encoding
+from threading import Event, Thread
 
 from codalab.common import (
     StorageURLScheme,
@@ -21,10 +23,26 @@ from codalab.common import (
 from codalab.worker.file_util import tar_gzip_directory, GzipStream, update_file_size
 from codalab.worker.bundle_state import State
 from codalab.lib import file_util, path_util, zip_util
+from codalab.lib.formatting import size_str
 from codalab.objects.bundle import Bundle
 from codalab.lib.zip_util import ARCHIVE_EXTS_DIR
 from codalab.lib.print_util import FileTransferProgress
 
+logger = logging.getLogger(__name__)
+
+# Spacing of the gzip seek points stored in bundle indexes. Reads of a file inside an archive
+# start inflating at the seek point before the file instead of at the start of the archive.
+# Each seek point stores 32 KiB of uncompressed data, so the points take up about 0.8% of the
+# uncompressed size.
+GZIP_SEEK_POINT_SPACING = 4 * 1024 * 1024
+# While creating seek points, indexed_gzip reads ahead in chunks of 4 * spacing and seeks back
+# to its last seek point to continue inflating, so the indexer must be able to seek back by that
+# much in the upload stream.
+INDEX_READER_LOOKBEHIND_SIZE = 6 * GZIP_SEEK_POINT_SPACING
+# Number of threads used to create bundle indexes: the TAR headers are parsed in one thread while
+# the other inserts the resulting rows into the index database.
+INDEX_PARALLELIZATION = 2
+
 Source = Union[str, Tuple[str, IO[bytes]]]
 
 
@@ -216,7 +234,15 @@ class DiskStorageUploader(Uploader):
 
 
 class BlobStorageUploader(Uploader):
-    """Uploader that uploads to archive files + index files on Blob Storage."""
+    """Uploader that uploads to archive files + index files on Blob Storage.
+
+    Archive contents are written in CHUNK_SIZE pieces. On Azure, the writer returned by
+    FileSystems.create buffers them into large blocks, stages the blocks in parallel and
+    commits the block list at the end (see codalab.lib.beam.blobstorageuploader).
+    """
+
+    # Size of the pieces read from the archive stream and written to Blob Storage.
+    CHUNK_SIZE = 4 * 1024 * 1024
 
     @property
     def storage_type(self):
@@ -246,7 +272,9 @@ class BlobStorageUploader(Uploader):
         else:
             output_fileobj = GzipStream(source_fileobj)
 
-        stream_file = MultiReaderFileStream(output_fileobj)
+        stream_file = MultiReaderFileStream(
+            output_fileobj, lookbehind_size=INDEX_READER_LOOKBEHIND_SIZE
+        )
         file_reader = stream_file.readers[0]
         index_reader = stream_file.readers[1]
 
@@ -255,58 +283,103 @@ class BlobStorageUploader(Uploader):
             conn_str = os.environ.get('AZURE_STORAGE_CONNECTION_STRING', '')
             os.environ['AZURE_STORAGE_CONNECTION_STRING'] = bundle_conn_str
         try:
-            CHUNK_SIZE = 16 * 1024
+            CHUNK_SIZE = self.CHUNK_SIZE
+            upload_errors = []
+            # Seconds taken by each stage of the upload pipeline, for logging.
+            stage_seconds: Dict[str, float] = {}
+            start_time = time.time()
+            # Set once the archive writer is open. The index upload switches the connection string
+            # used to open blobs, so it must not start before then.
+            archive_writer_opened = Event()
 
             def upload_file_content():
-                iteration = 0
-                ITERATIONS_PER_DISK_CHECK = 2000
+                try:
+                    _upload_file_content()
+                except Exception as e:
+                    upload_errors.append(e)
+                finally:
+                    archive_writer_opened.set()
+                    # Don't hold back the index reader if the upload stops early.
+                    file_reader.close()
+                    stage_seconds['archive upload'] = time.time() - start_time
+
+            def _upload_file_content():
                 bytes_uploaded = 0
+                start_time = time.time()
+                # Update disk and check if client has gone over disk usage, without blocking the upload.
+                disk_usage_reporter = (
+                    DiskUsageReporter(self._client, bundle_uuid) if self._client else None
+                )
 
                 with FileSystems.create(
                     bundle_path, compression_type=CompressionTypes.UNCOMPRESSED
                 ) as out:
+                    archive_writer_opened.set()
                     while True:
-                        iteration += 1
                         to_send = file_reader.read(CHUNK_SIZE)
                         if not to_send:
                             break
                         out.write(to_send)
 
-                        # Update disk and check if client has gone over disk usage.
-                        if self._client and iteration % ITERATIONS_PER_DISK_CHECK == 0:
-                            self._client.update(
-                                'user/increment_disk_used',
-                                {'disk_used_increment': len(to_send), 'bundle_uuid': bundle_uuid},
-                            )
-                            user_info = self._client.fetch('user')
-                            if user_info['disk_used'] >= user_info['disk_quota']:
-                                raise Exception(
-                                    'Upload aborted. User disk quota exceeded. '
-                                    'To apply for more quota, please visit the following link: '
-                                    'https://codalab-worksheets.readthedocs.io/en/latest/FAQ/'
-                                    '#how-do-i-request-more-disk-quota-or-time-quota'
-                                )
+                        if disk_usage_reporter:
+                            disk_usage_reporter.add(len(to_send))
 
                         bytes_uploaded += len(to_send)
                         if progress_callback is not None:
                             should_resume = progress_callback(bytes_uploaded)
                             if not should_resume:
                                 raise Exception('Upload aborted by client')
+                    if disk_usage_reporter:
+                        disk_usage_reporter.finish()
+
+                elapsed = time.time() - start_time
+                logger.info(
+                    "Uploaded %s to %s in %.1f seconds (%s/s)",
+                    size_str(bytes_uploaded),
+                    bundle_path,
+                    elapsed,
+                    size_str(bytes_uploaded / max(elapsed, 1e-3)),
+                )
 
             # temporary file that used to store index file
             tmp_index_file = tempfile.NamedTemporaryFile(suffix=".sqlite")
 
             def create_index():
                 is_dir = parse_linked_bundle_url(bundle_path).is_archive_dir
-                SQLiteIndexedTar(
-                    fileObject=index_reader,
-                    tarFileName="contents.tar.gz"
-                    if is_dir
-                    else "contents.gz",  # If saving a single file as a .gz archive, this file can be accessed by the "/contents" entry in the index.
-                    writeIndex=True,
-                    clearIndexCache=True,
-                    indexFilePath=tmp_index_file.name,
-                )
+                try:
+                    indexed_tar = SQLiteIndexedTar(
+                        fileObject=index_reader,
+                        tarFileName="contents.tar.gz"
+                        if is_dir
+                        else "contents.gz",  # If saving a single file as a .gz archive, this file can be accessed by the "/contents" entry in the index.
+                        writeIndex=True,
+                        clearIndexCache=True,
+                        indexFilePath=tmp_index_file.name,
+                        gzipSeekPointSpacing=GZIP_SEEK_POINT_SPACING,
+                        parallelization=INDEX_PARALLELIZATION,
+                    )
+                    logger.info(
+                        "Indexed %s at %.0f entries/s",
+                        bundle_path,
+                        indexed_tar.indexingEntriesPerSecond,
+                    )
+                finally:
+                    # Indexing may not read the archive to its very end; don't hold back the upload.
+                    index_reader.close()
+                    stage_seconds['indexing'] = time.time() - start_time
+
+            def create_and_upload_index():
+                # The index is complete as soon as the indexer has read the whole archive, which is
+                # usually before the archive upload has finished, so upload it while the tail of
+                # the archive is still being uploaded.
+                try:
+                    create_index()
+                    archive_writer_opened.wait()
+                    index_upload_start_time = time.time()
+                    upload_index()
+                    stage_seconds['index upload'] = time.time() - index_upload_start_time
+                except Exception as e:
+                    upload_errors.append(e)
 
             def upload_index():
                 if bundle_conn_str is not None:
@@ -315,12 +388,9 @@ class BlobStorageUploader(Uploader):
                     parse_linked_bundle_url(bundle_path).index_path,
                     compression_type=CompressionTypes.UNCOMPRESSED,
                 ) as out_index_file, open(tmp_index_file.name, "rb") as tif:
-                    while True:
-                        to_send = tif.read(CHUNK_SIZE)
-                        if not to_send:
-                            break
-                        out_index_file.write(to_send)
+                    shutil.copyfileobj(tif, out_index_file, CHUNK_SIZE)
 
+            def update_indexed_file_size():
                 # call API to update the indexed file size
 
                 if not parse_linked_bundle_url(bundle_path).is_archive_dir and hasattr(
@@ -344,15 +414,32 @@ class BlobStorageUploader(Uploader):
                             f"Skip update this type of data. The bundle path is: {bundle_path}. Exception: {repr(e)}"
                         )
 
-            threads = [Thread(target=upload_file_content), Thread(target=create_index)]
+            threads = [
+                Thread(target=upload_file_content),
+                Thread(target=create_and_upload_index),
+            ]
 
             for thread in threads:
                 thread.start()
 
             for thread in threads:
                 thread.join()
-
-            upload_index()
+            logger.debug(
+                "Upload of %s buffered at most %d bytes in memory",
+                bundle_path,
+                stream_file.high_water_mark,
+            )
+            if upload_errors:
+                raise upload_errors[0]
+
+            # The size of a single file is only known once the whole archive has been read.
+            update_indexed_file_size()
+            logger.info(
+                "Upload of %s finished in %.1f seconds (%s)",
+                bundle_path,
+                time.time() - start_time,
+                ', '.join('%s: %.1fs' % stage for stage in stage_seconds.items()),
+            )
 
         except Exception as err:
             raise err
@@ -426,9 +513,7 @@ class UploadManager(object):
     def cleanup_existing_contents(self, bundle):
         bundle_location = self._bundle_store.get_bundle_location(bundle.uuid)
         self._bundle_store.cleanup(bundle_location, dry_run=False)
-        bundle_update = {'metadata': {'data_size': 0}}
-        self._bundle_model.update_bundle(bundle, bundle_update)
-        self._bundle_model.update_user_disk_used(bundle.owner_id)
+        self._bundle_model.update_bundle_data_size(bundle, 0)
 
     def get_bundle_sas_token(self, path, **kwargs):
         """
@@ -640,33 +725,43 @@ class ClientUploadManager(object):
         else:
             output_fileobj = GzipStream(fileobj)
 
-        stream_file = MultiReaderFileStream(output_fileobj)
+        stream_file = MultiReaderFileStream(
+            output_fileobj, lookbehind_size=INDEX_READER_LOOKBEHIND_SIZE
+        )
         file_reader = stream_file.readers[0]
         index_reader = stream_file.readers[1]
 
         def upload_file_content():
             # Write archive file.
-            upload_with_chunked_encoding(
-                method='PUT',
-                base_url=bundle_conn_str,
-                headers={'Content-type': 'application/octet-stream'},
-                fileobj=file_reader,
-                query_params={},
-                progress_callback=None,
-                bundle_uuid=bundle_uuid,
-                json_api_client=self._client,
-            )
+            try:
+                upload_with_chunked_encoding(
+                    method='PUT',
+                    base_url=bundle_conn_str,
+                    headers={'Content-type': 'application/octet-stream'},
+                    fileobj=file_reader,
+                    query_params={},
+                    progress_callback=None,
+                    bundle_uuid=bundle_uuid,
+                    json_api_client=self._client,
+                )
+            finally:
+                file_reader.close()
 
         def create_upload_index():
             # upload the index file
             with tempfile.NamedTemporaryFile(suffix=".sqlite") as tmp_index_file:
-                SQLiteIndexedTar(
-                    fileObject=index_reader,
-                    tarFileName="contents",
-                    writeIndex=True,
-                    clearIndexCache=True,
-                    indexFilePath=tmp_index_file.name,
-                )
+                try:
+                    SQLiteIndexedTar(
+                        fileObject=index_reader,
+                        tarFileName="contents",
+                        writeIndex=True,
+                        clearIndexCache=True,
+                        indexFilePath=tmp_index_file.name,
+                        gzipSeekPointSpacing=GZIP_SEEK_POINT_SPACING,
+                        parallelization=INDEX_PARALLELIZATION,
+                    )
+                finally:
+                    index_reader.close()
                 upload_with_chunked_encoding(
                     method='PUT',
                     base_url=index_conn_str,
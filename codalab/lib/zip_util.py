@@ -18,13 +18,13 @@ from codalab.worker.file_util import (
     unzip_directory,
     GzipStream,
 )
-from codalab.worker.un_gzip_stream import un_gzip_stream, UnBz2Stream, ZipToTarStream
+from codalab.worker.un_gzip_stream import un_gzip_stream, UnBz2Stream, UnZstdStream, ZipToTarStream
 from codalab.worker.un_tar_directory import un_tar_directory
 
 
 # Files with these extensions are considered archive.
-ARCHIVE_EXTS = ['.tar.gz', '.tgz', '.tar.bz2', '.zip', '.gz', '.bz2']
-ARCHIVE_EXTS_DIR = ['.tar.gz', '.tgz', '.tar.bz2', '.zip']
+ARCHIVE_EXTS = ['.tar.gz', '.tgz', '.tar.bz2', '.tar.zst', '.zip', '.gz', '.bz2']
+ARCHIVE_EXTS_DIR = ['.tar.gz', '.tgz', '.tar.bz2', '.tar.zst', '.zip']
 
 
 def path_is_archive(path):
@@ -65,6 +65,8 @@ def unpack(ext: str, source: IO[bytes], dest_path: str):
             un_tar_directory(source, dest_path, 'gz')
         elif ext == '.tar.bz2':
             un_tar_directory(source, dest_path, 'bz2')
+        elif ext == '.tar.zst':
+            un_tar_directory(source, dest_path, 'zst')
         elif ext == '.bz2':
             un_bz2_file(source, dest_path)
         elif ext == '.gz':
@@ -97,6 +99,9 @@ def unpack_to_archive(ext: str, source: IO[bytes]) -> IO[bytes]:
             return source
         elif ext == '.tar.bz2':
             return GzipStream(UnBz2Stream(source))
+        elif ext == '.tar.zst':
+            # Bundles are stored as .tar.gz, which their index and seek points rely on.
+            return GzipStream(UnZstdStream(source))
         elif ext == '.bz2':
             return GzipStream(UnBz2Stream(source))
         elif ext == '.gz':
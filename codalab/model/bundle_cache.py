@@ -0,0 +1,161 @@
+"""
+Second-level cache of bundles in final states.
+
+Once a bundle is ready, failed or killed, its row, dependencies and most of its metadata don't
+change anymore, but they are read over and over (to resolve dependencies, serve bundle info and
+contents, render worksheets, ...). BundleModel keeps what it reads for such bundles in a
+BundleCache, and drops them from it whenever they are updated or deleted.
+
+Two backends are available:
+- LRUBundleCacheBackend (the default), which keeps entries in the memory of the process. Bundles
+  updated or deleted by other processes are only dropped from it by the process that updates
+  them, so its entries expire after CODALAB_BUNDLE_CACHE_TTL_SECONDS (5 by default) to bound how
+  long they can be stale. Servers that run several processes should use Redis instead.
+- RedisBundleCacheBackend, which is shared by all processes that use the same server (at
+  CODALAB_BUNDLE_CACHE_URL), so invalidations are seen by all of them. It works with any client
+  that has the mget, set and delete methods of redis.Redis, so a memcached or in-memory stand-in
+  can take the place of Redis.
+"""
+import collections
+import copy
+import logging
+import os
+import pickle
+import threading
+import time
+
+try:
+    import redis  # type: ignore
+except ImportError:
+    redis = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 10000
+# Entries of the in-process cache are only invalidated by the process that updates the bundle, so
+# they can't live long without other processes serving stale bundles.
+DEFAULT_LRU_TTL_SECONDS = 5
+DEFAULT_REDIS_TTL_SECONDS = 60
+
+
+class LRUBundleCacheBackend(object):
+    """Keeps the most recently used entries in memory, for at most ttl_seconds each."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_LRU_TTL_SECONDS):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        # Maps key to (expiration time, value), from least to most recently used.
+        self._entries = collections.OrderedDict()  # type: collections.OrderedDict
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        result = {}
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                result[key] = entry[1]
+        # Callers may modify what they are returned, so they each get their own copy.
+        return copy.deepcopy(result)
+
+    def set_many(self, mapping):
+        expiration = time.time() + self._ttl_seconds
+        mapping = copy.deepcopy(mapping)
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = (expiration, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class RedisBundleCacheBackend(object):
+    """Keeps entries in a Redis server (or anything with the same get/set/delete interface),
+    which is shared by all processes."""
+
+    def __init__(self, client, ttl_seconds=None):
+        self._client = client
+        self._ttl_seconds = ttl_seconds
+
+    @classmethod
+    def from_url(cls, url, ttl_seconds=None):
+        if redis is None:
+            raise ImportError('The redis package is needed to use a bundle cache at %s' % url)
+        return cls(redis.Redis.from_url(url), ttl_seconds)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self._client.mget(keys)
+        return {key: pickle.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, mapping):
+        for key, value in mapping.items():
+            self._client.set(key, pickle.dumps(value), ex=self._ttl_seconds)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if keys:
+            self._client.delete(*keys)
+
+
+class BundleCache(object):
+    """
+    Cache of the values that BundleModel reads for bundles, keyed by uuid. Errors of the backend
+    are logged and otherwise ignored, so that the cache is never worse than not having one.
+    """
+
+    KEY_PREFIX = 'codalab:bundle:'
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_many(self, uuids):
+        """Returns {uuid: value} for the given uuids that are cached."""
+        try:
+            values = self.backend.get_many([self.KEY_PREFIX + uuid for uuid in uuids])
+        except Exception:
+            logger.exception('Could not read from the bundle cache')
+            return {}
+        return {key[len(self.KEY_PREFIX) :]: value for key, value in values.items()}
+
+    def set_many(self, values):
+        """Caches the given {uuid: value}."""
+        if not values:
+            return
+        try:
+            self.backend.set_many({self.KEY_PREFIX + uuid: value for uuid, value in values.items()})
+        except Exception:
+            logger.exception('Could not write to the bundle cache')
+
+    def invalidate(self, uuids):
+        """Drops the given uuids from the cache."""
+        try:
+            self.backend.delete_many([self.KEY_PREFIX + uuid for uuid in uuids])
+        except Exception:
+            logger.exception('Could not invalidate %s in the bundle cache', uuids)
+
+
+def get_default_bundle_cache():
+    """Returns the bundle cache configured by the CODALAB_BUNDLE_CACHE_* environment variables."""
+    ttl = os.environ.get('CODALAB_BUNDLE_CACHE_TTL_SECONDS')
+    url = os.environ.get('CODALAB_BUNDLE_CACHE_URL')
+    if url:
+        return BundleCache(
+            RedisBundleCacheBackend.from_url(url, int(ttl or DEFAULT_REDIS_TTL_SECONDS))
+        )
+    ttl_seconds = int(ttl or DEFAULT_LRU_TTL_SECONDS)
+    max_entries = int(os.environ.get('CODALAB_BUNDLE_CACHE_SIZE', DEFAULT_MAX_ENTRIES))
+    return BundleCache(LRUBundleCacheBackend(max_entries, ttl_seconds))
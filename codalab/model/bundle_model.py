@@ -2,8 +2,11 @@
 BundleModel is a wrapper around database calls to save and load bundle metadata.
 """
 
+import base64
 import collections
+import contextlib
 import datetime
+import hashlib
 import os
 import re
 import time
@@ -13,9 +16,10 @@ import json
 from dataclasses import dataclass
 from dateutil import parser
 from uuid import uuid4
-from sqlalchemy import and_, or_, select, union, desc, func, Table
-from sqlalchemy.sql.expression import literal, true
+from sqlalchemy import and_, or_, select, union, desc, exc, func, bindparam, Table
+from sqlalchemy.sql.expression import column, literal, literal_column, table, true
 from sqlalchemy.orm import aliased
+from sqlalchemy.types import Text
 
 from codalab.bundles import get_bundle_subclass
 from codalab.bundles.run_bundle import RunBundle
@@ -27,11 +31,16 @@ from codalab.common import (
     PermissionError,
 )
 from codalab.lib import crypt_util, spec_util, worksheet_util, path_util
+from codalab.model.bundle_cache import get_default_bundle_cache
+from codalab.model.engine_router import EngineRouter, read_only
+from codalab.model.request_cache import RequestCache, request_cached
 from codalab.model.util import LikeQuery
+from codalab.worker.directory_manifest import DirectoryManifest
 from codalab.model.tables import (
     bundle as cl_bundle,
     bundle_dependency as cl_bundle_dependency,
     bundle_metadata as cl_bundle_metadata,
+    bundle_search as cl_bundle_search,
     bundle_store as cl_bundle_store,
     bundle_location as cl_bundle_location,
     group as cl_group,
@@ -55,7 +64,7 @@ from codalab.model.tables import (
     worker_run as cl_worker_run,
     db_metadata,
 )
-from codalab.objects.worksheet import item_sort_key, Worksheet
+from codalab.objects.worksheet import item_sort_key, SORT_KEY_GAP, Worksheet
 from codalab.objects.oauth2 import OAuth2AuthCode, OAuth2Client, OAuth2Token
 from codalab.objects.user import User
 from codalab.objects.dependency import Dependency
@@ -68,6 +77,14 @@ logger = logging.getLogger(__name__)
 
 SEARCH_KEYWORD_REGEX = re.compile('^([\.\w/]*)=(.*)$')
 SEARCH_RESULTS_LIMIT = 10
+# Number of bundles fetched at once by iter_bundles.
+ITER_BUNDLES_CHUNK_SIZE = 1000
+# Length of the tokens of MySQL's ngram full-text parser (its ngram_token_size).
+NGRAM_TOKEN_SIZE = 2
+# Maximum number of uuids in the IN clause of a query that walks bundle dependencies.
+DEPENDENCY_QUERY_BATCH_SIZE = 10000
+# Metadata keys that have typed columns in the bundle_search table.
+SEARCH_METADATA_KEYS = ('name', 'data_size', 'created', 'time', 'request_queue', 'staged_status')
 EDU_USER_REGEXES = re.compile('@[\w\.-]+\.(edu|edu\.[a-z]{2}|ac\.[a-z]{2})$')
 
 
@@ -90,6 +107,51 @@ def is_academic_email(email):
     return len(email_suffix) > 0
 
 
+def get_memo_key(owner_id, command, dependencies):
+    """
+    Returns the key that identifies run bundles with the given owner, command and dependencies,
+    which are (child_path, parent_uuid) pairs, when looking for bundles to reuse with
+    cl run --memo. It is the same however the dependencies are ordered.
+    """
+    value = json.dumps([owner_id, command, sorted([list(dep) for dep in dependencies])])
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def get_bundle_memo_key(bundle):
+    """Returns the memo key of the given bundle, or None if it has no command."""
+    if bundle.command is None:
+        return None
+    return get_memo_key(
+        bundle.owner_id,
+        bundle.command,
+        [(dep.child_path, dep.parent_uuid) for dep in bundle.dependencies],
+    )
+
+
+def encode_search_cursor(sort_value, id):
+    """Returns the cursor of a search_bundles page that ends with the bundle with the given
+    value of the sort key and id."""
+    return base64.urlsafe_b64encode(json.dumps([sort_value, id]).encode()).decode()
+
+
+def decode_search_cursor(cursor):
+    """Returns the (sort_value, id) of the given search_bundles cursor."""
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        value = None
+    if (
+        not isinstance(value, list)
+        or len(value) != 2
+        or isinstance(value[0], (list, dict))
+        or not isinstance(value[1], int)
+        or isinstance(value[1], bool)
+    ):
+        raise UsageError('Invalid search cursor: %s' % cursor)
+    sort_value, id = value
+    return sort_value, id
+
+
 @dataclass
 class Join:
     """
@@ -104,17 +166,29 @@ class Join:
 
 
 class BundleModel(object):
-    def __init__(self, engine, default_user_info, root_user_id, system_user_id):
+    def __init__(
+        self, engine, default_user_info, root_user_id, system_user_id, replica_engine=None
+    ):
         """
-        Initialize a BundleModel with the given SQLAlchemy engine.
+        Initialize a BundleModel with the given SQLAlchemy engine, and optionally with an engine
+        for a read replica of its database (see EngineRouter).
         """
-        self.engine = engine
+        self.engine_router = EngineRouter(engine, replica_engine)
+        self.request_cache = RequestCache(
+            *[engine for engine in (engine, replica_engine) if engine is not None]
+        )
+        self.bundle_cache = get_default_bundle_cache()
         self.default_user_info = default_user_info
         self.root_user_id = root_user_id
         self.system_user_id = system_user_id
         self.public_group_uuid = ''
         self.create_tables()
 
+    @property
+    def engine(self):
+        """The engine that queries of the current thread run on."""
+        return self.engine_router.engine
+
     # ==========================================================================
     # Database helper methods
     # ==========================================================================
@@ -203,6 +277,8 @@ class BundleModel(object):
     # Bundle info accessor methods
     # ==========================================================================
 
+    @read_only
+    @request_cached
     def get_bundle(self, uuid):
         """
         Retrieve a bundle from the database given its uuid.
@@ -222,6 +298,8 @@ class BundleModel(object):
         """
         return self.get_bundle_metadata(uuids, "name")
 
+    @read_only
+    @request_cached
     def get_bundle_metadata(self, uuids, metadata_key):
         """
         Fetch a single metadata value from the bundles referenced
@@ -242,6 +320,34 @@ class BundleModel(object):
             rows = connection.execute(query).fetchall()
             return dict((row.bundle_uuid, row.metadata_value) for row in rows)
 
+    def get_staged_docker_images(self, max_images):
+        """
+        Fetch the Docker images requested by staged bundles, most requested first.
+        Bundles that use the default image are not counted.
+        Return [docker_image, ...] with at most max_images entries.
+        """
+        count = func.count(cl_bundle_metadata.c.bundle_uuid).label('count')
+        with self.engine.begin() as connection:
+            rows = connection.execute(
+                select([cl_bundle_metadata.c.metadata_value, count])
+                .select_from(
+                    cl_bundle_metadata.join(
+                        cl_bundle, cl_bundle.c.uuid == cl_bundle_metadata.c.bundle_uuid
+                    )
+                )
+                .where(
+                    and_(
+                        cl_bundle.c.state == State.STAGED,
+                        cl_bundle_metadata.c.metadata_key == 'request_docker_image',
+                        cl_bundle_metadata.c.metadata_value != '',
+                    )
+                )
+                .group_by(cl_bundle_metadata.c.metadata_value)
+                .order_by(desc(count))
+                .limit(max_images)
+            ).fetchall()
+        return [row.metadata_value for row in rows]
+
     def get_owner_ids(self, table, uuids):
         """
         Fetch the owners of the given uuids (for either bundles or worksheets).
@@ -255,6 +361,7 @@ class BundleModel(object):
             ).fetchall()
             return dict((row.uuid, row.owner_id) for row in rows)
 
+    @request_cached
     def get_bundle_owner_ids(self, uuids):
         return self.get_owner_ids(cl_bundle, uuids)
 
@@ -287,6 +394,7 @@ class BundleModel(object):
                 'socket_id': worker_row.socket_id,
             }
 
+    @read_only
     def get_children_uuids(self, uuids):
         """
         Get all bundles that depend on the bundle with the given uuids.
@@ -303,6 +411,7 @@ class BundleModel(object):
             result[row.parent_uuid].append(row.child_uuid)
         return result
 
+    @read_only
     def get_host_worksheet_uuids(self, bundle_uuids, max_worksheets):
         """
         Get up to n host_worksheet uuids per bundle uuid. n of 0 will return an empty dictionary.
@@ -332,6 +441,7 @@ class BundleModel(object):
             ).fetchall()
         return dict((row.bundle_uuid, row.worksheet_uuids.split(',')) for row in rows)
 
+    @read_only
     def get_all_host_worksheet_uuids(self, bundle_uuids):
         """
         Return list of all worksheet uuids that contain the given bundle_uuids.
@@ -352,27 +462,116 @@ class BundleModel(object):
             result[uuid] = list(set(result[uuid]))
         return result
 
+    @read_only
     def get_self_and_descendants(self, uuids, depth):
         """
         Get all bundles that depend on bundles with the given uuids.
         depth = 1 gets only children
         """
-        frontier = uuids
-        visited = list(frontier)
-        while len(frontier) > 0 and depth > 0:
-            # Get children of all nodes in frontier
-            result = self.get_children_uuids(frontier)
-            new_frontier = []
-            for v in result.values():
-                for uuid in v:
-                    if uuid in visited:
-                        continue
-                    new_frontier.append(uuid)
-                    visited.append(uuid)
-            frontier = new_frontier
-            depth -= 1
-        return visited
+        return list(uuids) + self.get_descendants(uuids, depth)
+
+    @read_only
+    def get_descendants(self, uuids, depth=None):
+        """
+        Returns the uuids of the bundles that depend on the bundles with the given uuids, directly
+        or indirectly, down to the given depth (1 gets only children, None has no limit).
+        They don't include the given uuids, and are ordered by depth and then uuid (only by uuid
+        if there is no limit).
+        """
+        return self._get_dependency_closure(
+            uuids, depth, cl_bundle_dependency.c.parent_uuid, cl_bundle_dependency.c.child_uuid
+        )
+
+    @read_only
+    def get_ancestors(self, uuids, depth=None):
+        """
+        Returns the uuids of the bundles that the bundles with the given uuids depend on,
+        directly or indirectly, up to the given depth (1 gets only parents, None has no limit).
+        They don't include the given uuids, and are ordered like in get_descendants.
+        """
+        return self._get_dependency_closure(
+            uuids, depth, cl_bundle_dependency.c.child_uuid, cl_bundle_dependency.c.parent_uuid
+        )
 
+    def _get_dependency_closure(self, uuids, depth, from_column, to_column):
+        """
+        Follows bundle dependencies from from_column to to_column, starting from the given uuids.
+        This is done with a single recursive query where the database supports it, and
+        otherwise with one query per level.
+        """
+        if not uuids or (depth is not None and depth <= 0):
+            return []
+        depths = None
+        if self._supports_recursive_queries():
+            try:
+                depths = self._get_dependency_depths_recursive(uuids, depth, from_column, to_column)
+            except exc.OperationalError as e:
+                # For example, MySQL limits the number of levels to cte_max_recursion_depth.
+                logger.warning("Falling back to walking dependencies level by level: %s", e)
+        if depths is None:
+            depths = self._get_dependency_depths_iterative(uuids, depth, from_column, to_column)
+        for uuid in uuids:
+            depths.pop(uuid, None)
+        return sorted(depths, key=lambda uuid: (depths[uuid], uuid))
+
+    def _supports_recursive_queries(self):
+        """Returns whether the database supports WITH RECURSIVE (MySQL 8, SQLite 3.8.3)."""
+        dialect = self.engine.dialect
+        if dialect.name == 'mysql':
+            return dialect.server_version_info is not None and dialect.server_version_info >= (8,)
+        return dialect.name == 'sqlite'
+
+    def _get_dependency_depths_recursive(self, uuids, depth, from_column, to_column):
+        """
+        Returns {uuid: depth} of the bundles reached from the given uuids, with WITH RECURSIVE.
+        If depth is None, the depths are all 0: a bundle can be reached at many different
+        depths in a DAG, and tracking them would expand it once for each of them. Without them,
+        UNION (rather than UNION ALL) drops the bundles that were already reached, so each
+        bundle is only expanded once.
+        """
+        reached = (
+            select([to_column.label('uuid'), literal(0 if depth is None else 1).label('depth')])
+            .where(from_column.in_(uuids))
+            .cte('reached', recursive=True)
+        )
+        dependency = cl_bundle_dependency.alias('dependency')
+        if depth is None:
+            step = select([dependency.c[to_column.name], reached.c.depth])
+        else:
+            step = select([dependency.c[to_column.name], reached.c.depth + 1]).where(
+                reached.c.depth < depth
+            )
+        reached = reached.union(step.where(dependency.c[from_column.name] == reached.c.uuid))
+        query = select([reached.c.uuid, func.min(reached.c.depth)]).group_by(reached.c.uuid)
+        with self.engine.begin() as connection:
+            return dict(connection.execute(query).fetchall())
+
+    def _get_dependency_depths_iterative(self, uuids, depth, from_column, to_column):
+        """Returns {uuid: depth} of the bundles reached from the given uuids, level by level, with
+        the same depths as _get_dependency_depths_recursive."""
+        depths = {}
+        visited = set(uuids)
+        frontier = list(visited)
+        level = 0
+        with self.engine.begin() as connection:
+            while frontier and (depth is None or level < depth):
+                level += 1
+                new_frontier = []
+                for i in range(0, len(frontier), DEPENDENCY_QUERY_BATCH_SIZE):
+                    rows = connection.execute(
+                        select([to_column]).where(
+                            from_column.in_(frontier[i : i + DEPENDENCY_QUERY_BATCH_SIZE])
+                        )
+                    ).fetchall()
+                    for (uuid,) in rows:
+                        if uuid not in visited:
+                            visited.add(uuid)
+                            depths[uuid] = 0 if depth is None else level
+                            new_frontier.append(uuid)
+                frontier = new_frontier
+        return depths
+
+    @read_only
     def search_bundles(self, user_id, keywords):
         """
         Returns a bundle search result dict where:
@@ -380,11 +579,14 @@ class BundleModel(object):
                           specified for bundle searches
                     single number value for aggregate searches(.count, .sum)
             is_aggregate: True for aggregate searches, False otherwise
+            next_cursor: with .cursor, the cursor of the next page, or None for the last page
         Each keyword is either:
         - <key>=<value>
         - .floating: return bundles not in any worksheet
         - .offset=<int>: return bundles starting at this offset
         - .limit=<int>: maximum number of bundles to return
+        - .cursor=<cursor>: return the page of bundles after the given cursor, with keyset
+          pagination (.cursor= for the first page)
         - .count: just return the number of bundles
         - .shared: shared with me through a group
         - .mine: sugar for owner_id=user_id
@@ -414,8 +616,9 @@ class BundleModel(object):
             subquery_index[0] += 1
             return clause.alias('q' + str(subquery_index[0]))
 
-        def is_numeric(key):
-            return key != 'name'
+        def needs_cast(key, field):
+            # Values in bundle_metadata are text, which has to be cast to sort numbers.
+            return key != 'name' and isinstance(field.type, Text)
 
         def make_condition(key, field, value):
             """
@@ -423,16 +626,12 @@ class BundleModel(object):
             Otherwise, return an SQL expression checking some form of equality between field and value
             """
             # Special
-            if value == '.sort':
+            if value in ('.sort', '.sort-'):
                 aux_fields.append(field)
-                if is_numeric(key):
+                if needs_cast(key, field):
                     field = field * 1
                 sort_key[0] = field
-            elif value == '.sort-':
-                aux_fields.append(field)
-                if is_numeric(key):
-                    field = field * 1
-                sort_key[0] = desc(field)
+                sort_descending[0] = value == '.sort-'
             elif value == '.sum':
                 sum_key[0] = field * 1
             else:
@@ -450,13 +649,19 @@ class BundleModel(object):
             """
             joins.append(Join(table, condition, left_outer_join))
 
+        def join_bundle_search():
+            if not any(join.table is cl_bundle_search for join in joins):
+                add_join(cl_bundle_search, cl_bundle.c.uuid == cl_bundle_search.c.bundle_uuid)
+
         shortcuts = {'type': 'bundle_type', 'size': 'data_size', 'worksheet': 'host_worksheet'}
 
         offset = 0
         limit = SEARCH_RESULTS_LIMIT
+        cursor = None
         format_func = None
         count = False
         sort_key = [None]
+        sort_descending = [False]
         sum_key = [None]
         aux_fields = []  # Fields (e.g., sorting) that we need to include in the query
 
@@ -502,6 +707,8 @@ class BundleModel(object):
                 offset = int(value)
             elif key == '.limit':
                 limit = int(value)
+            elif key == '.cursor':
+                cursor = value
             elif key == '.format':
                 format_func = value
             # Bundle fields
@@ -577,35 +784,22 @@ class BundleModel(object):
                         "Unable to parse datetime. Datetime must be specified as an ISO-8601 datetime string such as YYYY-MM-DD."
                     )
 
-                subclause = None
-                aliased_bundle_metadata = aliased(cl_bundle_metadata)
+                join_bundle_search()
                 if key == '.before':
-                    subclause = aliased_bundle_metadata.c.metadata_value <= int(
-                        target_datetime.timestamp()
-                    )
+                    conjunct = cl_bundle_search.c.created <= int(target_datetime.timestamp())
                 if key == '.after':
-                    subclause = aliased_bundle_metadata.c.metadata_value >= int(
-                        target_datetime.timestamp()
-                    )
-                add_join(
-                    aliased_bundle_metadata,
-                    cl_bundle.c.uuid == aliased_bundle_metadata.c.bundle_uuid,
-                )
-                conjunct = and_(aliased_bundle_metadata.c.metadata_key == 'created', subclause)
+                    conjunct = cl_bundle_search.c.created >= int(target_datetime.timestamp())
             elif key == 'uuid_name':  # Search uuid and name by default
-                aliased_bundle_metadata = aliased(cl_bundle_metadata)
-                add_join(
-                    aliased_bundle_metadata,
-                    cl_bundle.c.uuid == aliased_bundle_metadata.c.bundle_uuid,
-                )
-
-                conjunct = or_(
-                    cl_bundle.c.uuid.like('%' + value + '%'),
-                    and_(
-                        aliased_bundle_metadata.c.metadata_key == 'name',
-                        aliased_bundle_metadata.c.metadata_value.like('%' + value + '%'),
-                    ),
+                matches = alias(
+                    union(
+                        select([cl_bundle.c.uuid]).where(cl_bundle.c.uuid.like('%' + value + '%')),
+                        self._search_bundle_names('%' + value + '%'),
+                    )
                 )
+                add_join(matches, cl_bundle.c.uuid == matches.c.uuid)
+            elif key == 'name' and isinstance(value, str) and '%' in value:
+                matches = alias(self._search_bundle_names(value))
+                add_join(matches, cl_bundle.c.uuid == matches.c.uuid)
             elif key == '':  # Match any field
                 aliased_bundle_metadata = aliased(cl_bundle_metadata)
                 add_join(
@@ -618,6 +812,13 @@ class BundleModel(object):
                     cl_bundle.c.command.like('%' + value + '%'),
                     aliased_bundle_metadata.c.metadata_value.like('%' + value + '%'),
                 )
+            elif key in SEARCH_METADATA_KEYS:
+                field = getattr(cl_bundle_search.c, key)
+                join_bundle_search()
+                conjunct = make_condition(key, field, value)
+                if conjunct is None:  # Sorting or summing
+                    # Like with bundle_metadata, only bundles that have the key are matched.
+                    conjunct = field.isnot(None)
             # Otherwise, assume metadata.
             else:
                 aliased_bundle_metadata = aliased(cl_bundle_metadata)
@@ -677,12 +878,16 @@ class BundleModel(object):
             )
             # Sum the numbers
             query = select([func.sum(query.c.num)])
+        elif cursor is not None and not count:
+            return self._search_bundles_page(
+                table, where_clause, aux_fields, sort_key[0], sort_descending[0], cursor, limit
+            )
         else:
             query = select([cl_bundle.c.uuid] + aux_fields).select_from(table)
             query = query.distinct().where(where_clause).offset(offset).limit(limit)
         # Sort
         if sort_key[0] is not None:
-            query = query.order_by(sort_key[0])
+            query = query.order_by(desc(sort_key[0]) if sort_descending[0] else sort_key[0])
 
         # Count
         if count:
@@ -694,6 +899,43 @@ class BundleModel(object):
             return {'result': result, 'is_aggregate': True}
         return {'result': result, 'is_aggregate': False}
 
+    def _search_bundles_page(
+        self, table, where_clause, aux_fields, sort_key, sort_descending, cursor, limit
+    ):
+        """
+        Returns the search_bundles result for the page of bundles after the given cursor ('' for
+        the first page), which are ordered by the sort key and then by id. Unlike with .offset,
+        a page is found through the indexes on the sort key and id without going through all the
+        bundles of the previous pages.
+        """
+        if sort_key is None:
+            sort_key = cl_bundle.c.id
+        if cursor:
+            sort_value, last_id = decode_search_cursor(cursor)
+            after = sort_key < sort_value if sort_descending else sort_key > sort_value
+            where_clause = and_(
+                where_clause, or_(after, and_(sort_key == sort_value, cl_bundle.c.id > last_id)),
+            )
+        query = (
+            select([cl_bundle.c.uuid, cl_bundle.c.id, sort_key.label('sort_value')] + aux_fields)
+            .select_from(table)
+            .distinct()
+            .where(where_clause)
+            .order_by(desc(sort_key) if sort_descending else sort_key, cl_bundle.c.id)
+            .limit(limit)
+        )
+        with self.engine.begin() as connection:
+            rows = connection.execute(query).fetchall()
+        next_cursor = None
+        if rows and len(rows) == limit:
+            next_cursor = encode_search_cursor(rows[-1].sort_value, rows[-1].id)
+        return {
+            'result': [row.uuid for row in rows],
+            'is_aggregate': False,
+            'next_cursor': next_cursor,
+        }
+
+    @read_only
     def get_bundle_uuids(self, conditions, max_results):
         """
         Returns a list of bundle_uuids that have match the conditions.
@@ -762,79 +1004,92 @@ class BundleModel(object):
         """
         # Decode json formatted dependencies string to a list of key value pairs
         dependencies = json.loads(dependencies)
-        # When there is no dependency to be matched, the target memoized bundle
-        # should only exist in the bundle table but not in the bundle_dependency table.
-        if len(dependencies) == 0:
-            query = (
-                select([cl_bundle.c.uuid])
-                .select_from(cl_bundle)
-                .where(
-                    and_(
-                        cl_bundle.c.command == command,
-                        cl_bundle.c.owner_id == user_id,
-                        cl_bundle.c.uuid.notin_(
-                            select([cl_bundle_dependency.c.child_uuid]).select_from(
-                                cl_bundle_dependency
-                            )
-                        ),
-                    )
-                )
-                .order_by(cl_bundle.c.id)
-            )
-        else:
-            # The following matching logic contains two aggregations. In the first aggregation, we select those records
-            # that have the same number of dependencies as specified in input. In the second aggregation, we operate on
-            # records that returned from the first aggregation. We first select those records that match with all
-            # (child_path, parent_uuid) dependency pairs from the input. Then, we aggregate on child_uuid and match
-            # the total the number of unique dependencies per child_uuid with input dependencies.
-            clause = []
-            for dep in dependencies:
-                clause.append(
-                    and_(
-                        cl_bundle_dependency.c.child_path == dep['child_path'],
-                        cl_bundle_dependency.c.parent_uuid == dep['parent_uuid'],
-                    )
-                )
-            # Step 1: filter by input command and the number of dependencies
-            command_filter = (
-                select([cl_bundle_dependency.c.child_uuid])
-                .select_from(
-                    cl_bundle.join(
-                        cl_bundle_dependency, cl_bundle.c.uuid == cl_bundle_dependency.c.child_uuid
-                    )
-                )
-                .where(and_(cl_bundle.c.command == command, cl_bundle.c.owner_id == user_id))
-                # child_path is unique across all dependencies, aggregate on child_uuid
-                # and COUNT the total the number of unique dependencies per child_uuid
-                .group_by(cl_bundle_dependency.c.child_uuid)
-                .having(func.count(cl_bundle_dependency.c.child_path) == len(dependencies))
-            )
-            uuids = self._execute_query(command_filter)
-
-            # Step 2: filter by each dependency (child_path, parent_uuid) pair in the bundle_dependency table
-            query = (
-                select([cl_bundle_dependency.c.child_uuid])
-                .select_from(cl_bundle_dependency)
-                .where(and_(cl_bundle_dependency.c.child_uuid.in_(uuids), or_(*clause)))
-                # child_path is unique across all dependencies, aggregate on child_uuid
-                # and COUNT the total the number of unique dependencies per child_uuid
-                .group_by(cl_bundle_dependency.c.child_uuid)
-                .having(func.count(cl_bundle_dependency.c.child_path) == len(dependencies))
-                # Ensure the order of the returning bundles will be in the order of they were created.
-                .order_by(cl_bundle_dependency.c.id)
+        memo_key = get_memo_key(
+            user_id, command, [(dep['child_path'], dep['parent_uuid']) for dep in dependencies]
+        )
+        query = (
+            select([cl_bundle.c.uuid])
+            .select_from(
+                cl_bundle_search.join(cl_bundle, cl_bundle.c.uuid == cl_bundle_search.c.bundle_uuid)
             )
-
+            .where(cl_bundle_search.c.memo_key == memo_key)
+            # Ensure the order of the returning bundles will be in the order of they were created.
+            .order_by(cl_bundle.c.id)
+        )
         return self._execute_query(query)
 
+    @read_only
     def batch_get_bundles(self, **kwargs):
         """
         Return a list of bundles given a SQLAlchemy clause on the cl_bundle table.
+        Bundles in final states that are looked up by uuid are served from the bundle cache.
+        """
+        cached_values = {}
+        if list(kwargs) == ['uuid'] and not isinstance(kwargs['uuid'], LikeQuery):
+            uuids = kwargs['uuid']
+            uuids = [uuids] if isinstance(uuids, str) else list(uuids)
+            cached_values = self.bundle_cache.get_many(uuids)
+            kwargs = {'uuid': [uuid for uuid in uuids if uuid not in cached_values]}
+        # Rows read from the replica may be older than an update that has already invalidated
+        # them, so only rows read from the primary are cached.
+        from_primary = self.engine is self.engine_router.primary
+        bundle_values = self._get_bundle_values(kwargs)
+        # The bundle cache only holds bundles that won't change anymore, short of an update that
+        # invalidates them.
+        if from_primary:
+            self.bundle_cache.set_many(
+                {
+                    uuid: bundle_value
+                    for uuid, bundle_value in bundle_values.items()
+                    if bundle_value['state'] in State.FINAL_STATES
+                }
+            )
+        bundle_values.update(cached_values)
+
+        # Construct and validate all of the retrieved bundles.
+        sorted_values = sorted(bundle_values.values(), key=lambda r: r['id'])
+        bundles = [
+            #
+            get_bundle_subclass(bundle_value['bundle_type'])(bundle_value)
+            for bundle_value in sorted_values
+        ]
+        return bundles
+
+    def iter_bundles(self, chunk_size=ITER_BUNDLES_CHUNK_SIZE, **kwargs):
+        """
+        Like batch_get_bundles, but yields the bundles in order of id, fetching chunk_size of them
+        at a time, so that only one chunk of them is in memory at once.
         """
         clause = self.make_kwargs_clause(cl_bundle, kwargs)
+        last_id = None
+        while True:
+            query = select([cl_bundle.c.id, cl_bundle.c.uuid]).where(clause)
+            if last_id is not None:
+                query = query.where(cl_bundle.c.id > last_id)
+            with self.engine_router.read_only_scope(), self.engine.begin() as connection:
+                rows = connection.execute(
+                    query.order_by(cl_bundle.c.id).limit(chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield from self.batch_get_bundles(uuid=[row.uuid for row in rows])
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1].id
+
+    def _get_bundle_values(self, kwargs):
+        """
+        Return {uuid: bundle_value} for the bundles that match the given dict of cl_bundle
+        columns to values, where each bundle_value is the dict of the bundle row, with the
+        dicts of its dependency and metadata rows under 'dependencies' and 'metadata'.
+        """
+        if kwargs.get('uuid') == []:
+            return {}
+        clause = self.make_kwargs_clause(cl_bundle, kwargs)
         with self.engine.begin() as connection:
             bundle_rows = connection.execute(cl_bundle.select().where(clause)).fetchall()
             if not bundle_rows:
-                return []
+                return {}
             uuids = set(bundle_row.uuid for bundle_row in bundle_rows)
             dependency_rows = connection.execute(
                 cl_bundle_dependency.select()
@@ -853,20 +1108,12 @@ class BundleModel(object):
         for dep_row in dependency_rows:
             if dep_row.child_uuid not in bundle_values:
                 raise IntegrityError('Got dependency %s without bundle' % (dep_row,))
-            bundle_values[dep_row.child_uuid]['dependencies'].append(dep_row)
+            bundle_values[dep_row.child_uuid]['dependencies'].append(str_key_dict(dep_row))
         for metadata_row in metadata_rows:
             if metadata_row.bundle_uuid not in bundle_values:
                 raise IntegrityError('Got metadata %s without bundle' % (metadata_row,))
-            bundle_values[metadata_row.bundle_uuid]['metadata'].append(metadata_row)
-
-        # Construct and validate all of the retrieved bundles.
-        sorted_values = sorted(bundle_values.values(), key=lambda r: r['id'])
-        bundles = [
-            #
-            get_bundle_subclass(bundle_value['bundle_type'])(bundle_value)
-            for bundle_value in sorted_values
-        ]
-        return bundles
+            bundle_values[metadata_row.bundle_uuid]['metadata'].append(str_key_dict(metadata_row))
+        return bundle_values
 
     # ==========================================================================
     # Server-side bundle state machine methods
@@ -878,7 +1125,7 @@ class BundleModel(object):
             Updates the last_updated metadata.
             Adds a worker_run row that tracks which worker will run the bundle.
         """
-        with self.engine.begin() as connection:
+        with self._begin_bundle_update(bundle) as connection:
             # Check if the requested bundle still exists.
             row = connection.execute(
                 cl_bundle.select().where(cl_bundle.c.id == bundle.id)
@@ -917,7 +1164,7 @@ class BundleModel(object):
             Returns False if the bundle was not in STARTING state.
             Clears the job_handle metadata and removes the worker_run row.
         """
-        with self.engine.begin() as connection:
+        with self._begin_bundle_update(bundle) as connection:
             # Make sure it's still starting.
             row = connection.execute(
                 cl_bundle.select().where(cl_bundle.c.id == bundle.id)
@@ -950,7 +1197,7 @@ class BundleModel(object):
             (done by checking the worker_run table).
             Returns True if it is.
         """
-        with self.engine.begin() as connection:
+        with self._begin_bundle_update(bundle) as connection:
             # Check that still assigned to this worker.
             run_row = connection.execute(
                 cl_worker_run.select().where(cl_worker_run.c.run_uuid == bundle.uuid)
@@ -1064,7 +1311,7 @@ class BundleModel(object):
 
         If the bundle is preemptible, move the bundle to the STAGED state instead.
         """
-        with self.engine.begin() as connection:
+        with self._begin_bundle_update(bundle) as connection:
             # Check that it still exists and is running
             row = connection.execute(
                 cl_bundle.select().where(
@@ -1134,7 +1381,7 @@ class BundleModel(object):
 
         metadata = {'run_status': 'Finished', 'last_updated': int(time.time())}
 
-        with self.engine.begin() as connection:
+        with self._begin_bundle_update(bundle) as connection:
             self.update_bundle(bundle, {'state': state, 'metadata': metadata}, connection)
             connection.execute(
                 cl_worker_run.delete().where(cl_worker_run.c.run_uuid == bundle.uuid)
@@ -1144,12 +1391,40 @@ class BundleModel(object):
     # Bundle state machine helper functions
     # ==========================================================================
 
+    def _search_bundle_names(self, pattern):
+        """
+        Returns a query of the uuids of the bundles with a name LIKE the given
+        pattern, which uses the full-text index of bundle_search to find them.
+        """
+        query = select([cl_bundle_search.c.bundle_uuid.label('uuid')])
+        if self.engine.dialect.name == 'sqlite':
+            fts = table('bundle_search_fts', column('rowid'), column('name'))
+            return query.select_from(
+                cl_bundle_search.join(fts, fts.c.rowid == literal_column('bundle_search.rowid'))
+            ).where(fts.c.name.like(pattern))
+        condition = cl_bundle_search.c.name.like(pattern)
+        if self.engine.dialect.name == 'mysql':
+            # Every literal part of the pattern must be in the name. Parts shorter than a
+            # token can't be searched for, and if there are none, the LIKE alone is used.
+            parts = [
+                part for part in re.split(r'[%_"\\\s]', pattern) if len(part) >= NGRAM_TOKEN_SIZE
+            ]
+            if parts:
+                terms = ' '.join('+"%s"' % part for part in parts)
+                condition = and_(cl_bundle_search.c.name.match(terms), condition)
+        return query.where(condition)
+
     def get_data_size(self, bundle_location):
         """
-        Returns data_size (in bytes) of bundle at bundle_location
+        Returns data_size (in bytes) of bundle at bundle_location. The size of a
+        directory is read from its manifest, if it has an up-to-date one.
         """
         dirs_and_files = None
         if os.path.isdir(bundle_location):
+            manifest = DirectoryManifest.open(bundle_location)
+            if manifest is not None:
+                with manifest:
+                    return manifest.get_total_size()
             dirs_and_files = path_util.recursive_ls(bundle_location)
         else:
             dirs_and_files = [], [bundle_location]
@@ -1174,17 +1449,37 @@ class BundleModel(object):
         Update user's disk used with the size of the new bundle.
 
         Only used by bundle_manager when creating make bundles.
+
+        This is when the bundle's contents are final, so for directories in the
+        bundle store, a manifest is written too. It lets their size and target
+        info be computed without walking them again.
         """
-        data_size = self.get_data_size(bundle_location)
-        bundle_update = {'metadata': {'data_size': data_size}}
-        self.update_bundle(bundle, bundle_update)
-        self.update_user_disk_used(bundle.owner_id)
+        if not getattr(bundle.metadata, 'link_url', None) and os.path.isdir(bundle_location):
+            DirectoryManifest.write(bundle_location).close()
+        self.update_bundle_data_size(bundle, self.get_data_size(bundle_location))
+
+    def update_bundle_data_size(self, bundle, data_size):
+        """
+        Sets the data_size of the bundle, and adds the difference with its previous data_size
+        to the disk used by its owner, in the same transaction.
+        """
+        with self._begin_bundle_update(bundle) as connection:
+            row = connection.execute(
+                select([cl_bundle_search.c.data_size])
+                .where(cl_bundle_search.c.bundle_uuid == bundle.uuid)
+                .with_for_update()
+            ).fetchone()
+            previous_data_size = (row.data_size if row else None) or 0
+            self.update_bundle(bundle, {'metadata': {'data_size': data_size}}, connection)
+            self.increment_user_disk_used(
+                bundle.owner_id, data_size - previous_data_size, connection
+            )
 
     def bundle_checkin(self, bundle, worker_run, user_id, worker_id):
         """
         Updates the database tables with the most recent bundle information from worker
         """
-        with self.engine.begin() as connection:
+        with self._begin_bundle_update(bundle) as connection:
             # If bundle isn't in db anymore the user deleted it so cancel
             row = connection.execute(
                 cl_bundle.select().where(cl_bundle.c.id == bundle.id)
@@ -1229,6 +1524,11 @@ class BundleModel(object):
             result = connection.execute(cl_bundle.insert().values(bundle_value))
             self.do_multirow_insert(connection, cl_bundle_dependency, dependency_values)
             self.do_multirow_insert(connection, cl_bundle_metadata, metadata_values)
+            search_values = {
+                key: getattr(bundle.metadata, key, None) for key in SEARCH_METADATA_KEYS
+            }
+            search_values.update(bundle_uuid=bundle.uuid, memo_key=get_bundle_memo_key(bundle))
+            connection.execute(cl_bundle_search.insert().values(search_values))
             if bundle_store_uuid:
                 bundle_location_value = {
                     'bundle_uuid': bundle.uuid,
@@ -1244,6 +1544,7 @@ class BundleModel(object):
         Also, delete any metadata key-value pairs when the value specified is None.
         This method validates all updates to the bundle, so it is appropriate
         to use this method to update bundles based on user input (eg: cl edit).
+        If a connection is given, it must come from self._begin_bundle_update(bundle).
         """
         message = 'Illegal update: %s' % (update,)
         precondition('id' not in update and 'uuid' not in update, message)
@@ -1281,6 +1582,13 @@ class BundleModel(object):
                 for row_dict in bundle.to_dict().pop('metadata')
                 if row_dict['metadata_key'] in metadata_update
             ]
+        search_update = {
+            key: getattr(bundle.metadata, key, None)
+            for key in SEARCH_METADATA_KEYS
+            if key in metadata_update or key in metadata_delete_keys
+        }
+        if 'command' in update or 'owner_id' in update:
+            search_update['memo_key'] = get_bundle_memo_key(bundle)
         if metadata_delete_keys:
             metadata_delete_clause = and_(
                 cl_bundle_metadata.c.bundle_uuid == bundle.uuid,
@@ -1297,15 +1605,35 @@ class BundleModel(object):
                     self.do_multirow_insert(connection, cl_bundle_metadata, metadata_update_values)
                 if metadata_delete_keys:
                     connection.execute(cl_bundle_metadata.delete().where(metadata_delete_clause))
+                if search_update:
+                    connection.execute(
+                        cl_bundle_search.update()
+                        .where(cl_bundle_search.c.bundle_uuid == bundle.uuid)
+                        .values(search_update)
+                    )
             except UnicodeError:
                 raise UsageError("Invalid character detected; use ascii characters only.")
 
         if connection:
             do_update(connection)
         else:
-            with self.engine.begin() as connection:
+            with self._begin_bundle_update(bundle) as connection:
                 do_update(connection)
 
+    @contextlib.contextmanager
+    def _begin_bundle_update(self, bundle):
+        """
+        Like self.engine.begin(), for a transaction that updates the bundle. The bundle is dropped
+        from the bundle cache once the transaction is over rather than during it, since readers
+        could otherwise cache what it was before the transaction committed.
+        """
+        try:
+            with self.engine.begin() as connection:
+                yield connection
+        finally:
+            self.bundle_cache.invalidate([bundle.uuid])
+
+    @read_only
     def get_bundle_dependencies(self, uuid):
         with self.engine.begin() as connection:
             dependency_rows = connection.execute(
@@ -1315,12 +1643,14 @@ class BundleModel(object):
             ).fetchall()
         return [Dependency(dep_val) for dep_val in dependency_rows]
 
+    @request_cached
     def get_bundle_state(self, uuid):
         result_dict = self.get_bundle_states([uuid])
         if uuid not in result_dict:
             raise NotFoundError('Could not find bundle with uuid %s' % uuid)
         return result_dict[uuid]
 
+    @request_cached
     def get_bundle_states(self, uuids):
         """
         Return {uuid: state, ...}
@@ -1331,6 +1661,7 @@ class BundleModel(object):
             ).fetchall()
             return dict((r.uuid, r.state) for r in rows)
 
+    @request_cached
     def get_bundle_storage_info(self, uuid):
         """
         Return (storage_type, is_dir) for the bundle
@@ -1341,17 +1672,26 @@ class BundleModel(object):
             return None, None
         return result_dict[uuid]
 
+    @request_cached
     def get_bundle_storage_infos(self, uuids):
         """
         Return {uuid: (storage_type, is_dir), ...}
         """
+        result = {
+            uuid: (bundle_value['storage_type'], bundle_value['is_dir'])
+            for uuid, bundle_value in self.bundle_cache.get_many(uuids).items()
+        }
+        uuids = [uuid for uuid in uuids if uuid not in result]
+        if not uuids:
+            return result
         with self.engine.begin() as connection:
             rows = connection.execute(
                 select([cl_bundle.c.uuid, cl_bundle.c.storage_type, cl_bundle.c.is_dir]).where(
                     cl_bundle.c.uuid.in_(uuids)
                 )
             ).fetchall()
-            return dict((r.uuid, (r.storage_type, r.is_dir)) for r in rows)
+            result.update((r.uuid, (r.storage_type, r.is_dir)) for r in rows)
+            return result
 
     def delete_bundles(self, uuids):
         """
@@ -1371,6 +1711,9 @@ class BundleModel(object):
             connection.execute(
                 cl_bundle_metadata.delete().where(cl_bundle_metadata.c.bundle_uuid.in_(uuids))
             )
+            connection.execute(
+                cl_bundle_search.delete().where(cl_bundle_search.c.bundle_uuid.in_(uuids))
+            )
             connection.execute(
                 cl_bundle_dependency.delete().where(cl_bundle_dependency.c.child_uuid.in_(uuids))
             )
@@ -1380,11 +1723,14 @@ class BundleModel(object):
             # In case something goes wrong, delete bundles that are currently running on workers.
             connection.execute(cl_worker_run.delete().where(cl_worker_run.c.run_uuid.in_(uuids)))
             connection.execute(cl_bundle.delete().where(cl_bundle.c.uuid.in_(uuids)))
+        self.bundle_cache.invalidate(uuids)
 
     # ==========================================================================
     # Worksheet-related model methods follow!
     # ==========================================================================
 
+    @read_only
+    @request_cached
     def get_worksheet(self, uuid, fetch_items):
         """
         Get a worksheet given its uuid.
@@ -1397,6 +1743,7 @@ class BundleModel(object):
             raise IntegrityError('Found multiple worksheets with uuid %s' % (uuid,))
         return worksheets[0]
 
+    @read_only
     def batch_get_worksheets(self, fetch_items, **kwargs):
         """
         Get a list of worksheets, all of which satisfy the clause given by kwargs.
@@ -1453,6 +1800,7 @@ class BundleModel(object):
                 worksheet_values[item_row['worksheet_uuid']]['items'].append(item_row)
         return [Worksheet(value) for value in worksheet_values.values()]
 
+    @read_only
     def search_worksheets(self, user_id, keywords):
         """
         Return a list of row dicts, one per worksheet. These dicts do NOT contain
@@ -1689,6 +2037,8 @@ class BundleModel(object):
         """
         Add worksheet items *items* to the position *after_sort_key* to the worksheet,
         removing items specified by *replace* if necessary.
+        The new items get sort keys in the gap between after_sort_key and the sort key of the
+        next item, so the other items keep theirs, unless the gap is too small for them.
         """
         with self.engine.begin() as connection:
             if len(replace) > 0:
@@ -1699,44 +2049,11 @@ class BundleModel(object):
             if len(items) == 0:
                 # Nothing to insert, return
                 return
+            sort_keys = [None] * len(items)
             if after_sort_key is not None:
-                after_sort_key = int(after_sort_key)
-                # Shift existing items' sort_keys for items that originally came after
-                # the after_sort_key
-                offset = len(items)
-                clause = and_(
-                    cl_worksheet_item.c.worksheet_uuid == worksheet_uuid,
-                    or_(
-                        cl_worksheet_item.c.sort_key > after_sort_key,
-                        and_(
-                            cl_worksheet_item.c.sort_key is None,
-                            cl_worksheet_item.c.id > after_sort_key,
-                        ),
-                    ),
+                sort_keys = self._get_new_item_sort_keys(
+                    connection, worksheet_uuid, int(after_sort_key), len(items)
                 )
-                query = select(['*']).where(clause)
-                # Get result in a list
-                after_items = [item for item in connection.execute(query)]
-                if (
-                    len(after_items) > 0
-                    and min(item_sort_key(item) for item in after_items) - after_sort_key <= offset
-                ):
-                    # Shift the keys of the original items if the gap between after_sort_key
-                    # and the next smallest key is not sufficient for inserting items.
-                    # In actuality, delete these items and re-insert.
-                    connection.execute(cl_worksheet_item.delete().where(clause))
-                    new_after_items = [
-                        {
-                            'worksheet_uuid': item.worksheet_uuid,
-                            'bundle_uuid': item.bundle_uuid,
-                            'subworksheet_uuid': item.subworksheet_uuid,
-                            'value': item.value,
-                            'type': item.type,
-                            'sort_key': item_sort_key(item) + offset,
-                        }
-                        for item in after_items
-                    ]
-                    self.do_multirow_insert(connection, cl_worksheet_item, new_after_items)
             # Insert new items
             items_to_insert = [
                 {
@@ -1745,13 +2062,95 @@ class BundleModel(object):
                     'subworksheet_uuid': subworksheet_uuid,
                     'value': self.encode_str(value),
                     'type': type,
-                    'sort_key': after_sort_key + idx + 1 if after_sort_key is not None else None,
+                    'sort_key': sort_key,
                 }
-                for idx, (bundle_uuid, subworksheet_uuid, value, type) in enumerate(items)
+                for sort_key, (bundle_uuid, subworksheet_uuid, value, type) in zip(sort_keys, items)
             ]
             self.do_multirow_insert(connection, cl_worksheet_item, items_to_insert)
         self.update_worksheet_last_modified_date(worksheet_uuid)
 
+    def _get_new_item_sort_keys(self, connection, worksheet_uuid, after_sort_key, count):
+        """
+        Returns the sort keys of count items to insert after after_sort_key in the worksheet,
+        which are spread out in the gap before the next item. If the gap is too small, the sort
+        keys of the worksheet are rebalanced first.
+        """
+        next_sort_key = self._get_next_item_sort_key(connection, worksheet_uuid, after_sort_key)
+        if next_sort_key is None:
+            spacing = SORT_KEY_GAP
+        elif next_sort_key - after_sort_key > count:
+            spacing = min((next_sort_key - after_sort_key) // (count + 1), SORT_KEY_GAP)
+        else:
+            after_sort_key = self._rebalance_item_sort_keys(
+                connection, worksheet_uuid, after_sort_key, count
+            )
+            spacing = SORT_KEY_GAP
+        return [after_sort_key + spacing * (i + 1) for i in range(count)]
+
+    def _get_next_item_sort_key(self, connection, worksheet_uuid, after_sort_key):
+        """
+        Returns the smallest sort key (see item_sort_key) greater than after_sort_key among the
+        items of the worksheet, or None if there is none.
+        """
+        next_sort_key = connection.execute(
+            select([func.min(cl_worksheet_item.c.sort_key)]).where(
+                and_(
+                    cl_worksheet_item.c.worksheet_uuid == worksheet_uuid,
+                    cl_worksheet_item.c.sort_key > after_sort_key,
+                )
+            )
+        ).scalar()
+        # Items without a sort key sort as if it were SORT_KEY_GAP times their id.
+        next_id = connection.execute(
+            select([func.min(cl_worksheet_item.c.id)]).where(
+                and_(
+                    cl_worksheet_item.c.worksheet_uuid == worksheet_uuid,
+                    cl_worksheet_item.c.sort_key == None,  # noqa: E711
+                    cl_worksheet_item.c.id > after_sort_key // SORT_KEY_GAP,
+                )
+            )
+        ).scalar()
+        candidates = []
+        if next_sort_key is not None:
+            candidates.append(next_sort_key)
+        if next_id is not None:
+            candidates.append(next_id * SORT_KEY_GAP)
+        return min(candidates) if candidates else None
+
+    def _rebalance_item_sort_keys(self, connection, worksheet_uuid, after_sort_key, count):
+        """
+        Spreads the sort keys of the items of the worksheet SORT_KEY_GAP apart, keeping their
+        order and leaving room for count items after after_sort_key. Returns the sort key that
+        after_sort_key has become.
+        """
+        rows = connection.execute(
+            select([cl_worksheet_item.c.id, cl_worksheet_item.c.sort_key]).where(
+                cl_worksheet_item.c.worksheet_uuid == worksheet_uuid
+            )
+        ).fetchall()
+        new_after_sort_key = 0
+        sort_key = 0
+        shifted = False
+        updates = []
+        for row in sorted(rows, key=lambda row: (item_sort_key(row), row.id)):
+            if not shifted and item_sort_key(row) > after_sort_key:
+                # Leave room for the new items.
+                sort_key += count * SORT_KEY_GAP
+                shifted = True
+            sort_key += SORT_KEY_GAP
+            if not shifted:
+                new_after_sort_key = sort_key
+            if row.sort_key != sort_key:
+                updates.append({'item_id': row.id, 'new_sort_key': sort_key})
+        if updates:
+            connection.execute(
+                cl_worksheet_item.update()
+                .where(cl_worksheet_item.c.id == bindparam('item_id'))
+                .values(sort_key=bindparam('new_sort_key')),
+                updates,
+            )
+        return new_after_sort_key
+
     def add_shadow_worksheet_items(self, old_bundle_uuid, new_bundle_uuid):
         """
         For each occurrence of old_bundle_uuid in any worksheet, add
@@ -1811,9 +2210,10 @@ class BundleModel(object):
             cl_worksheet_item.c.id <= last_item_id,
         )
         # See codalab.objects.worksheet for an explanation of the sort_key protocol.
-        # We need to produce sort keys here that are strictly upper-bounded by the
-        # last known item id in this worksheet, and which monotonically increase.
-        # The expression last_item_id + i - len(new_items) works. It can produce
+        # We need to produce sort keys here that are strictly upper-bounded by
+        # SORT_KEY_GAP times the last known item id in this worksheet, and which
+        # monotonically increase. The expression
+        # (last_item_id + i - len(new_items)) * SORT_KEY_GAP works. It can produce
         # negative sort keys, but that's fine.
         new_item_values = [
             {
@@ -1822,7 +2222,7 @@ class BundleModel(object):
                 'subworksheet_uuid': subworksheet_uuid,
                 'value': self.encode_str(value),
                 'type': item_type,
-                'sort_key': (last_item_id + i - len(new_items)),
+                'sort_key': (last_item_id + i - len(new_items)) * SORT_KEY_GAP,
             }
             for (i, (bundle_uuid, subworksheet_uuid, value, item_type)) in enumerate(new_items)
         ]
@@ -1835,6 +2235,23 @@ class BundleModel(object):
             self.do_multirow_insert(connection, cl_worksheet_item, new_item_values)
         self.update_worksheet_last_modified_date(worksheet_uuid)
 
+    def fill_worksheet_item_sort_keys(self, worksheet_uuid):
+        """
+        Gives the items of the worksheet that have no sort key the one they sort by
+        (see item_sort_key), without changing their order.
+        """
+        with self.engine.begin() as connection:
+            connection.execute(
+                cl_worksheet_item.update()
+                .where(
+                    and_(
+                        cl_worksheet_item.c.worksheet_uuid == worksheet_uuid,
+                        cl_worksheet_item.c.sort_key == None,  # noqa: E711
+                    )
+                )
+                .values(sort_key=cl_worksheet_item.c.id * SORT_KEY_GAP)
+            )
+
     def update_worksheet_last_modified_date(self, worksheet_id):
         """
         Update worksheet's last modified date to now.
@@ -2199,6 +2616,7 @@ class BundleModel(object):
     def get_group_worksheet_permissions(self, user_id, worksheet_uuid):
         return self.get_group_permissions(cl_group_worksheet_permission, user_id, worksheet_uuid)
 
+    @request_cached
     def get_user_permissions(self, table, user_id, object_uuids, owner_ids):
         """
         Gets the set of permissions granted to the given user on the given objects.
@@ -2260,6 +2678,7 @@ class BundleModel(object):
             raise NotFoundError("User matching %r not found" % user_spec)
         return user
 
+    @request_cached
     def get_user(self, user_id=None, username=None, check_active=True):
         """
         Get user.
@@ -2702,6 +3121,7 @@ class BundleModel(object):
 
         return user_id
 
+    @request_cached
     def get_user_info(self, user_id, fetch_extra=False):
         """
         Return the user info corresponding to |user_id|.
@@ -2739,24 +3159,28 @@ class BundleModel(object):
                 cl_user.update().where(cl_user.c.user_id == user_info['user_id']).values(user_info)
             )
 
-    def increment_user_disk_used(self, user_id: str, amount: int):
+    def increment_user_disk_used(self, user_id: str, amount: int, connection=None):
         """
-        Increment disk_used for user by amount.
-        When incrementing values, we have to use a special query to ensure that we avoid
-        race conditions or deadlock arising from multiple threads calling functions
-        concurrently. We do this using with_for_update() and commit().
+        Increment disk_used for user by amount, which is negative when disk is freed.
+        The increment is done by the database in a single UPDATE, so that increments by
+        multiple threads calling this function concurrently are neither lost nor deadlock.
+        If connection is given, the increment is part of its transaction.
         """
-        with self.engine.begin() as connection:
-            rows = connection.execute(
-                select([cl_user.c.disk_used]).where(cl_user.c.user_id == user_id).with_for_update()
+
+        def do_increment(connection):
+            result = connection.execute(
+                cl_user.update()
+                .where(cl_user.c.user_id == user_id)
+                .values(disk_used=cl_user.c.disk_used + amount)
             )
-            if not rows:
+            if result.rowcount == 0:
                 raise NotFoundError("User with ID %s not found" % user_id)
-            disk_used = rows.first()[0] + amount
-            connection.execute(
-                cl_user.update().where(cl_user.c.user_id == user_id).values(disk_used=disk_used)
-            )
-            connection.commit()
+
+        if connection:
+            do_increment(connection)
+        else:
+            with self.engine.begin() as connection:
+                do_increment(connection)
 
     def increment_user_time_used(self, user_id: str, amount: int):
         """
@@ -2787,15 +3211,69 @@ class BundleModel(object):
             user_info = self.get_user_info(user_id)
         return user_info['disk_quota'] - user_info['disk_used']
 
-    def _get_disk_used(self, user_id):
-        # TODO(Ashwin): don't include linked bundles
-        return self.search_bundles(user_id, ['size=.sum', 'owner_id=' + user_id])['result'] or 0
+    def _get_disk_used_query(self):
+        """Returns a query of the total data_size of the bundles of each owner."""
+        return (
+            select(
+                [
+                    cl_bundle.c.owner_id,
+                    func.coalesce(func.sum(cl_bundle_search.c.data_size), 0).label('disk_used'),
+                ]
+            )
+            .select_from(
+                cl_bundle.join(cl_bundle_search, cl_bundle.c.uuid == cl_bundle_search.c.bundle_uuid)
+            )
+            .group_by(cl_bundle.c.owner_id)
+        )
 
     def update_user_disk_used(self, user_id):
-        user_info = self.get_user_info(user_id)
-        # Compute from scratch for simplicity
-        user_info['disk_used'] = self._get_disk_used(user_id)
-        self.update_user_info(user_info)
+        """
+        Recomputes the disk used by the user from the data_size of all of their bundles, and
+        returns how much it was off by. This is expensive for users with many bundles, so
+        disk_used is otherwise kept up to date incrementally (see update_bundle_data_size),
+        and this is only used to repair it.
+        """
+        # TODO(Ashwin): don't include linked bundles
+        with self.engine.begin() as connection:
+            previous_disk_used = connection.execute(
+                select([cl_user.c.disk_used]).where(cl_user.c.user_id == user_id).with_for_update()
+            ).scalar()
+            if previous_disk_used is None:
+                raise NotFoundError("User with ID %s not found" % user_id)
+            row = connection.execute(
+                self._get_disk_used_query().where(cl_bundle.c.owner_id == user_id)
+            ).fetchone()
+            disk_used = row.disk_used if row else 0
+            connection.execute(
+                cl_user.update().where(cl_user.c.user_id == user_id).values(disk_used=disk_used)
+            )
+        return previous_disk_used - disk_used
+
+    def reconcile_user_disk_used(self):
+        """
+        Finds the users whose disk_used differs from the total data_size of their bundles,
+        which happens if an incremental update was missed, and repairs it.
+        Returns a dict from the ids of these users to how much their disk_used was off by.
+        """
+        totals = self._get_disk_used_query().alias('totals')
+        with self.engine.begin() as connection:
+            user_ids = [
+                row.user_id
+                for row in connection.execute(
+                    select([cl_user.c.user_id])
+                    .select_from(cl_user.outerjoin(totals, cl_user.c.user_id == totals.c.owner_id))
+                    .where(cl_user.c.disk_used != func.coalesce(totals.c.disk_used, 0))
+                )
+            ]
+        drifts = {}
+        for user_id in user_ids:
+            # Bundles may have changed since the totals were computed, so the user's disk_used
+            # is recomputed and only counts as drift if it is still off.
+            drift = self.update_user_disk_used(user_id)
+            if drift:
+                logger.warning("Repaired disk_used of user %s, which was off by %d", user_id, drift)
+                drifts[user_id] = drift
+        return drifts
 
     def get_user_parallel_run_quota_left(self, user_id, user_info=None):
         if not user_info:
@@ -0,0 +1,79 @@
+"""
+Routing of read-only BundleModel queries to a read replica.
+
+A BundleModel can be given a second engine, connected to a replica of its database. While a
+REST request is being served, the BundleModel methods decorated with @read_only query the
+replica instead of the primary database, so that heavy read traffic (searching bundles,
+rendering worksheets, polling for staged bundles, ...) doesn't compete with the writes of the
+bundle manager on the primary.
+
+Since the replica lags behind the primary, requests read their own writes: once a request has
+written to the primary, all of its queries go to the primary until it ends. Outside of requests
+(in the bundle manager, for example), everything goes to the primary, since there is no request
+to scope writes to.
+"""
+import contextlib
+import functools
+import threading
+
+from sqlalchemy import event
+
+from codalab.model.request_cache import READ_STATEMENT_PREFIXES
+
+
+class EngineRouter(object):
+    """Chooses the engine that the queries of the current thread run on."""
+
+    def __init__(self, primary, replica=None):
+        self.primary = primary
+        self.replica = replica
+        self._local = threading.local()
+        if replica is not None:
+            event.listen(primary, 'before_cursor_execute', self._before_cursor_execute)
+
+    @property
+    def engine(self):
+        local = self._local
+        if (
+            self.replica is not None
+            and getattr(local, 'active', False)
+            and not local.wrote
+            and getattr(local, 'read_only_depth', 0) > 0
+        ):
+            return self.replica
+        return self.primary
+
+    def begin(self):
+        """Starts routing the read-only queries of this thread to the replica, until it writes."""
+        self._local.active = True
+        self._local.wrote = False
+
+    def end(self):
+        """Stops routing the queries of this thread to the replica."""
+        self._local.active = False
+
+    @contextlib.contextmanager
+    def read_only_scope(self):
+        """Within this scope, queries of this thread may be routed to the replica."""
+        self._local.read_only_depth = getattr(self._local, 'read_only_depth', 0) + 1
+        try:
+            yield
+        finally:
+            self._local.read_only_depth -= 1
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._local, 'active', False) and not statement.lstrip().upper().startswith(
+            READ_STATEMENT_PREFIXES
+        ):
+            self._local.wrote = True
+
+
+def read_only(method):
+    """Marks a method of BundleModel that only reads, so that it can query the read replica."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.engine_router.read_only_scope():
+            return method(self, *args, **kwargs)
+
+    return wrapper
@@ -38,10 +38,20 @@ def ping_connection(dbapi_connection, connection_record, connection_proxy):
 
 
 class MySQLModel(BundleModel):
-    def __init__(self, engine_url, default_user_info, root_user_id, system_user_id):
+    def __init__(
+        self, engine_url, default_user_info, root_user_id, system_user_id, replica_engine_url=None
+    ):
+        engine = self._create_engine(engine_url)
+        replica_engine = self._create_engine(replica_engine_url) if replica_engine_url else None
+        super(MySQLModel, self).__init__(
+            engine, default_user_info, root_user_id, system_user_id, replica_engine
+        )
+
+    @staticmethod
+    def _create_engine(engine_url):
         if not engine_url.startswith('mysql://'):
             raise UsageError('Engine URL should start with mysql://')
-        engine = create_engine(
+        return create_engine(
             engine_url,
             strategy='threadlocal',
             pool_size=20,
@@ -49,7 +59,6 @@ class MySQLModel(BundleModel):
             pool_recycle=3600,
             encoding='utf-8',
         )
-        super(MySQLModel, self).__init__(engine, default_user_info, root_user_id, system_user_id)
 
     def do_multirow_insert(self, connection, table, values):
         # MySQL allows for more efficient multi-row insertions.
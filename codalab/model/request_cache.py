@@ -0,0 +1,100 @@
+"""
+Request-scoped caching of BundleModel reads.
+
+A single REST request often reads the same bundle, user or permissions several times (for
+example, once for a permission check and again to serve the request). While a request is
+active, the results of the BundleModel methods decorated with @request_cached are memoized by
+their arguments, so that each is only queried once. Any statement that writes to the database
+clears the cache, so reads after a write in the same request see it.
+
+The cache is per thread, since the REST server handles each request in its own thread, and it
+also counts the queries made during the request, which the REST server logs.
+"""
+import copy
+import functools
+import threading
+
+from sqlalchemy import event
+
+# Statements that don't write to the database.
+READ_STATEMENT_PREFIXES = ('SELECT', 'WITH', 'SHOW', 'PRAGMA')
+
+
+def _freeze(value):
+    """Returns a hashable version of the given argument."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+class RequestCache(object):
+    """Caches reads and counts the queries made through the given engines during a request."""
+
+    def __init__(self, *engines):
+        self._local = threading.local()
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+
+    @property
+    def active(self):
+        return getattr(self._local, 'entries', None) is not None
+
+    def begin(self):
+        """Starts caching reads in this thread."""
+        self._local.entries = {}
+        self._local.queries = 0
+        self._local.hits = 0
+
+    def end(self):
+        """Stops caching reads in this thread, and returns the number of queries made and of
+        reads that were served from the cache since begin()."""
+        stats = {
+            'queries': getattr(self._local, 'queries', 0),
+            'hits': getattr(self._local, 'hits', 0),
+        }
+        self._local.entries = None
+        return stats
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.active:
+            return
+        self._local.queries += 1
+        if not statement.lstrip().upper().startswith(READ_STATEMENT_PREFIXES):
+            self._local.entries.clear()
+
+    def get(self, key):
+        """Returns (True, value) if a value is cached for the key, and (False, None) otherwise."""
+        if key in self._local.entries:
+            self._local.hits += 1
+            # Callers may modify what they are returned, so they each get their own copy.
+            return True, copy.deepcopy(self._local.entries[key])
+        return False, None
+
+    def set(self, key, value):
+        self._local.entries[key] = copy.deepcopy(value)
+
+
+def request_cached(method):
+    """Memoizes a read method of BundleModel by its arguments while a request is active."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = self.request_cache
+        if not cache.active:
+            return method(self, *args, **kwargs)
+        key = (method.__name__, _freeze(args), _freeze(kwargs))
+        try:
+            found, value = cache.get(key)
+        except TypeError:
+            # An argument isn't hashable.
+            return method(self, *args, **kwargs)
+        if not found:
+            value = method(self, *args, **kwargs)
+            cache.set(key, value)
+        return value
+
+    return wrapper
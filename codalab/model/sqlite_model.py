@@ -1,6 +1,6 @@
 """
-SQLite is a subclass of BundleModel that stores metadata in an in-memory
-SQLite database. Only used for testing purposes.
+SQLite is a subclass of BundleModel that stores metadata in an SQLite database,
+in memory by default. Only used for testing purposes.
 """
 from sqlalchemy import create_engine
 from sqlalchemy.pool import StaticPool
@@ -9,14 +9,23 @@ from codalab.model.bundle_model import BundleModel
 
 
 class SQLiteModel(BundleModel):
-    def __init__(self, default_user_info, root_user_id, system_user_id):
-        # Use an in-memory database in multiple threads -- see
+    def __init__(
+        self, default_user_info, root_user_id, system_user_id, path=':memory:', replica_path=None
+    ):
+        engine = self._create_engine(path)
+        replica_engine = self._create_engine(replica_path) if replica_path else None
+        super(SQLiteModel, self).__init__(
+            engine, default_user_info, root_user_id, system_user_id, replica_engine
+        )
+
+    @staticmethod
+    def _create_engine(path):
+        # Share the database between threads -- see
         # https://docs.sqlalchemy.org/en/13/dialects/sqlite.html#threading-pooling-behavior
-        engine = create_engine(
-            'sqlite:///:memory:',
+        return create_engine(
+            'sqlite:///' + path,
             strategy='threadlocal',
             encoding='utf-8',
             connect_args={'check_same_thread': False},
             poolclass=StaticPool,
         )
-        super(SQLiteModel, self).__init__(engine, default_user_info, root_user_id, system_user_id)
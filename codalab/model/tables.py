@@ -5,7 +5,7 @@ The SQLAlchemy table objects for the CodaLab bundle system tables.
 # This way, SQLAlchemy will automatically perform conversions to and from UTF-8
 # encoding, or use appropriate database engine-specific data types for Unicode
 # data. Currently, only worksheet.title uses the Unicode column type.
-from sqlalchemy import Column, ForeignKey, Index, MetaData, Table, UniqueConstraint
+from sqlalchemy import DDL, Column, ForeignKey, Index, MetaData, Table, UniqueConstraint, event
 from sqlalchemy.types import (
     BigInteger,
     Boolean,
@@ -77,6 +77,62 @@ bundle_metadata = Table(
     mysql_charset=TABLE_DEFAULT_CHARSET,
 )
 
+# Typed copies of the bundle metadata that is searched and sorted on most often, which is also
+# in bundle_metadata. Every bundle has a row, kept in sync by BundleModel.save_bundle and
+# BundleModel.update_bundle, and searches on these keys use it instead of bundle_metadata, whose
+# values are text that has to be cast for every comparison.
+# Substring searches of names (like bare keywords in bundle searches) use a full-text index:
+# - On MySQL, a FULLTEXT index with the ngram parser, which requires the default
+#   ngram_token_size of 2. Stopwords are disabled for it, since with the ngram parser they
+#   would drop all tokens containing them.
+# - On SQLite, an FTS5 table with the trigram tokenizer, kept in sync by triggers.
+# Both are only used to narrow down the rows that are then matched with LIKE, so searches
+# return the same results as LIKE on bundle_metadata did.
+bundle_search = Table(
+    'bundle_search',
+    db_metadata,
+    Column('bundle_uuid', String(63), ForeignKey(bundle.c.uuid), primary_key=True),
+    Column('name', Text, nullable=True),
+    Column('data_size', BigInteger, nullable=True),
+    Column('created', Integer, nullable=True),
+    # Double precision, since MySQL's FLOAT only has about 7 significant digits.
+    Column('time', Float(precision=53), nullable=True),
+    Column('request_queue', String(255), nullable=True),
+    # Text rather than String(255) like request_queue, since staged statuses can be longer and
+    # searches match them exactly; the prefix index covers the common statuses.
+    Column('staged_status', Text, nullable=True),
+    # Hash of the owner, command and dependencies of run bundles (see bundle_model.get_memo_key),
+    # which are looked up by it to find bundles to reuse with cl run --memo.
+    Column('memo_key', String(64), nullable=True),
+    Index('bundle_search_name_prefix_index', 'name', mysql_length=63),
+    Index('bundle_search_data_size_index', 'data_size'),
+    Index('bundle_search_created_index', 'created'),
+    Index('bundle_search_time_index', 'time'),
+    Index('bundle_search_request_queue_index', 'request_queue'),
+    Index('bundle_search_staged_status_prefix_index', 'staged_status', mysql_length=63),
+    Index('bundle_search_memo_key_index', 'memo_key'),
+    mysql_charset=TABLE_DEFAULT_CHARSET,
+)
+for statement in [
+    'SET SESSION innodb_ft_enable_stopword = OFF',
+    'CREATE FULLTEXT INDEX bundle_search_name_index ON bundle_search (name) WITH PARSER ngram',
+]:
+    event.listen(bundle_search, 'after_create', DDL(statement).execute_if(dialect='mysql'))
+for statement in [
+    "CREATE VIRTUAL TABLE bundle_search_fts USING fts5("
+    "name, content='bundle_search', content_rowid='rowid', tokenize='trigram')",
+    "CREATE TRIGGER bundle_search_insert AFTER INSERT ON bundle_search BEGIN "
+    "INSERT INTO bundle_search_fts(rowid, name) VALUES (new.rowid, new.name); END",
+    "CREATE TRIGGER bundle_search_delete AFTER DELETE ON bundle_search BEGIN "
+    "INSERT INTO bundle_search_fts(bundle_search_fts, rowid, name) "
+    "VALUES ('delete', old.rowid, old.name); END",
+    "CREATE TRIGGER bundle_search_update AFTER UPDATE ON bundle_search BEGIN "
+    "INSERT INTO bundle_search_fts(bundle_search_fts, rowid, name) "
+    "VALUES ('delete', old.rowid, old.name); "
+    "INSERT INTO bundle_search_fts(rowid, name) VALUES (new.rowid, new.name); END",
+]:
+    event.listen(bundle_search, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
 # For each child_uuid, we have: key = child_path, target = (parent_uuid, parent_path)
 bundle_dependency = Table(
     'bundle_dependency',
@@ -94,6 +150,9 @@ bundle_dependency = Table(
     # dependencies to bundles not (yet) in the system.
     Column('parent_uuid', String(63), nullable=False),
     Column('parent_path', Text, nullable=False),
+    # Needed to walk dependencies in both directions (see BundleModel.get_descendants).
+    Index('dependency_child_uuid_index', 'child_uuid'),
+    Index('dependency_parent_uuid_index', 'parent_uuid'),
     mysql_charset=TABLE_DEFAULT_CHARSET,
 )
 
@@ -206,8 +265,9 @@ worksheet_item = Table(
     Column('subworksheet_uuid', String(63), nullable=True),
     Column('value', Text, nullable=False),  # TODO: make this nullable
     Column('type', String(20), nullable=False),
-    Column('sort_key', Integer, nullable=True),
+    Column('sort_key', BigInteger, nullable=True),
     Index('worksheet_item_worksheet_uuid_index', 'worksheet_uuid'),
+    Index('worksheet_item_worksheet_uuid_sort_key_index', 'worksheet_uuid', 'sort_key'),
     Index('worksheet_item_bundle_uuid_index', 'bundle_uuid'),
     Index('worksheet_item_subworksheet_uuid_index', 'subworksheet_uuid'),
     mysql_charset=TABLE_DEFAULT_CHARSET,
@@ -12,12 +12,18 @@ from codalab.model.orm_object import ORMObject
 
 # We will keep worksheet items sorted in the database by maintining a sort_key
 # for each item that was batch-added to a worksheet by a call to update_worksheet_items.
-# These sort keys will be strictly upper-bounded by the maximum id at the time
-# at which the edit was BEGUN. This ensures that any worksheet items appended to
-# the sheet between the time the edit was begun and committed will have ids
-# greater than the maximum sort key.
+# These sort keys will be strictly upper-bounded by SORT_KEY_GAP times the maximum id at
+# the time at which the edit was BEGUN. An item without a sort key sorts as if its sort key
+# were SORT_KEY_GAP times its id. This ensures that any worksheet items appended to
+# the sheet between the time the edit was begun and committed will sort after the
+# edited items.
+# Sort keys are spaced SORT_KEY_GAP apart, so that items can be inserted between two others
+# without changing the sort keys of any other item (see BundleModel.add_worksheet_items).
+SORT_KEY_GAP = 2 ** 16
+
+
 def item_sort_key(item):
-    return item['id'] if item['sort_key'] is None else item['sort_key']
+    return item['id'] * SORT_KEY_GAP if item['sort_key'] is None else item['sort_key']
 
 
 class Worksheet(ORMObject):
@@ -3,9 +3,9 @@ import logging
 import mimetypes
 import os
 import re
-import sys
 import traceback
 import time
+import urllib.parse
 from io import BytesIO
 from http.client import HTTPResponse
 
@@ -23,6 +23,7 @@ from codalab.common import (
 )
 from codalab.lib import canonicalize, spec_util, worksheet_util, bundle_util
 from codalab.lib.beam.filesystems import LOCAL_USING_AZURITE, get_azure_bypass_conn_str
+from codalab.lib.download_manager import FileSection
 from codalab.worker.file_util import OpenIndexedArchiveFile, update_file_size
 from codalab.lib.server_util import (
     RequestSource,
@@ -54,10 +55,15 @@ from codalab.rest.users import UserSchema
 from codalab.rest.util import get_bundle_infos, get_resource_ids, resolve_owner_in_keywords
 from codalab.server.authenticated_plugin import AuthenticatedProtectedPlugin, ProtectedPlugin
 from codalab.worker.bundle_state import State
+from codalab.worker.compression import GZIP, negotiate_codec
 from codalab.worker.download_util import BundleTarget
 
 logger = logging.getLogger(__name__)
 
+# Files on local disk of at least this size are sent as they are, even to clients that accept
+# gzip, so that they can be sent without copying them through Python (see send_local_file).
+SENDFILE_MIN_SIZE = int(os.environ.get('CODALAB_SENDFILE_MIN_SIZE', 16 * 1024 * 1024))
+
 
 @get('/bundles/<uuid:re:%s>' % spec_util.UUID_STR, apply=ProtectedPlugin())
 def _fetch_bundle(uuid):
@@ -104,6 +110,8 @@ def _fetch_bundles():
         - `.floating              ` : Match bundles that aren't on any worksheet.
         - `.count                 ` : Count the number of bundles.
         - `.limit=10              ` : Limit the number of results to the top 10.
+        - `.cursor=<cursor>       ` : Fetch the page of results after the given cursor
+                                      (`.cursor=` for the first page).
      - `include_display_metadata`: `1` to include additional metadata helpful
        for displaying the bundle info, `0` to omit them. Default is `0`.
      - `include`: comma-separated list of related resources to include, such as "owner"
@@ -117,6 +125,9 @@ def _fetch_bundles():
         }
     }
     ```
+    When `.cursor` is used, the cursor of the next page is returned in
+    `meta.next_cursor`, which is null for the last page. Unlike `.offset`,
+    fetching a page this way takes the same time however deep it is.
     2. By bundle `command` and/or `dependencies` (for `--memoized` option in cl [run/mimic] command).
     When `dependencies` is not defined, the searching result will include bundles that match with command only.
 
@@ -135,6 +146,7 @@ def _fetch_bundles():
     descendant_depth = query_get_type(int, 'depth', None)
     command = query_get_type(str, 'command', '')
     dependencies = query_get_type(str, 'dependencies', '[]')
+    meta = {}
 
     if keywords:
         # Handle search keywords
@@ -145,6 +157,8 @@ def _fetch_bundles():
             return json_api_meta({}, {'result': search_result['result']})
         # If not aggregate this is a list
         bundle_uuids = search_result['result']
+        if 'next_cursor' in search_result:
+            meta['next_cursor'] = search_result['next_cursor']
     elif specs:
         # Resolve bundle specs
         bundle_uuids = canonicalize.get_bundle_uuids(
@@ -162,7 +176,10 @@ def _fetch_bundles():
     if descendant_depth is not None:
         bundle_uuids = local.model.get_self_and_descendants(bundle_uuids, depth=descendant_depth)
 
-    return build_bundles_document(bundle_uuids)
+    document = build_bundles_document(bundle_uuids)
+    if meta:
+        json_api_meta(document, meta)
+    return document
 
 
 def build_bundles_document(bundle_uuids):
@@ -925,17 +942,28 @@ def _fetch_bundle_contents_blob(uuid, path=''):
     """
     API to download the contents of a bundle or a subpath within a bundle.
 
-    For directories, this method always returns a tarred and gzipped archive of
-    the directory.
+    For directories, this method returns a tarred and compressed archive of
+    the directory. The archive is gzipped, unless the request has an
+    Accept-Encoding header preferring another codec that is enabled on the
+    server (such as `zstd`) and the bundle is stored on local disk.
+    If the `uncompressed` query parameter is set to 1 and the bundle is ready
+    (or failed or killed) and stored on local disk, the archive is not
+    compressed, and its size is sent in the Content-Length header.
 
     For files, if the request has an Accept-Encoding header containing gzip,
-    then the returned file is gzipped. Otherwise, the file is returned as-is.
+    then the returned file is gzipped, unless it is a file within a directory
+    bundle on blob storage (which would have to be decompressed and compressed
+    again). Otherwise, the file is returned as-is. Files on the server's disk are
+    also returned as-is when a range of them is requested or when they are large,
+    so that they can be sent without copying them through the REST server (with
+    sendfile, or by handing them off to the web server in front of it).
 
     HTTP Request headers:
     - `Range: bytes=<start>-<end>`: fetch bytes from the range
       `[<start>, <end>)`.
     - `Accept-Encoding: <encoding>`: indicate that the client can accept
-      encoding `<encoding>`. Currently only `gzip` encoding is supported.
+      encoding `<encoding>`. `gzip` is supported for files and directories,
+      and `zstd` for directories if enabled on the server.
 
     Query parameters:
     - `head`: number of lines to fetch from the beginning of the file.
@@ -944,6 +972,8 @@ def _fetch_bundle_contents_blob(uuid, path=''):
       Default is 0, meaning to fetch the entire file.
     - `max_line_length`: maximum number of characters to fetch from each line,
       if either `head` or `tail` is specified. Default is 128.
+    - `uncompressed`: Set to 1 to get directories as uncompressed tar archives
+      with a Content-Length, when possible (see above). Default is 0.
     - `support_redirect`: Set to 1 if the client supports bypassing the server
       and redirecting to another URL (such as Blob Storage). If so, the Target-Type and
       X-CodaLab-Target-Size headers will not be present in the response.
@@ -963,9 +993,10 @@ def _fetch_bundle_contents_blob(uuid, path=''):
     - `X-CodaLab-Target-Size: <size of the target>`
 
     HTTP Response headers (for directories):
-    - `Content-Disposition: attachment; filename=<bundle or directory name>.tar.gz`
-    - `Content-Type: application/gzip`
+    - `Content-Disposition: attachment; filename=<bundle or directory name>.[tar.gz|tar.zst|tar]`
+    - `Content-Type: [application/gzip|application/zstd|application/x-tar]`
     - `Content-Encoding: identity`
+    - `Content-Length: <size of the archive>` (uncompressed archives only)
     - `Access-Control-Allow-Origin: *`
     - `Target-Type: directory`
     - `X-CodaLab-Target-Size: <size of the target>`
@@ -984,9 +1015,11 @@ def _fetch_bundle_contents_blob(uuid, path=''):
         'support_redirect',
         default=1 if get_request_source() == RequestSource.WEB_BROWSER else 0,
     )
+    uncompressed = query_get_type(int, 'uncompressed', default=0)
     check_bundles_have_read_permission(local.model, request.user, [uuid])
     target = BundleTarget(uuid, path)
     fileobj = None
+    content_length = None
 
     try:
         target_info = local.download_manager.get_target_info(target, 0)
@@ -1032,18 +1065,37 @@ def _fetch_bundle_contents_blob(uuid, path=''):
             abort(http.client.BAD_REQUEST, 'Range not supported for directory blobs.')
         if head_lines or tail_lines:
             abort(http.client.BAD_REQUEST, 'Head and tail not supported for directory blobs.')
-        # Always tar and gzip directories
         gzipped_stream = False  # but don't set the encoding to 'gzip'
-        mimetype = "application/gzip"
-        filename += ".tar.gz"
-        if not should_redirect_url:
-            fileobj = local.download_manager.stream_tarred_gzipped_directory(target)
+        tarred_directory = None
+        if uncompressed and not should_redirect_url:
+            tarred_directory = local.download_manager.stream_tarred_directory(target)
+        if tarred_directory is not None:
+            fileobj, content_length = tarred_directory
+            mimetype = 'application/x-tar'
+            filename += '.tar'
+        else:
+            # Otherwise, tar and compress directories, with gzip unless the client accepts
+            # another codec. Web browsers get gzip, since users expect a .tar.gz file.
+            codec = GZIP
+            if not should_redirect_url:
+                if get_request_source() != RequestSource.WEB_BROWSER:
+                    codec = negotiate_codec(request.headers.get('Accept-Encoding')) or GZIP
+                fileobj, codec = local.download_manager.stream_tarred_compressed_directory(
+                    target, codec
+                )
+            mimetype = codec.content_type
+            filename += codec.archive_ext
     elif target_info['type'] == 'file':
         # Let's gzip to save bandwidth.
         # For simplicity, we do this even if the file is already a packed
         # archive (which should be relatively rare).
         # The browser will transparently decode the file.
-        gzipped_stream = request_accepts_gzip_encoding()
+        # Files within directories on blob storage are decompressed from the archive to
+        # be read, so they are sent as they are rather than compressed again in this
+        # process; gzip is only a preference of the client.
+        gzipped_stream = request_accepts_gzip_encoding() and not local.download_manager.gzipping_requires_recompression(
+            target
+        )
 
         # Since guess_type() will interpret '.tar.gz' as an 'application/x-tar' file
         # with 'gzip' encoding, which would usually go into the Content-Encoding
@@ -1056,8 +1108,19 @@ def _fetch_bundle_contents_blob(uuid, path=''):
             mimetype = 'application/octet-stream'
 
         if not should_redirect_url:
+            local_file_path = None
+            if not (head_lines or tail_lines):
+                local_file_path = local.download_manager.get_local_file_path(target)
             if byte_range and (head_lines or tail_lines):
                 abort(http.client.BAD_REQUEST, 'Head and range not supported on the same request.')
+            elif local_file_path is not None and (
+                byte_range
+                or not gzipped_stream
+                or target_info['size'] >= SENDFILE_MIN_SIZE
+                or get_sendfile_header() is not None
+            ):
+                gzipped_stream = False
+                fileobj = send_local_file(local_file_path, byte_range)
             elif byte_range:
                 start, end = byte_range
                 fileobj = local.download_manager.read_file_section(
@@ -1095,6 +1158,8 @@ def _fetch_bundle_contents_blob(uuid, path=''):
         # if request is for a subdir in a bundle then return 0
         size = 0
     response.set_header('X-Codalab-Target-Size', size)
+    if content_length is not None:
+        response.set_header('Content-Length', str(content_length))
 
     if should_redirect_url:
         # Redirect to SAS URL on Blob Storage.
@@ -1282,6 +1347,48 @@ def get_request_range():
     return int(start), int(end)
 
 
+def get_sendfile_header():
+    """
+    Returns the name of the header with which files on local disk are handed off to the
+    web server in front of the REST server, or None if they are sent by the REST server.
+    - If CODALAB_X_ACCEL_REDIRECT is set (to the prefix of an internal nginx location that
+      serves the root directory), files are handed off with X-Accel-Redirect.
+    - Otherwise, if CODALAB_X_SENDFILE is set to 1, they are handed off with X-Sendfile
+      (Apache mod_xsendfile, lighttpd).
+    """
+    if os.environ.get('CODALAB_X_ACCEL_REDIRECT'):
+        return 'X-Accel-Redirect'
+    if os.environ.get('CODALAB_X_SENDFILE') == '1':
+        return 'X-Sendfile'
+    return None
+
+
+def send_local_file(file_path, byte_range):
+    """
+    Returns the response body for the given file on local disk, or the requested range of it,
+    without copying its contents through Python.
+    The file is either handed off to the web server in front of the REST server (see
+    get_sendfile_header), which then also serves ranges, or returned as a FileSection that
+    gunicorn sends with os.sendfile.
+    """
+    file_path = os.path.abspath(file_path)
+    header = get_sendfile_header()
+    if header == 'X-Accel-Redirect':
+        prefix = os.environ['CODALAB_X_ACCEL_REDIRECT'].rstrip('/')
+        response.set_header(header, prefix + urllib.parse.quote(file_path))
+        return b''
+    elif header == 'X-Sendfile':
+        response.set_header(header, file_path)
+        return b''
+    if byte_range:
+        start, end = byte_range
+        fileobj = FileSection(file_path, start, end - start + 1)
+    else:
+        fileobj = FileSection(file_path)
+    response.set_header('Content-Length', str(fileobj.length))
+    return fileobj
+
+
 def request_accepts_gzip_encoding():
     # See rules for parsing here: https://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html
     # Browsers silently decode gzipped files, so we save some bandwidth.
@@ -1304,7 +1411,7 @@ def delete_bundles(uuids, force, recursive, data_only, dry_run):
     If |recursive|, add all bundles downstream too.
     If |data_only|, only remove from the bundle store, not the bundle metadata.
     """
-    relevant_uuids = local.model.get_self_and_descendants(uuids, depth=sys.maxsize)
+    relevant_uuids = local.model.get_self_and_descendants(uuids, depth=None)
     if not recursive:
         # If any descendants exist, then we only delete uuids if force = True.
         if (not force) and set(uuids) != set(relevant_uuids):
@@ -1362,7 +1469,7 @@ def delete_bundles(uuids, force, recursive, data_only, dry_run):
     # Delete the actual bundle
     if not dry_run:
         for bundle in bundles:
-            local.model.update_bundle(bundle, {'metadata': {'data_size': 0}})
+            local.model.update_bundle_data_size(bundle, 0)
         if not data_only:
             # Delete bundle metadata.
             local.model.delete_bundles(relevant_uuids)
@@ -1385,8 +1492,6 @@ def delete_bundles(uuids, force, recursive, data_only, dry_run):
             ):
                 local.bundle_store.cleanup(bundle_location, dry_run)
 
-    # Update user disk used.
-    local.model.update_user_disk_used(request.user.user_id)
     return relevant_uuids
 
 
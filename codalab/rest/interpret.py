@@ -46,7 +46,7 @@ from codalab.rest.worksheet_block_schemas import (
 from codalab.worker.download_util import BundleTarget
 
 
-@post('/interpret/search', apply=ProtectedPlugin())
+@post('/interpret/search', apply=ProtectedPlugin(), read_only=True)
 def _interpret_search():
     """
     Returns worksheet items given a search query for bundles.
@@ -69,7 +69,7 @@ def _interpret_search():
     return {'response': interpret_search(query['keywords'])}
 
 
-@post('/interpret/wsearch', apply=ProtectedPlugin())
+@post('/interpret/wsearch', apply=ProtectedPlugin(), read_only=True)
 def _interpret_wsearch():
     """
     Returns worksheets information given a search query for worksheets.
@@ -110,7 +110,7 @@ def _interpret_wsearch():
     return {'response': interpret_wsearch(query['keywords'])}
 
 
-@post('/interpret/file-genpaths', apply=ProtectedPlugin())
+@post('/interpret/file-genpaths', apply=ProtectedPlugin(), read_only=True)
 def _interpret_file_genpaths():
     """
     Interpret a file genpath.
@@ -144,7 +144,7 @@ def _interpret_file_genpaths():
     return {'data': results}
 
 
-@post('/interpret/genpath-table-contents', apply=ProtectedPlugin())
+@post('/interpret/genpath-table-contents', apply=ProtectedPlugin(), read_only=True)
 def _interpret_genpath_table_contents():
     """
     Takes a table and fills in unresolved genpath specifications.
@@ -12,10 +12,14 @@ from codalab.lib import spec_util
 from codalab.objects.permission import check_bundle_have_run_permission
 from codalab.server.authenticated_plugin import AuthenticatedProtectedPlugin
 from codalab.worker.bundle_state import BundleCheckinState
+from codalab.worker.compression import accept_encoding_header
 from codalab.worker.main import DEFAULT_EXIT_AFTER_NUM_RUNS
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of Docker images of staged bundles to suggest to a worker for pre-pulling
+MAX_IMAGE_HINTS = 5
+
 
 @post("/workers/<worker_id>/checkin", name="worker_checkin", apply=AuthenticatedProtectedPlugin())
 def checkin(worker_id):
@@ -23,6 +27,11 @@ def checkin(worker_id):
     Checks in with the bundle service, storing information about the worker.
     Waits for a message for the worker for WAIT_TIME_SECS seconds. Returns the
     message or None if there isn't one.
+
+    The response contains `image_hints`, the Docker images most requested by
+    staged bundles, which idle workers can pull ahead of time, and
+    `accept_encoding`, the codecs that the server accepts uploads of bundle
+    contents in, in the format of an Accept-Encoding header.
     """
 
     # Old workers might not have all the fields, so allow subsets to be missing.
@@ -72,6 +81,13 @@ def checkin(worker_id):
         except Exception as e:
             logger.info("Exception in REST checkin: {}".format(e))
 
+    try:
+        image_hints = local.model.get_staged_docker_images(MAX_IMAGE_HINTS)
+    except Exception as e:
+        logger.info("Exception in REST checkin when fetching image hints: {}".format(e))
+        image_hints = []
+    return {'image_hints': image_hints, 'accept_encoding': accept_encoding_header()}
+
 
 def check_reply_permission(worker_id, socket_id):
     """
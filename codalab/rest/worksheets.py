@@ -351,8 +351,7 @@ def get_worksheet_info(uuid, fetch_items=False, fetch_permissions=True):
 
     # Update worksheet item sort keys if needed.
     if items and any(item['sort_key'] is None for item in items):
-        items = [Worksheet.Item.as_tuple(i) for i in items]  # convert items
-        update_worksheet_items(result, items, convert_items=False)  # update sort keys
+        local.model.fill_worksheet_item_sort_keys(uuid)  # update sort keys
         worksheet = local.model.get_worksheet(uuid, fetch_items=fetch_items)  # get updated info
         result = worksheet.to_dict()
 
@@ -31,6 +31,9 @@ logger = logging.getLogger(__name__)
 SECONDS_PER_DAY = 60 * 60 * 24
 # Fail unresponsive bundles in uploading, staged and running state after this many days.
 BUNDLE_TIMEOUT_DAYS = 60
+
+# How often to repair the disk used by users if it drifted from the total size of their bundles.
+DISK_USED_RECONCILE_SECONDS = 60 * 60
 # Impose a minimum container request memory 4mb (4 * 1024 * 1024 bytes), same as docker's minimum allowed value
 # https://docs.docker.com/config/containers/resource_constraints/#limit-a-containers-access-to-memory
 # When using the REST api, it is allowed to set Memory to 0 but that means the container has unbounded
@@ -73,6 +76,8 @@ class BundleManager(object):
         self._make_uuids_lock = threading.Lock()
         self._make_uuids = set()
 
+        self._last_disk_used_reconcile_time = 0.0
+
         def parse(to_value, field):
             return to_value(config[field]) if field in config else None
 
@@ -115,6 +120,7 @@ class BundleManager(object):
         self._make_bundles()
         self._schedule_run_bundles()
         self._fail_unresponsive_bundles()
+        self._reconcile_disk_used()
 
     def _set_staged_status(self, bundle, staged_status):
         self._model.update_bundle(bundle, {'metadata': {'staged_status': staged_status}})
@@ -900,6 +906,19 @@ class BundleManager(object):
                     {'state': State.FAILED, 'metadata': {'failure_message': failure_message}},
                 )
 
+    def _reconcile_disk_used(self):
+        """
+        Every DISK_USED_RECONCILE_SECONDS, repair the disk used by users whose disk used has
+        drifted from the total size of their bundles. It is otherwise only updated incrementally.
+        """
+        now = time.time()
+        if now - self._last_disk_used_reconcile_time < DISK_USED_RECONCILE_SECONDS:
+            return
+        self._last_disk_used_reconcile_time = now
+        drifts = self._model.reconcile_user_disk_used()
+        if drifts:
+            logger.info('Repaired the disk used of %d users', len(drifts))
+
     def _schedule_run_bundles(self):
         """
         This method implements a state machine. The states are:
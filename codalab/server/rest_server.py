@@ -72,6 +72,10 @@ class SaveEnvironmentPlugin(object):
         self.manager = manager
 
     def apply(self, callback, route):
+        # Read-only model methods of GET requests, and of routes declared with read_only=True,
+        # can query the read replica (see EngineRouter).
+        use_replica = route.method == 'GET' or route.config.get('read_only', False)
+
         def wrapper(*args, **kwargs):
             # Note that the model is created here during the first request to
             # the server. This is intentional to ensure that any MySQL engine
@@ -83,7 +87,22 @@ class SaveEnvironmentPlugin(object):
             local.bundle_store = self.manager.bundle_store()
             local.config = self.manager.config
             local.emailer = self.manager.emailer
-            return callback(*args, **kwargs)
+            # Model reads are cached until the end of the request (see RequestCache).
+            local.model.request_cache.begin()
+            if use_replica:
+                local.model.engine_router.begin()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                local.model.engine_router.end()
+                stats = local.model.request_cache.end()
+                logger.info(
+                    '%s %s made %d queries (%d reads served from the request cache)',
+                    request.method,
+                    request.path,
+                    stats['queries'],
+                    stats['hits'],
+                )
 
         return wrapper
 
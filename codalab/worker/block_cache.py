@@ -0,0 +1,239 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from apache_beam.io.filesystem import CompressionTypes
+from apache_beam.io.filesystems import FileSystems
+
+logger = logging.getLogger(__name__)
+
+
+class BlockCache(object):
+    """
+    An LRU cache of fixed-size, aligned blocks of files on blob storage, bounded by the total
+    size of the cached blocks. The cache is shared by all files read through CachedBlobFile,
+    whose file keys must change whenever the contents of the file do.
+    """
+
+    DEFAULT_BLOCK_SIZE = 1024 * 1024
+    DEFAULT_MAX_SIZE_BYTES = int(
+        os.environ.get('CODALAB_BLOCK_CACHE_MAX_SIZE_BYTES', 512 * 1024 * 1024)
+    )
+
+    def __init__(
+        self, max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES, block_size: int = DEFAULT_BLOCK_SIZE
+    ):
+        self.block_size = block_size
+        self._max_size_bytes = max_size_bytes
+        # (file key, block index) => block contents, in least recently used order.
+        self._blocks = OrderedDict()  # type: OrderedDict
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_key: Hashable, block_index: int) -> Optional[bytes]:
+        with self._lock:
+            block = self._blocks.get((file_key, block_index))
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end((file_key, block_index))
+            self.hits += 1
+            return block
+
+    def contains(self, file_key: Hashable, block_index: int) -> bool:
+        with self._lock:
+            return (file_key, block_index) in self._blocks
+
+    def put(self, file_key: Hashable, block_index: int, block: bytes):
+        with self._lock:
+            old_block = self._blocks.pop((file_key, block_index), None)
+            if old_block is not None:
+                self._size -= len(old_block)
+            self._blocks[(file_key, block_index)] = block
+            self._size += len(block)
+            while self._size > self._max_size_bytes and self._blocks:
+                _, evicted = self._blocks.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'num_blocks': len(self._blocks),
+                'size_bytes': self._size,
+            }
+
+
+class CachedBlobFile(io.RawIOBase):
+    """
+    A read-only, seekable file object that reads a blob through a BlockCache.
+
+    Every read is served from whole blocks of the cache, and runs of missing blocks are fetched
+    from the underlying file with one ranged read each. When reads are sequential, fetches are
+    extended to read ahead a number of blocks that doubles with every sequential read (up to
+    MAX_READ_AHEAD_BLOCKS), and drops back to zero on a random access. This turns the many small
+    reads of small files in an archive into few requests, without reading ahead on random access.
+    """
+
+    MAX_READ_AHEAD_BLOCKS = 16
+
+    def __init__(self, fileobj: io.IOBase, file_key: Hashable, cache: BlockCache):
+        """
+        Args:
+            fileobj: Underlying seekable file object. Reads go directly to its raw stream when it
+                is buffered, since the cache does the buffering.
+            file_key: Identifies the contents of the file in the cache.
+            cache: Block cache to read through.
+        """
+        self._fileobj = fileobj
+        self._raw = getattr(fileobj, 'raw', fileobj)
+        self._file_key = file_key
+        self._cache = cache
+        self._pos = 0
+        self._raw.seek(0, io.SEEK_END)
+        self._size = self._raw.tell()
+        # Offset where the last read ended, to detect sequential reads.
+        self._last_read_end = None  # type: Optional[int]
+        self._read_ahead_blocks = 0
+        self.name = getattr(fileobj, 'name', None)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self._size + offset
+        else:
+            raise ValueError("Invalid whence: %s" % whence)
+        return self._pos
+
+    def readinto(self, b):
+        start = self._pos
+        end = min(start + len(b), self._size)
+        if start >= end:
+            return 0
+        if start == self._last_read_end:
+            self._read_ahead_blocks = min(
+                max(1, 2 * self._read_ahead_blocks), self.MAX_READ_AHEAD_BLOCKS
+            )
+        else:
+            self._read_ahead_blocks = 0
+
+        block_size = self._cache.block_size
+        first_block, last_block = start // block_size, (end - 1) // block_size
+        blocks = self._get_blocks(first_block, last_block)
+        data = b''.join(blocks)[start - first_block * block_size : end - first_block * block_size]
+        b[: len(data)] = data
+        self._pos = self._last_read_end = end
+        return len(data)
+
+    def _get_blocks(self, first_block: int, last_block: int) -> List[bytes]:
+        """Returns the contents of blocks first_block to last_block (inclusive)."""
+        blocks = {}  # type: Dict[int, bytes]
+        missing = []  # type: List[int]
+        for index in range(first_block, last_block + 1):
+            block = self._cache.get(self._file_key, index)
+            if block is None:
+                missing.append(index)
+            else:
+                blocks[index] = block
+        for run_start, run_end in self._runs(missing):
+            if run_end == last_block:
+                run_end = self._extend_read_ahead(run_end)
+            blocks.update(self._fetch(run_start, run_end))
+        return [blocks[index] for index in range(first_block, last_block + 1)]
+
+    @staticmethod
+    def _runs(indices: List[int]) -> List[Tuple[int, int]]:
+        """Groups sorted block indices into runs of consecutive blocks."""
+        runs = []  # type: List[Tuple[int, int]]
+        for index in indices:
+            if runs and runs[-1][1] == index - 1:
+                runs[-1] = (runs[-1][0], index)
+            else:
+                runs.append((index, index))
+        return runs
+
+    def _extend_read_ahead(self, last_block: int) -> int:
+        """Extends a fetch ending at last_block by the current read-ahead, stopping at the end
+        of the file and at blocks that are already cached."""
+        num_blocks = (self._size + self._cache.block_size - 1) // self._cache.block_size
+        for _ in range(self._read_ahead_blocks):
+            if last_block + 1 >= num_blocks or self._cache.contains(self._file_key, last_block + 1):
+                break
+            last_block += 1
+        return last_block
+
+    def _fetch(self, first_block: int, last_block: int) -> Dict[int, bytes]:
+        """Reads blocks first_block to last_block (inclusive) from the underlying file with a
+        single ranged read, and adds them to the cache."""
+        block_size = self._cache.block_size
+        start = first_block * block_size
+        length = min((last_block + 1) * block_size, self._size) - start
+        self._raw.seek(start)
+        parts = []
+        while length > 0:
+            part = self._raw.read(length)
+            if not part:
+                break
+            parts.append(part)
+            length -= len(part)
+        data = b''.join(parts)
+        blocks = {}
+        for index in range(first_block, last_block + 1):
+            offset = (index - first_block) * block_size
+            blocks[index] = data[offset : offset + block_size]
+            self._cache.put(self._file_key, index, blocks[index])
+        return blocks
+
+    def close(self):
+        if not self.closed:
+            self._fileobj.close()
+        super().close()
+
+
+_block_cache = None  # type: Optional[BlockCache]
+_block_cache_lock = threading.Lock()
+
+
+def get_block_cache() -> BlockCache:
+    """Returns the block cache shared by the process, creating it on first use."""
+    global _block_cache
+    with _block_cache_lock:
+        if _block_cache is None:
+            _block_cache = BlockCache()
+        return _block_cache
+
+
+def blob_version(path: str) -> str:
+    """Identifies the current contents of the blob at the given path without reading it."""
+    version = '%s:%s' % (FileSystems.checksum(path), FileSystems.last_updated(path))
+    return hashlib.sha1(version.encode()).hexdigest()
+
+
+def open_cached_blob(path: str) -> CachedBlobFile:
+    """Opens the blob at the given path for reading through the shared block cache."""
+    # Blocks are cached by the version of the blob, so a bundle that is uploaded again isn't
+    # read from the blocks of its old contents, which are evicted once unused.
+    file_key = (path, blob_version(path))
+    fileobj = FileSystems.open(path, compression_type=CompressionTypes.UNCOMPRESSED)
+    return CachedBlobFile(fileobj, file_key, get_block_cache())
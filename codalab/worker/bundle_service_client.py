@@ -10,7 +10,8 @@ import urllib.parse
 import urllib.error
 
 from .rest_client import RestClient, RestClientException
-from .file_util import tar_gzip_directory
+from .compression import accept_encoding_header, upload_codec
+from .file_util import tar_compress_directory
 from codalab.common import URLOPEN_TIMEOUT_SECONDS, ensure_str, urlopen_with_retry
 
 
@@ -73,6 +74,8 @@ class BundleServiceClient(RestClient):
         self._authorization_lock = threading.Lock()
         self._access_token = None
         self._token_expiration_time = None
+        # Codecs that the server accepts uploads in, as advertised in its checkin responses.
+        self._server_accept_encoding = None
 
         base_url += '/rest'
         super(BundleServiceClient, self).__init__(base_url)
@@ -124,9 +127,12 @@ class BundleServiceClient(RestClient):
 
     @wrap_exception('Unable to check in with bundle service')
     def checkin(self, worker_id, request_data):
-        return self._make_request(
+        response = self._make_request(
             'POST', self._worker_url_prefix(worker_id) + '/checkin', data=request_data
         )
+        if response:
+            self._server_accept_encoding = response.get('accept_encoding')
+        return response
 
     @wrap_exception('Unable to reply to message from bundle service')
     def reply(self, worker_id, socket_id, message):
@@ -156,12 +162,17 @@ class BundleServiceClient(RestClient):
     def update_bundle_contents(
         self, worker_id, uuid, path, exclude_patterns, store, progress_callback
     ):
-        with closing(tar_gzip_directory(path, exclude_patterns=exclude_patterns)) as fileobj:
+        # The server unpacks the archive according to the extension of the file name. Servers
+        # that haven't advertised other codecs (such as older ones) only get gzip.
+        codec = upload_codec(self._server_accept_encoding)
+        with closing(
+            tar_compress_directory(path, codec, exclude_patterns=exclude_patterns)
+        ) as fileobj:
             self._upload_with_chunked_encoding(
                 'PUT',
                 '/bundles/' + uuid + '/contents/blob/',
                 query_params={
-                    'filename': 'bundle.tar.gz',
+                    'filename': 'bundle' + codec.archive_ext,
                     'finalize_on_success': 0,
                     'store': store or '',
                 },
@@ -197,7 +208,7 @@ class BundleServiceClient(RestClient):
             'GET',
             '/bundles/' + uuid + '/contents/blob/' + path,
             query_params={'support_redirect': 1},
-            headers={'Accept-Encoding': 'gzip'},
+            headers={'Accept-Encoding': accept_encoding_header()},
             return_response=True,
             timeout_seconds=URLOPEN_TIMEOUT_SECONDS * 2,
         )
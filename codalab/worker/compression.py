@@ -0,0 +1,313 @@
+"""
+Compression codecs used to transfer bundle contents.
+
+gzip is understood by every client, server and worker, and stays the default. zstd compresses
+and decompresses several times faster and can use several cores, but it requires the zstandard package
+and is opt-in: it is only used when it is listed in the CODALAB_COMPRESSION_CODECS environment
+variable (for example "zstd,gzip", in order of preference) on both ends of a transfer. Which
+codec is used for a transfer is negotiated with the Accept-Encoding header, so clients and
+servers that only know gzip keep working.
+"""
+import os
+import shutil
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Deque, Dict, IO, List, Optional
+
+from codalab.worker.un_gzip_stream import BytesBuffer, UnGzipStream, UnZstdStream
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None  # type: ignore
+
+# Default compression level for zstd. Level 3 is zstd's default, and compresses about as well as
+# gzip -6 at several times the speed.
+ZSTD_LEVEL = 3
+# Default compression level for gzip, which is also gzip's default.
+GZIP_LEVEL = 6
+
+# Number of threads to compress each stream with, unless set with the CODALAB_COMPRESSION_THREADS
+# environment variable. The REST server compresses a stream for every concurrent download, so it
+# compresses each of them with a single thread. The worker and the CLI, which only compress a few
+# streams at a time, call use_all_cores() to compress with all cores.
+_default_threads = 1
+
+
+def use_all_cores() -> None:
+    """Compresses each stream with as many threads as there are cores by default."""
+    global _default_threads
+    _default_threads = os.cpu_count() or 1
+
+
+def compression_threads() -> int:
+    """Returns the number of threads to compress each stream with."""
+    return max(1, int(os.environ.get('CODALAB_COMPRESSION_THREADS', _default_threads)))
+
+
+def pigz_path() -> Optional[str]:
+    """Returns the path of the pigz executable, a parallel gzip, if it is installed."""
+    return shutil.which('pigz')
+
+
+class Codec(object):
+    """A compression format, as used for Content-Encoding and for compressed tar archives."""
+
+    # Token used in the Accept-Encoding and Content-Encoding headers.
+    name = ''
+    # Compression argument of un_tar_directory.
+    tar_compression = ''
+    # Extension of a compressed tar archive.
+    archive_ext = ''
+    # Content-Type of a compressed tar archive.
+    content_type = ''
+    # Compression level used unless set with the CODALAB_<NAME>_LEVEL environment variable.
+    default_level = 0
+
+    def is_available(self) -> bool:
+        return True
+
+    def level(self) -> int:
+        """Returns the compression level to compress with."""
+        return int(os.environ.get('CODALAB_%s_LEVEL' % self.name.upper(), self.default_level))
+
+    def compressor(self, level: Optional[int] = None):
+        """Returns an object with compress(data) and flush() methods, which compresses at the
+        given level (by default, self.level())."""
+        raise NotImplementedError
+
+    def decompress_stream(self, fileobj: IO[bytes]) -> IO[bytes]:
+        """Returns a file-like object containing the decompressed contents of fileobj."""
+        raise NotImplementedError
+
+    def compress_stream(self, fileobj: IO[bytes], level: Optional[int] = None) -> IO[bytes]:
+        """Returns a file-like object containing the contents of fileobj, compressed at the
+        given level (by default, self.level())."""
+        return CompressStream(fileobj, self.compressor(level))
+
+
+class GzipCodec(Codec):
+    name = 'gzip'
+    tar_compression = 'gz'
+    archive_ext = '.tar.gz'
+    content_type = 'application/gzip'
+    default_level = GZIP_LEVEL
+
+    def compressor(self, level=None):
+        level = self.level() if level is None else level
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def decompress_stream(self, fileobj):
+        return UnGzipStream(fileobj)
+
+    def compress_stream(self, fileobj, level=None):
+        threads = compression_threads()
+        if threads > 1:
+            return ParallelGzipStream(fileobj, threads, self.level() if level is None else level)
+        return super().compress_stream(fileobj, level)
+
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+    tar_compression = 'zst'
+    archive_ext = '.tar.zst'
+    content_type = 'application/zstd'
+    default_level = ZSTD_LEVEL
+
+    def is_available(self):
+        return zstandard is not None
+
+    def compressor(self, level=None):
+        level = self.level() if level is None else level
+        return zstandard.ZstdCompressor(level=level, threads=compression_threads()).compressobj()
+
+    def decompress_stream(self, fileobj):
+        return UnZstdStream(fileobj)
+
+
+GZIP = GzipCodec()
+ZSTD = ZstdCodec()
+CODECS = {codec.name: codec for codec in [GZIP, ZSTD]}  # type: Dict[str, Codec]
+
+
+class CompressStream(BytesIO):
+    """A stream that compresses a file in chunks with the given compressor."""
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, fileobj: IO[bytes], compressor):
+        self._input = fileobj
+        self._compressor = compressor
+        self._buffer = BytesBuffer()
+        self._finished = False
+
+    def read(self, num_bytes=None):
+        while not self._finished and (num_bytes is None or len(self._buffer) < num_bytes):
+            chunk = self._input.read(self.CHUNK_SIZE)
+            if chunk:
+                self._buffer.write(self._compressor.compress(chunk))
+            else:
+                self._buffer.write(self._compressor.flush())
+                self._finished = True
+        if num_bytes is None:
+            num_bytes = len(self._buffer)
+        return self._buffer.read(num_bytes)
+
+    def close(self):
+        self._input.close()
+        super().close()
+
+
+class ParallelGzipStream(BytesIO):
+    """
+    A stream that gzips a file in chunks using several threads, the way pigz does.
+
+    The input is split into blocks that are deflated independently, each using the last 32 KiB
+    of the block before it as the dictionary, so the compression ratio is nearly that of gzip.
+    Every block but the last ends with a sync flush, which ends it on a byte boundary, so the
+    compressed blocks concatenate into one deflate stream. The output is a single standard gzip
+    member. zlib releases the GIL while compressing, so the threads run in parallel.
+    """
+
+    BLOCK_SIZE = 1024 * 1024
+    DICT_SIZE = 32 * 1024
+    # Header of a gzip member with no file name or modification time, like gzip -n writes.
+    HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+    def __init__(self, fileobj: IO[bytes], threads: int, level: int = GZIP_LEVEL):
+        self._input = fileobj
+        self._level = level
+        self._executor = ThreadPoolExecutor(threads)
+        # Blocks being compressed, in input order. Limits how far ahead of the reader we get.
+        self._pending = deque()  # type: Deque
+        self._max_pending = 2 * threads
+        self._buffer = BytesBuffer()
+        self._buffer.write(self.HEADER)
+        self._dictionary = b''
+        self._crc = 0
+        self._size = 0
+        self._input_finished = False
+        self._finished = False
+
+    def _compress_block(self, block: bytes, dictionary: bytes, last: bool) -> bytes:
+        if dictionary:
+            compressor = zlib.compressobj(
+                self._level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary
+            )
+        else:
+            compressor = zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+        )
+
+    def _submit_blocks(self):
+        """Reads and submits input blocks until enough are pending."""
+        while not self._input_finished and len(self._pending) < self._max_pending:
+            block = self._read_block()
+            # Whether a block is the last one is only known once the next read returns nothing,
+            # so an empty final block finishes the deflate stream.
+            last = not block
+            self._input_finished = last
+            self._crc = zlib.crc32(block, self._crc)
+            self._size += len(block)
+            self._pending.append(
+                self._executor.submit(self._compress_block, block, self._dictionary, last)
+            )
+            self._dictionary = (self._dictionary + block)[-self.DICT_SIZE :]
+
+    def _read_block(self) -> bytes:
+        parts = []
+        remaining = self.BLOCK_SIZE
+        while remaining > 0:
+            part = self._input.read(remaining)
+            if not part:
+                break
+            parts.append(part)
+            remaining -= len(part)
+        return b''.join(parts)
+
+    def read(self, num_bytes=None):
+        while not self._finished and (num_bytes is None or len(self._buffer) < num_bytes):
+            self._submit_blocks()
+            if self._pending:
+                self._buffer.write(self._pending.popleft().result())
+            else:
+                self._buffer.write(struct.pack('<II', self._crc, self._size & 0xFFFFFFFF))
+                self._finished = True
+                self._executor.shutdown(wait=False)
+        if num_bytes is None:
+            num_bytes = len(self._buffer)
+        return self._buffer.read(num_bytes)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._input.close()
+        super().close()
+
+
+def get_codec(name: str) -> Optional[Codec]:
+    """Returns the codec with the given Content-Encoding name, or None if it isn't known."""
+    return CODECS.get(name.strip().lower())
+
+
+def enabled_codecs() -> List[Codec]:
+    """Returns the codecs that may be used for transfers, in order of preference. gzip is always
+    enabled, so that clients and servers that only know gzip keep working."""
+    names = os.environ.get('CODALAB_COMPRESSION_CODECS', GZIP.name).split(',')
+    codecs = [get_codec(name) for name in names]
+    result = [codec for codec in codecs if codec is not None and codec.is_available()]
+    if GZIP not in result:
+        result.append(GZIP)
+    return result
+
+
+def upload_codec(server_accept_encoding: Optional[str]) -> Codec:
+    """Returns the codec to upload archives with, given the Accept-Encoding that the server
+    advertised, or None if it didn't advertise any (servers that only know gzip don't)."""
+    return negotiate_codec(server_accept_encoding) or GZIP
+
+
+def accept_encoding_header() -> str:
+    """Returns the Accept-Encoding header advertising the enabled codecs."""
+    return ', '.join(codec.name for codec in enabled_codecs())
+
+
+def negotiate_codec(accept_encoding: Optional[str]) -> Optional[Codec]:
+    """
+    Returns the enabled codec that the given Accept-Encoding header prefers, or None if it
+    accepts none of them. Codecs the header gives the same weight are picked in the order of
+    enabled_codecs().
+    See rules for parsing here: https://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html
+    """
+    if not accept_encoding:
+        return None
+    weights = {}  # type: Dict[str, float]
+    for encoding in accept_encoding.split(','):
+        name, _, params = encoding.strip().partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best = None
+    best_weight = 0.0
+    for codec in enabled_codecs():
+        weight = weights.get(codec.name, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = codec, weight
+    return best
+
+
+def codec_for_content_type(content_type: Optional[str]) -> Codec:
+    """Returns the codec of a compressed tar archive with the given Content-Type. Archives
+    without a known Content-Type are gzipped, as they always were before zstd was added."""
+    for codec in CODECS.values():
+        if content_type and content_type.split(';')[0].strip() == codec.content_type:
+            return codec
+    return GZIP
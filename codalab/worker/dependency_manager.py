@@ -14,6 +14,7 @@ import codalab.worker.pyjson
 from .bundle_service_client import BundleServiceClient
 from codalab.lib.formatting import size_str
 from codalab.worker.file_util import remove_path
+from codalab.worker.compression import codec_for_content_type
 from codalab.worker.un_tar_directory import un_tar_directory
 from codalab.worker.fsm import BaseDependencyManager, DependencyStage, StateTransitioner
 from codalab.worker.worker_thread import ThreadDict
@@ -491,7 +492,9 @@ class DependencyManager(StateTransitioner, BaseDependencyManager):
                 else:
                     os.remove(dependency_path)
             if target_type == 'directory':
-                un_tar_directory(fileobj, dependency_path, 'gz')
+                # Directories are sent as gzipped archives unless another codec was negotiated.
+                codec = codec_for_content_type(fileobj.headers.get('Content-Type'))
+                un_tar_directory(fileobj, dependency_path, codec.tar_compression)
             else:
                 with open(dependency_path, 'wb') as f:
                     logger.debug('copying file to %s', dependency_path)
@@ -0,0 +1,201 @@
+"""
+Manifests of bundle directories on local disk.
+
+A manifest records the path, size, mode, modification time and link target of every entry in a
+directory, in a SQLite database stored next to it (at <directory>.manifest.sqlite). It is written
+when a bundle is finalized, so that its size, target info and listings can be served without
+walking or stat'ing the directory, which is slow for bundles with millions of files, especially
+on NFS.
+
+A manifest is only used while the modification time and inode of the directory are the ones it
+was written for, so one for a directory that has been replaced or had entries added or removed
+at the top level is ignored and removed.
+"""
+import logging
+import os
+import sqlite3
+import stat
+from typing import Iterator, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_SUFFIX = '.manifest.sqlite'
+
+
+def get_manifest_path(directory_path: str) -> str:
+    return directory_path + MANIFEST_SUFFIX
+
+
+class DirectoryManifest(object):
+    """A manifest of a directory. Use DirectoryManifest.write() and DirectoryManifest.open()
+    to get one."""
+
+    # Number of entries inserted at once when writing a manifest.
+    INSERT_BATCH_SIZE = 10000
+
+    def __init__(self, directory_path: str, connection: sqlite3.Connection):
+        self.directory_path = directory_path
+        self._connection = connection
+
+    @staticmethod
+    def _directory_key(directory_path: str) -> str:
+        """Returns what identifies the current version of the directory."""
+        stat_result = os.stat(directory_path)
+        return '%d:%d' % (stat_result.st_ino, stat_result.st_mtime_ns)
+
+    @classmethod
+    def write(cls, directory_path: str) -> 'DirectoryManifest':
+        """Walks the given directory and writes its manifest, replacing any existing one."""
+        manifest_path = get_manifest_path(directory_path)
+        tmp_path = manifest_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.executescript(
+                '''
+                CREATE TABLE entries (
+                    path TEXT PRIMARY KEY,
+                    parent TEXT,
+                    size INTEGER,
+                    mode INTEGER,
+                    mtime REAL,
+                    link TEXT
+                );
+                CREATE INDEX entries_parent ON entries (parent);
+                CREATE TABLE properties (key TEXT PRIMARY KEY, value TEXT);
+                '''
+            )
+            key = cls._directory_key(directory_path)
+            total_size = 0
+            batch = []
+            for row in cls._walk(directory_path):
+                total_size += row[2]
+                batch.append(row)
+                if len(batch) >= cls.INSERT_BATCH_SIZE:
+                    connection.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)', batch)
+                    batch = []
+            connection.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)', batch)
+            connection.executemany(
+                'INSERT INTO properties VALUES (?, ?)',
+                [('directory_key', key), ('total_size', str(total_size))],
+            )
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(tmp_path, manifest_path)
+        manifest = cls.open(directory_path)
+        assert manifest is not None
+        return manifest
+
+    @staticmethod
+    def _walk(
+        directory_path: str,
+    ) -> Iterator[Tuple[str, Optional[str], int, int, float, Optional[str]]]:
+        """Yields a row for every entry of the directory, including itself (with path '').
+        Symlinks to directories are not followed."""
+        stat_result = os.lstat(directory_path)
+        yield ('', None, stat_result.st_size, stat_result.st_mode, stat_result.st_mtime, None)
+        pending = ['']
+        while pending:
+            parent = pending.pop()
+            with os.scandir(os.path.join(directory_path, parent)) as it:
+                for entry in it:
+                    path = parent + '/' + entry.name if parent else entry.name
+                    stat_result = entry.stat(follow_symlinks=False)
+                    link = os.readlink(entry.path) if stat.S_ISLNK(stat_result.st_mode) else None
+                    yield (
+                        path,
+                        parent,
+                        stat_result.st_size,
+                        stat_result.st_mode,
+                        stat_result.st_mtime,
+                        link,
+                    )
+                    if stat.S_ISDIR(stat_result.st_mode):
+                        pending.append(path)
+
+    @classmethod
+    def open(cls, directory_path: str) -> Optional['DirectoryManifest']:
+        """Returns the manifest of the given directory, or None if there is none or if it is out
+        of date, in which case it is removed."""
+        manifest_path = get_manifest_path(directory_path)
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            connection = sqlite3.connect('file:%s?mode=ro' % manifest_path, uri=True)
+            row = connection.execute(
+                "SELECT value FROM properties WHERE key = 'directory_key'"
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Ignoring unreadable manifest %s: %s", manifest_path, e)
+            return None
+        if os.path.isdir(directory_path) and row and row[0] == cls._directory_key(directory_path):
+            return cls(directory_path, connection)
+        connection.close()
+        logger.info("Removing out of date manifest %s", manifest_path)
+        remove_manifest(directory_path)
+        return None
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def get_total_size(self) -> int:
+        """Returns the total size of the directory, which is the sum of the sizes of all of its
+        entries (not following symlinks), like path_util.get_size."""
+        row = self._connection.execute(
+            "SELECT value FROM properties WHERE key = 'total_size'"
+        ).fetchone()
+        return int(row[0])
+
+    def get_target_info(self, path: str, depth: Union[int, float]):
+        """
+        Returns the target info of the entry at the given path relative to the directory, in the
+        format of download_util.get_target_info (without resolved_target), or None if the
+        manifest has no such entry.
+        """
+        row = self._connection.execute(
+            'SELECT path, size, mode, link FROM entries WHERE path = ?', (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._to_target_info(row, depth)
+
+    def _to_target_info(self, row, depth: Union[int, float]):
+        path, size, mode, link = row
+        result = {
+            'name': os.path.basename(path or self.directory_path),
+            'size': size,
+            'perm': mode & 0o777,
+            'type': '',
+        }
+        if stat.S_ISLNK(mode):
+            result['type'] = 'link'
+            result['link'] = link
+        elif stat.S_ISREG(mode):
+            result['type'] = 'file'
+        elif stat.S_ISDIR(mode):
+            result['type'] = 'directory'
+            if depth > 0:
+                result['contents'] = [
+                    self._to_target_info(child, depth - 1)
+                    for child in self._connection.execute(
+                        'SELECT path, size, mode, link FROM entries WHERE parent = ? ORDER BY path',
+                        (path,),
+                    ).fetchall()
+                ]
+        return result
+
+
+def remove_manifest(directory_path: str):
+    """Removes the manifest of the given directory, if there is one."""
+    try:
+        os.remove(get_manifest_path(directory_path))
+    except FileNotFoundError:
+        pass
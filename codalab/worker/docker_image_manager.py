@@ -1,6 +1,8 @@
 from collections import namedtuple
+import threading
 import time
 import logging
+from typing import Callable, Dict, Optional
 
 import docker
 import requests
@@ -9,6 +11,7 @@ from docker import DockerClient
 import codalab.worker.docker_utils as docker_utils
 
 from .docker_utils import DEFAULT_DOCKER_TIMEOUT, URI_PREFIX
+from codalab.lib.formatting import size_str
 from codalab.worker.fsm import DependencyStage
 from codalab.worker.state_committer import JsonStateCommitter
 from .image_manager import ImageManager, ImageAvailabilityState
@@ -22,47 +25,189 @@ ImageCacheEntry = namedtuple(
     'ImageCacheEntry', ['id', 'digest', 'last_used', 'virtual_size', 'marginal_size']
 )
 
+# Stores the download throughput of a finished image pull
+ImagePullStats = namedtuple('ImagePullStats', ['image_spec', 'bytes_downloaded', 'seconds'])
+
+# Default number of images that can be pulled at the same time
+DEFAULT_MAX_CONCURRENT_PULLS = 3
+
+# Number of seconds the size of an image queried from Docker Hub is reused for
+IMAGE_SIZE_CACHE_TTL_SECS = 10 * 60
+
+
+def canonical_image_ref(image_spec: str) -> str:
+    """
+    Return a canonical name for image_spec, so that different names of the same
+    Docker Hub image (e.g., ubuntu:latest and docker.io/library/ubuntu:latest) compare equal.
+    """
+    for prefix in ('docker.io/', 'index.docker.io/', 'registry-1.docker.io/'):
+        if image_spec.startswith(prefix):
+            image_spec = image_spec[len(prefix) :]
+            break
+    if image_spec.startswith('library/'):
+        image_spec = image_spec[len('library/') :]
+    return image_spec
+
+
+class ImagePullCoordinator:
+    """
+    Coordinates the image pulls of an image manager:
+    - At most max_concurrent_pulls pulls run at the same time. Other pulls wait for a slot.
+    - Concurrent pulls of the same image, possibly under different names, are only done once.
+    - The download throughput of each pull is recorded in `stats`.
+    """
+
+    def __init__(self, max_concurrent_pulls: int = DEFAULT_MAX_CONCURRENT_PULLS):
+        self._semaphore = threading.BoundedSemaphore(max_concurrent_pulls)
+        self._lock = threading.Lock()
+        # Maps canonical image ref -> {'done': Event set when the pull ends, 'error': exception}
+        self._in_flight = {}  # type: Dict[str, Dict]
+        self.stats = {}  # type: Dict[str, ImagePullStats]
+
+    def pull(
+        self,
+        image_spec: str,
+        pull_fn: Callable[[], int],
+        set_status: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """
+        Pull image_spec by calling pull_fn, which returns the number of bytes downloaded.
+        If the same image is already being pulled, wait for that pull to finish instead.
+        Exceptions raised by pull_fn are raised to every caller waiting on the pull.
+        """
+        set_status = set_status or (lambda status: None)
+        ref = canonical_image_ref(image_spec)
+        with self._lock:
+            is_leader = ref not in self._in_flight
+            if is_leader:
+                self._in_flight[ref] = {'done': threading.Event(), 'error': None}
+            in_flight = self._in_flight[ref]
+
+        if not is_leader:
+            set_status('Waiting for another pull of the same image')
+            in_flight['done'].wait()
+            if in_flight['error'] is not None:
+                raise in_flight['error']
+            return
+
+        try:
+            if not self._semaphore.acquire(blocking=False):
+                set_status('Waiting for other image pulls to finish')
+                self._semaphore.acquire()
+            try:
+                start_time = time.time()
+                bytes_downloaded = pull_fn()
+                stats = ImagePullStats(image_spec, bytes_downloaded, time.time() - start_time)
+            finally:
+                self._semaphore.release()
+            self.stats[image_spec] = stats
+            logger.info(
+                'Pulled image %s: downloaded %s in %.1f seconds (%s/s)',
+                image_spec,
+                size_str(stats.bytes_downloaded),
+                stats.seconds,
+                size_str(stats.bytes_downloaded / max(stats.seconds, 1e-3)),
+            )
+        except Exception as e:
+            in_flight['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[ref]
+            in_flight['done'].set()
+
 
 class DockerImageManager(ImageManager):
 
     CACHE_TAG = 'codalab-image-cache/last-used'
 
-    def __init__(self, commit_file: str, max_image_cache_size: int, max_image_size: int):
+    def __init__(
+        self,
+        commit_file: str,
+        max_image_cache_size: int,
+        max_image_size: int,
+        prepull_top_n: int = 0,
+        max_concurrent_pulls: int = DEFAULT_MAX_CONCURRENT_PULLS,
+    ):
         """
         Initializes a DockerImageManager
         :param commit_file: String path to where the state file should be committed
         :param max_image_cache_size: Total size in bytes that the image cache can use
         :param max_image_size: Total size in bytes that the image can have
+        :param prepull_top_n: Number of most used images to pull while the worker is idle
+        :param max_concurrent_pulls: Number of images that can be pulled at the same time
         """
-        super().__init__(max_image_size, max_image_cache_size)
+        super().__init__(max_image_size, max_image_cache_size, prepull_top_n)
         self._state_committer = JsonStateCommitter(commit_file)  # type: JsonStateCommitter
         self._docker = docker.from_env(timeout=DEFAULT_DOCKER_TIMEOUT)  # type: DockerClient
+        self._pull_coordinator = ImagePullCoordinator(max_concurrent_pulls)
+        # Maps image ID -> {layer diff ID: layer size in bytes}. Image IDs are content
+        # addressed, so the layers of an image never change.
+        self._layer_sizes = {}  # type: Dict[str, Dict[str, int]]
+        # Maps image spec -> (size in bytes queried from Docker Hub, time of the query)
+        self._image_size_cache = {}  # type: Dict[str, tuple]
+        self._usage = self._state_committer.load(default={}).get('usage', {})
+
+    def _commit_usage(self):
+        with self._usage_lock:
+            self._state_committer.commit({'usage': self._usage})
+
+    @property
+    def pull_stats(self) -> Dict[str, ImagePullStats]:
+        """ Throughput of the finished image pulls, keyed by image spec """
+        return self._pull_coordinator.stats
+
+    def _image_layer_sizes(self, image) -> Dict[str, int]:
+        """
+        Return {layer diff ID: size in bytes} for the layers of the given image.
+        The image history lists layers newest first, and history entries that don't change the
+        filesystem have size 0 and no layer. If the remaining entries can't be matched one-to-one
+        with the image's layers, the whole image is accounted as a single layer of its own.
+        """
+        if image.id not in self._layer_sizes:
+            diff_ids = image.attrs.get('RootFS', {}).get('Layers', [])
+            sizes = [entry['Size'] for entry in reversed(image.history()) if entry['Size'] > 0]
+            if diff_ids and len(sizes) == len(diff_ids):
+                self._layer_sizes[image.id] = dict(zip(diff_ids, sizes))
+            else:
+                self._layer_sizes[image.id] = {image.id: int(image.attrs['VirtualSize'])}
+        return self._layer_sizes[image.id]
 
     def _get_cache_use(self):
-        return sum(
-            float(image.attrs['VirtualSize']) for image in self._docker.images.list(self.CACHE_TAG)
-        )
+        """
+        Return the disk use of the cached images, counting layers shared by several images once.
+        """
+        layers = {}  # type: Dict[str, int]
+        for image in self._docker.images.list(self.CACHE_TAG):
+            layers.update(self._image_layer_sizes(image))
+        return float(sum(layers.values()))
 
     def _cleanup(self):
         """
         Prunes the image cache for runs.
         1. Only care about images we (this DockerImageManager) downloaded and know about.
         2. We also try to prune any dangling docker images on the system.
-        3. We use sum of VirtualSize's, which is an upper bound on the disk use of our images:
-            in case no images share any intermediate layers, this will be the real disk use,
-            however if images share layers, the virtual size will count that layer's size for each
-            image that uses it, even though it's stored only once in the disk. The 'Size' field
-            accounts for the marginal size each image adds on top of the shared layers, but summing
-            those is not accurate either since the shared base layers need to be counted once to get
-            the total size. (i.e. summing marginal sizes would give us a lower bound on the total disk
-            use of images). Calling df gives us an accurate disk use of ALL the images on the machine
-            but because of (1) we don't want to use that.
-        """
-        # Sort the image cache in LRU order
+        3. We sum the sizes of the layers of our images, counting each layer once even if it is
+            shared by several images, since it's stored only once on the disk. Summing VirtualSize's
+            would count a shared layer once per image that uses it. Calling df gives us an accurate
+            disk use of ALL the images on the machine but because of (1) we don't want to use that.
+            Removing an image whose layers are all shared with other cached images frees no space,
+            so we keep pruning until the layers that are no longer used fit in the cache.
+        """
+        # Sort the image cache in frequency-weighted LRU order: images with the lowest usage
+        # score go first, and images with the same score are evicted least recently used first.
         def last_used(image):
             for tag in image.tags:
                 if tag.split(":")[0] == self.CACHE_TAG:
                     return float(tag.split(":")[1])
+            return 0.0
+
+        def retention_key(image):
+            image_specs = image.tags + image.attrs.get('RepoDigests', [])
+            score = max([self.usage_score(spec) for spec in image_specs] + [0.0])
+            return (score, last_used(image))
+
+        self._commit_usage()
 
         cache_use = self._get_cache_use()
         if cache_use > self._max_image_cache_size:
@@ -72,7 +217,7 @@ class DockerImageManager(ImageManager):
                 self._max_image_cache_size,
             )
             all_images = self._docker.images.list(self.CACHE_TAG)
-            all_images_sorted = sorted(all_images, key=last_used)
+            all_images_sorted = sorted(all_images, key=retention_key)
             logger.info("Cached docker images: {}".format(all_images_sorted))
             for image in all_images_sorted:
                 # We re-list all the images to get an updated total size since we may have deleted some
@@ -108,6 +253,9 @@ class DockerImageManager(ImageManager):
             logger.debug("Stopping docker image manager cleanup")
 
     def get(self, image_spec: str):
+        return super().get(self._normalize_image_spec(image_spec))
+
+    def _normalize_image_spec(self, image_spec: str) -> str:
         if ':' not in image_spec:
             # Both digests and repo:tag kind of specs include the : character. The only case without it is when
             # a repo is specified without a tag (like 'latest')
@@ -122,25 +270,32 @@ class DockerImageManager(ImageManager):
             # Hence, we append the latest tag to the image spec
             # if there's no tag specified otherwise at the very beginning
             image_spec += ':latest'
-        return super().get(image_spec)
+        return image_spec
+
+    def _image_exists_locally(self, image_spec: str) -> bool:
+        try:
+            self._docker.images.get(image_spec)
+            return True
+        except docker.errors.ImageNotFound:
+            return False
 
     def _download(self, image_spec: str) -> None:
         """
         Download the container image from DockerHub to the host machine.
+        The pull goes through the pull coordinator, which limits the number of concurrent pulls
+        and dedupes pulls of the same image.
         Args:
             image_spec: docker image (just image, no prefix docker://)
 
         Returns: None
         """
+
+        def set_status(status):
+            self._downloading[image_spec]['status'] = status
+
         logger.debug('Downloading Docker image %s', image_spec)
         try:
-            for line in self._docker.api.pull(image_spec, stream=True, decode=True):
-                if line['status'] == 'Downloading' or line['status'] == 'Extracting':
-                    progress = docker_utils.parse_image_progress(line)
-                    self._downloading[image_spec]['status'] = '%s %s' % (line['status'], progress)
-                else:
-                    self._downloading[image_spec]['status'] = ''
-
+            self._pull_coordinator.pull(image_spec, lambda: self._pull(image_spec), set_status)
             logger.debug('Download for Docker image %s complete', image_spec)
             self._downloading[image_spec]['success'] = True
             self._downloading[image_spec]['message'] = "Downloading image"
@@ -149,8 +304,39 @@ class DockerImageManager(ImageManager):
             self._downloading[image_spec]['success'] = False
             self._downloading[image_spec]['message'] = "Can't download image: {}".format(ex)
 
-    @docker_utils.wrap_exception('Unable to get image size without pulling from Docker Hub')
+    def _pull(self, image_spec: str) -> int:
+        """
+        Pull image_spec from DockerHub, reporting progress in the download status.
+        Returns: the number of bytes downloaded, i.e., the compressed size of the layers
+            that were not present locally.
+        """
+        layer_bytes = {}  # type: Dict[str, int]
+        for line in self._docker.api.pull(image_spec, stream=True, decode=True):
+            if line['status'] == 'Downloading' or line['status'] == 'Extracting':
+                progress = docker_utils.parse_image_progress(line)
+                self._downloading[image_spec]['status'] = '%s %s' % (line['status'], progress)
+                total = line.get('progressDetail', {}).get('total')
+                if line['status'] == 'Downloading' and total and 'id' in line:
+                    layer_bytes[line['id']] = total
+            else:
+                self._downloading[image_spec]['status'] = ''
+        return sum(layer_bytes.values())
+
     def _image_size_without_pulling(self, image_spec: str):
+        """
+        Get the compressed size of a docker image without pulling it from Docker Hub.
+        Sizes are reused for IMAGE_SIZE_CACHE_TTL_SECS, so that runs and pre-pulls requesting
+        the same image don't query Docker Hub each time.
+        """
+        cached = self._image_size_cache.get(image_spec)
+        if cached is not None and time.time() - cached[1] < IMAGE_SIZE_CACHE_TTL_SECS:
+            return cached[0]
+        image_size_bytes = self._query_image_size(image_spec)
+        self._image_size_cache[image_spec] = (image_size_bytes, time.time())
+        return image_size_bytes
+
+    @docker_utils.wrap_exception('Unable to get image size without pulling from Docker Hub')
+    def _query_image_size(self, image_spec: str):
         """
         Get the compressed size of a docker image without pulling it from Docker Hub. Note that since docker-py doesn't
         report the accurate compressed image size, e.g. the size reported from the RegistryData object, we then switch
@@ -8,6 +8,7 @@ from typing_extensions import TypedDict
 
 from apache_beam.io.filesystems import FileSystems
 from codalab.common import parse_linked_bundle_url
+from codalab.worker.directory_manifest import DirectoryManifest
 from codalab.worker.file_util import OpenIndexedArchiveFile
 from ratarmountcore import FileInfo
 
@@ -100,11 +101,15 @@ def get_target_info(bundle_path: str, target: BundleTarget, depth: int) -> Targe
                 "Path '{}' in bundle {} not found".format(target.subpath, target.bundle_uuid)
             )
     else:
-        if not os.path.islink(final_path) and not os.path.exists(final_path):
-            raise PathException(
-                "Path '{}' in bundle {} not found".format(target.subpath, target.bundle_uuid)
-            )
-        info = _compute_target_info_local(final_path, depth)
+        manifest_info = _compute_target_info_manifest(bundle_path, final_path, depth)
+        if manifest_info is not None:
+            info = manifest_info
+        else:
+            if not os.path.islink(final_path) and not os.path.exists(final_path):
+                raise PathException(
+                    "Path '{}' in bundle {} not found".format(target.subpath, target.bundle_uuid)
+                )
+            info = _compute_target_info_local(final_path, depth)
 
     info['resolved_target'] = target
     return info
@@ -183,6 +188,22 @@ def _compute_target_info_local(path: str, depth: Union[int, float]) -> TargetInf
     return result
 
 
+def _compute_target_info_manifest(
+    bundle_path: str, final_path: str, depth: Union[int, float]
+) -> Optional[TargetInfo]:
+    """Computes target info for a local file from the manifest of the bundle directory (see
+    DirectoryManifest). Returns None if there is no up-to-date manifest with the file in it."""
+    manifest = DirectoryManifest.open(bundle_path)
+    if manifest is None:
+        return None
+    with manifest:
+        path = os.path.relpath(final_path, os.path.realpath(bundle_path))
+        info = manifest.get_target_info('' if path == '.' else path, depth)
+    if info is not None:
+        info['name'] = os.path.basename(final_path)
+    return info
+
+
 def _compute_target_info_blob(
     path: str, depth: Union[int, float], return_generators=False
 ) -> TargetInfo:
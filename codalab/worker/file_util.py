@@ -11,7 +11,11 @@ import stat
 
 from codalab.common import BINARY_PLACEHOLDER, UsageError
 from codalab.common import parse_linked_bundle_url
+from codalab.worker.block_cache import open_cached_blob
+from codalab.worker.compression import Codec, GZIP, compression_threads, pigz_path
+from codalab.worker.index_cache import get_index_cache
 from codalab.worker.un_gzip_stream import BytesBuffer
+from codalab.worker.tar_directory_stream import TarDirectoryStream
 from codalab.worker.tar_subdir_stream import TarSubdirStream
 from codalab.worker.tar_file_stream import TarFileStream
 from apache_beam.io.filesystem import CompressionTypes
@@ -56,7 +60,30 @@ def tar_gzip_directory(
 ):
     """
     Returns a file-like object containing a tarred and gzipped archive of the
-    given directory.
+    given directory. See tar_compress_directory for the arguments.
+    """
+    return tar_compress_directory(
+        directory_path,
+        GZIP,
+        follow_symlinks=follow_symlinks,
+        exclude_patterns=exclude_patterns,
+        exclude_names=exclude_names,
+        ignore_file=ignore_file,
+    )
+
+
+def tar_compress_directory(
+    directory_path,
+    codec: Codec,
+    follow_symlinks=False,
+    exclude_patterns=None,
+    exclude_names=None,
+    ignore_file=None,
+    level=None,
+):
+    """
+    Returns a file-like object containing a tarred archive of the given
+    directory, compressed with the given codec.
 
     follow_symlinks: Whether symbolic links should be followed.
     exclude_names: Any top-level directory entries with names in exclude_names
@@ -64,8 +91,64 @@ def tar_gzip_directory(
     exclude_patterns: Any directory entries with the given names at any depth in
                       the directory structure are excluded.
     ignore_file: Name of the file where exclusion patterns are read from.
+    level: Compression level, by default that of the codec (see Codec.level).
+
+    The archive is generated in this process by a TarDirectoryStream, unless the
+    CODALAB_TAR_SUBPROCESS environment variable is set to 1, in which case it is
+    generated by a tar subprocess (and compressed by pigz, if it is installed).
+    """
+    if os.environ.get('CODALAB_TAR_SUBPROCESS') == '1':
+        return _tar_compress_directory_subprocess(
+            directory_path,
+            codec,
+            follow_symlinks,
+            (exclude_patterns or []) + ALWAYS_IGNORE_PATTERNS,
+            exclude_names,
+            ignore_file,
+        )
+    stream = tar_directory(
+        directory_path,
+        follow_symlinks=follow_symlinks,
+        exclude_patterns=exclude_patterns,
+        exclude_names=exclude_names,
+        ignore_file=ignore_file,
+    )
+    return codec.compress_stream(stream, level)
+
+
+def tar_directory(
+    directory_path,
+    follow_symlinks=False,
+    exclude_patterns=None,
+    exclude_names=None,
+    ignore_file=None,
+) -> TarDirectoryStream:
+    """
+    Returns a TarDirectoryStream containing an uncompressed tarred archive of the given
+    directory. See tar_compress_directory for the arguments.
+    """
+    return TarDirectoryStream(
+        directory_path,
+        follow_symlinks=follow_symlinks,
+        exclude_patterns=(exclude_patterns or []) + ALWAYS_IGNORE_PATTERNS,
+        exclude_names=exclude_names,
+        ignore_file=ignore_file,
+    )
+
+
+def _tar_compress_directory_subprocess(
+    directory_path, codec: Codec, follow_symlinks, exclude_patterns, exclude_names, ignore_file,
+):
     """
-    args = ['tar', 'czf', '-', '-C', directory_path]
+    Returns a file-like object containing a tarred archive of the given
+    directory, compressed with the given codec, generated by tar.
+    See tar_compress_directory for the arguments.
+    """
+    # With a single thread, tar compresses gzip itself. Otherwise, the output of tar is
+    # compressed with pigz if it is installed, and with the codec's own stream if not.
+    threads = compression_threads()
+    tar_gzips = codec is GZIP and threads == 1
+    args = ['tar', 'czf' if tar_gzips else 'cf', '-', '-C', directory_path]
 
     # If the BSD tar library is being used, append --disable-copy to prevent creating ._* files
     if 'bsdtar' in get_tar_version_output():
@@ -76,10 +159,7 @@ def tar_gzip_directory(
         args.append('--exclude-ignore=' + ignore_file)
     if follow_symlinks:
         args.append('-h')
-    if not exclude_patterns:
-        exclude_patterns = []
 
-    exclude_patterns.extend(ALWAYS_IGNORE_PATTERNS)
     for pattern in exclude_patterns:
         args.append('--exclude=' + pattern)
 
@@ -91,7 +171,17 @@ def tar_gzip_directory(
     args.append('.')
     try:
         proc = subprocess.Popen(args, stdout=subprocess.PIPE)
-        return proc.stdout
+        if tar_gzips:
+            return proc.stdout
+        pigz = pigz_path()
+        if codec is GZIP and pigz:
+            pigz_proc = subprocess.Popen(
+                [pigz, '-c', '-n', '-p', str(threads)], stdin=proc.stdout, stdout=subprocess.PIPE
+            )
+            # Only pigz reads the output of tar.
+            cast(IO[bytes], proc.stdout).close()
+            return pigz_proc.stdout
+        return codec.compress_stream(cast(IO[bytes], proc.stdout))
     except subprocess.CalledProcessError as e:
         raise IOError(e.output)
 
@@ -200,35 +290,51 @@ class OpenIndexedArchiveFile(object):
     SQLiteIndexedTar object.
 
     This way, the archive file can be read and specific files can be extracted without
-    needing to download the entire archive file.
+    needing to download the entire archive file. The archive is read through the shared
+    block cache, so reading many small files from it doesn't make a request per file.
+
+    Index files are read through the process-wide index cache, so that they aren't downloaded
+    again on every access. Unless reuse_handle is False, the SQLiteIndexedTar object may be
+    reused by a later OpenIndexedArchiveFile once this one exits, so it must not be used after
+    exiting. Pass use_cache=False to get a private copy of the index, e.g., in order to modify it.
 
     Returns the SQLiteIndexedTar object.
     """
 
-    def __init__(self, path: str):
-        self.f = FileSystems.open(path, compression_type=CompressionTypes.UNCOMPRESSED)
+    def __init__(self, path: str, use_cache: bool = True, reuse_handle: bool = True):
         self.path = path
-        with tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False) as index_fileobj:
-            self.index_file_name = index_fileobj.name
-            shutil.copyfileobj(
-                FileSystems.open(
-                    parse_linked_bundle_url(self.path).index_path,
-                    compression_type=CompressionTypes.UNCOMPRESSED,
-                ),
-                index_fileobj,
-            )
+        self.use_cache = use_cache
+        self.reuse_handle = reuse_handle
+        if not use_cache:
+            with tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False) as index_fileobj:
+                self.index_file_name = index_fileobj.name
+                shutil.copyfileobj(
+                    FileSystems.open(
+                        parse_linked_bundle_url(self.path).index_path,
+                        compression_type=CompressionTypes.UNCOMPRESSED,
+                    ),
+                    index_fileobj,
+                )
 
     def __enter__(self) -> SQLiteIndexedTar:
-        return SQLiteIndexedTar(
-            fileObject=self.f,
-            tarFileName="contents",
-            writeIndex=False,
-            clearIndexCache=False,
-            indexFilePath=self.index_file_name,
-        )
+        if self.use_cache:
+            self.tf, self.cache_token = get_index_cache().open(self.path)
+        else:
+            self.tf = SQLiteIndexedTar(
+                fileObject=open_cached_blob(self.path),
+                tarFileName="contents",
+                writeIndex=False,
+                clearIndexCache=False,
+                indexFilePath=self.index_file_name,
+            )
+        return self.tf
 
     def __exit__(self, type, value, traceback):
-        os.remove(self.index_file_name)
+        if self.use_cache:
+            if self.reuse_handle:
+                get_index_cache().release(self.path, self.tf, self.cache_token)
+        else:
+            os.remove(self.index_file_name)
 
 
 class OpenFile(object):
@@ -270,7 +376,8 @@ class OpenFile(object):
                     raise IOError("Directories must be gzipped.")
                 return FileSystems.open(self.path, compression_type=CompressionTypes.UNCOMPRESSED)
             # If a file path is specified within an archive file on Blob Storage, open the specified path within the archive.
-            with OpenIndexedArchiveFile(linked_bundle_path.bundle_path) as tf:
+            # The returned stream reads through tf after it exits, so tf can't be reused.
+            with OpenIndexedArchiveFile(linked_bundle_path.bundle_path, reuse_handle=False) as tf:
                 isdir = lambda finfo: stat.S_ISDIR(finfo.mode)
                 # If the archive file is a .tar.gz file, open the specified archive subpath within the archive.
                 # If it is a .gz file, open the "/contents" entry, which represents the actual gzipped file.
@@ -283,13 +390,14 @@ class OpenFile(object):
                 if finfo is None:
                     raise FileNotFoundError(fpath)
                 if isdir(finfo):
-                    # Stream a directory from within the archive
+                    # Stream a directory from within the archive. The new archive has to be
+                    # compressed, which is done with multiple threads.
                     if not self.gzipped:
                         raise IOError("Directories must be gzipped.")
-                    return GzipStream(TarSubdirStream(self.path))
+                    return GZIP.compress_stream(TarSubdirStream(self.path))
                 else:
                     fs = TarFileStream(tf, finfo)
-                    return GzipStream(fs) if self.gzipped else fs
+                    return GZIP.compress_stream(fs) if self.gzipped else fs
 
         else:
             # Stream a directory or file from disk storage.
@@ -648,7 +756,7 @@ def update_file_size(bundle_path, file_size):
         parse_linked_bundle_url(bundle_path).uses_beam
         and not parse_linked_bundle_url(bundle_path).is_archive_dir
     ):
-        with OpenIndexedArchiveFile(bundle_path) as tf:
+        with OpenIndexedArchiveFile(bundle_path, use_cache=False) as tf:
             # tf is a SQLiteTar file, which is a copy of original index file
             finfo = tf._getFileInfoRow('/contents')
             finfo = dict(finfo)
@@ -3,7 +3,7 @@ import threading
 import time
 import traceback
 from collections import namedtuple
-from typing import Optional
+from typing import Dict, List, Optional
 
 from codalab.lib.formatting import size_str
 from codalab.worker.fsm import DependencyStage
@@ -15,6 +15,10 @@ logger = logging.getLogger(__name__)
 # DependencyStage and relevant status message from the download)
 ImageAvailabilityState = namedtuple('ImageAvailabilityState', ['digest', 'stage', 'message'])
 
+# Half-life (in seconds) of an image's usage score. An image requested once a day ago
+# scores half as much as an image requested just now.
+USAGE_SCORE_HALF_LIFE_SECS = 24 * 60 * 60
+
 
 class ImageManager:
     """
@@ -23,39 +27,63 @@ class ImageManager:
     An Image Manager manages instances of images, not dependent on the container runtime.
     It does this in the start and stop cleanup loops.
     Subclasses need to implement the get and _cleanup methods.
+
+    The image manager also keeps a usage histogram of the images requested by runs. Each image
+    has a score that is incremented on every request and decays exponentially over time, which
+    gives a frequency-weighted LRU order. Subclasses use it to decide which images to evict
+    first, and when prepull_top_n is set, the image manager pulls the most popular images (and
+    the images hinted by the server) while the worker is idle.
     """
 
-    def __init__(self, max_image_size: int, max_image_cache_size: int):
+    def __init__(self, max_image_size: int, max_image_cache_size: int, prepull_top_n: int = 0):
         """
         Args:
             max_image_size: maximum image size in bytes of any given image
             max_image_cache_size: max number of bytes the image cache will hold at any given time.
+            prepull_top_n: number of most frequently used images to pull ahead of time while
+                the worker is idle. 0 disables pre-pulling.
         """
         self._max_image_size = max_image_size
         self._max_image_cache_size = max_image_cache_size
+        self._prepull_top_n = prepull_top_n
         self._stop = False
         self._sleep_secs = 10
         self._downloading = ThreadDict(
             fields={'success': False, 'status': 'Download starting'}, lock=True
         )
         self._cleanup_thread = None  # type: Optional[threading.Thread]
+        # Maps image spec -> {'score': decayed number of requests, 'last_used': timestamp}
+        self._usage = {}  # type: Dict[str, Dict[str, float]]
+        self._usage_lock = threading.Lock()
+        # Images the server expects to be needed soon (e.g., images of staged bundles)
+        self._hints = []  # type: List[str]
+        # Image specs whose in-flight download was started by a pre-pull, not by a run
+        self._prepulling = set()  # type: set
+        # Guards _downloading and _prepulling between runs' requests and the pre-pull loop
+        self._lock = threading.RLock()
+        self.worker_idle = False
 
     def start(self) -> None:
         """
         Start the image manager.
         If the _max_cache_image_size argument is defined, the image manager will
             clean up the cache where images are held.
+        If the _prepull_top_n argument is defined, the image manager will pull
+            popular and hinted images whenever the worker is idle.
 
         Returns: None
 
         """
         logger.info("Starting image manager")
-        if self._max_image_cache_size:
+        if self._max_image_cache_size or self._prepull_top_n:
 
             def cleanup_loop(self):
                 while not self._stop:
                     try:
-                        self._cleanup()
+                        if self._max_image_cache_size:
+                            self._cleanup()
+                        if self._prepull_top_n:
+                            self._prepull()
                     except Exception:
                         traceback.print_exc()
                     time.sleep(self._sleep_secs)
@@ -76,9 +104,149 @@ class ImageManager:
         if self._cleanup_thread:
             logger.debug("Stopping image manager: stop the cleanup thread")
             self._cleanup_thread.join()
+        self._commit_usage()
         logger.info("Stopped image manager")
         pass
 
+    def update_hints(self, image_specs: List[str]) -> None:
+        """
+        Set the list of images that the server expects this worker to need soon, most
+        requested first. Hinted images are pre-pulled before the locally popular ones.
+        Args:
+            image_specs: image specs (as they would be passed to get)
+        """
+        self._hints = list(image_specs)
+
+    def record_usage(self, image_spec: str, now: Optional[float] = None) -> None:
+        """
+        Record a request of image_spec by a run in the usage histogram.
+        """
+        now = time.time() if now is None else now
+        with self._usage_lock:
+            entry = self._usage.get(image_spec)
+            score = self.usage_score(image_spec, now) if entry else 0.0
+            self._usage[image_spec] = {'score': score + 1.0, 'last_used': now}
+
+    def usage_score(self, image_spec: str, now: Optional[float] = None) -> float:
+        """
+        Return the frequency-weighted recency score of image_spec: the number of times the
+        image was requested, with each request decaying by half every USAGE_SCORE_HALF_LIFE_SECS.
+        Images that were never requested have a score of 0.
+        """
+        entry = self._usage.get(image_spec)
+        if not entry:
+            return 0.0
+        now = time.time() if now is None else now
+        age = max(now - entry['last_used'], 0)
+        return entry['score'] * 0.5 ** (age / USAGE_SCORE_HALF_LIFE_SECS)
+
+    def most_used_images(self, n: int) -> List[str]:
+        """
+        Return the n image specs with the highest usage score.
+        """
+        now = time.time()
+        with self._usage_lock:
+            image_specs = list(self._usage)
+        return sorted(image_specs, key=lambda spec: self.usage_score(spec, now), reverse=True)[:n]
+
+    def _prepull_candidates(self) -> List[str]:
+        """
+        Return the images that should be present locally ahead of time, in order of priority:
+        the hinted images first, then the most used images.
+        """
+        candidates = []  # type: List[str]
+        for image_spec in self._hints + self.most_used_images(self._prepull_top_n):
+            image_spec = self._normalize_image_spec(image_spec)
+            if image_spec not in candidates:
+                candidates.append(image_spec)
+        return candidates[: self._prepull_top_n]
+
+    def _prepull(self) -> None:
+        """
+        Pull one missing candidate image if the worker is idle. Only one pre-pull runs at a time
+        so that pre-pulling never competes with downloads requested by runs.
+        Finished pre-pulls that no run has asked for yet are registered in the cache.
+        """
+        with self._lock:
+            for image_spec in list(self._prepulling):
+                if image_spec in self._downloading and not self._downloading[image_spec].is_alive():
+                    if self._downloading[image_spec]['success']:
+                        self._image_availability_state(
+                            image_spec,
+                            success_message='Image pre-pulled',
+                            failure_message='Image {} was pre-pulled, but it cannot be found '
+                            'locally: %s'.format(image_spec),
+                        )
+                    else:
+                        logger.info(
+                            'Pre-pull of image %s failed: %s',
+                            image_spec,
+                            self._downloading[image_spec]['message'],
+                        )
+                    self._downloading.remove(image_spec)
+                if image_spec not in self._downloading:
+                    self._prepulling.discard(image_spec)
+            if not self.worker_idle or self._prepulling or len(self._downloading) > 0:
+                return
+
+        for image_spec in self._prepull_candidates():
+            if self._image_exists_locally(image_spec):
+                continue
+            if self._check_image_size(image_spec) is not None:
+                continue
+            with self._lock:
+                if len(self._downloading) > 0:
+                    # A run started a download in the meantime
+                    return
+                logger.info('Worker is idle, pre-pulling image %s', image_spec)
+                self._prepulling.add(image_spec)
+                self._downloading.add_if_new(
+                    image_spec, threading.Thread(target=self._download, args=[image_spec])
+                )
+            return
+
+    def _commit_usage(self) -> None:
+        """
+        Persist the usage histogram so that it survives worker restarts.
+        By default, the histogram is only kept in memory.
+        """
+        pass
+
+    def _check_image_size(self, image_spec: str) -> Optional[str]:
+        """
+        Check that the size of image_spec does not exceed _max_image_size.
+        Returns: None if the image can be pulled, or a failure message otherwise.
+        """
+        if not self._max_image_size:
+            return None
+        try:
+            try:
+                image_size_bytes = self._image_size_without_pulling(image_spec)
+            except NotImplementedError:
+                failure_msg = (
+                    "Could not query size of {} from container runtime hub. "
+                    "Skipping size precheck.".format(image_spec)
+                )
+                logger.info(failure_msg)
+                image_size_bytes = 0
+            if image_size_bytes > self._max_image_size:
+                failure_msg = (
+                    "The size of "
+                    + image_spec
+                    + ": {} exceeds the maximum image size allowed {}.".format(
+                        size_str(image_size_bytes), size_str(self._max_image_size)
+                    )
+                )
+                logger.error(failure_msg)
+                return failure_msg
+        except Exception as ex:
+            failure_msg = "Cannot fetch image size before pulling Docker image: {} from Docker Hub: {}.".format(
+                image_spec, ex
+            )
+            logger.error(failure_msg)
+            return failure_msg
+        return None
+
     def get(self, image_spec: str) -> ImageAvailabilityState:
         """
         Always request the newest image from the cloud if it's not in downloading thread and return the current
@@ -99,80 +267,69 @@ class ImageManager:
             ImageAvailabilityState of the image requested.
         """
         try:
-            if image_spec in self._downloading:
-                with self._downloading[image_spec]['lock']:
-                    if self._downloading[image_spec].is_alive():
-                        return ImageAvailabilityState(
-                            digest=None,
-                            stage=DependencyStage.DOWNLOADING,
-                            message=self._downloading[image_spec]['status'],
-                        )
-                    else:
-                        if self._downloading[image_spec]['success']:
-                            status = self._image_availability_state(
-                                image_spec,
-                                success_message='Image ready',
-                                failure_message='Image {} was downloaded successfully, '
-                                'but it cannot be found locally due to unhandled error %s'.format(
-                                    image_spec
-                                ),
-                            )
-                        else:
-                            status = self._image_availability_state(
-                                image_spec,
-                                success_message='Image {} can not be downloaded from the cloud '
-                                'but it is found locally'.format(image_spec),
-                                failure_message=self._downloading[image_spec]['message'] + ": %s",
-                            )
-                        self._downloading.remove(image_spec)
-                        return status
-            else:
-                if self._max_image_size:
-                    try:
-                        try:
-                            image_size_bytes = self._image_size_without_pulling(image_spec)
-                        except NotImplementedError:
-                            failure_msg = (
-                                "Could not query size of {} from container runtime hub. "
-                                "Skipping size precheck.".format(image_spec)
-                            )
-                            logger.info(failure_msg)
-                            image_size_bytes = 0
-                        if image_size_bytes > self._max_image_size:
-                            failure_msg = (
-                                "The size of "
-                                + image_spec
-                                + ": {} exceeds the maximum image size allowed {}.".format(
-                                    size_str(image_size_bytes), size_str(self._max_image_size)
-                                )
-                            )
-                            logger.error(failure_msg)
-                            return ImageAvailabilityState(
-                                digest=None, stage=DependencyStage.FAILED, message=failure_msg
-                            )
-                    except Exception as ex:
-                        failure_msg = "Cannot fetch image size before pulling Docker image: {} from Docker Hub: {}.".format(
-                            image_spec, ex
-                        )
-                        logger.error(failure_msg)
-                        return ImageAvailabilityState(
-                            digest=None, stage=DependencyStage.FAILED, message=failure_msg
-                        )
-
-            self._downloading.add_if_new(
-                image_spec, threading.Thread(target=self._download, args=[image_spec])
-            )
-            return ImageAvailabilityState(
-                digest=None,
-                stage=DependencyStage.DOWNLOADING,
-                message=self._downloading[image_spec]['status'],
-            )
+            with self._lock:
+                status = self._get(image_spec)
+            if status is not None:
+                return status
+            # Checking the size may query the registry, so other lookups don't wait for it.
+            failure_msg = self._check_image_size(image_spec)
+            if failure_msg is not None:
+                return ImageAvailabilityState(
+                    digest=None, stage=DependencyStage.FAILED, message=failure_msg
+                )
+            with self._lock:
+                self._downloading.add_if_new(
+                    image_spec, threading.Thread(target=self._download, args=[image_spec])
+                )
+                return ImageAvailabilityState(
+                    digest=None,
+                    stage=DependencyStage.DOWNLOADING,
+                    message=self._downloading[image_spec]['status'],
+                )
         except Exception as ex:
             logger.error(ex)
             return ImageAvailabilityState(
                 digest=None, stage=DependencyStage.FAILED, message=str(ex)
             )
 
+    def _get(self, image_spec: str) -> Optional[ImageAvailabilityState]:
+        """
+        Return the status of the download of image_spec, or None if it isn't being downloaded.
+        Must be called with self._lock held.
+        """
+        if image_spec not in self._downloading or image_spec in self._prepulling:
+            # Count each run's request once, including requests served by a pre-pull.
+            self.record_usage(image_spec)
+            self._prepulling.discard(image_spec)
+        if image_spec in self._downloading:
+            with self._downloading[image_spec]['lock']:
+                if self._downloading[image_spec].is_alive():
+                    return ImageAvailabilityState(
+                        digest=None,
+                        stage=DependencyStage.DOWNLOADING,
+                        message=self._downloading[image_spec]['status'],
+                    )
+                else:
+                    if self._downloading[image_spec]['success']:
+                        status = self._image_availability_state(
+                            image_spec,
+                            success_message='Image ready',
+                            failure_message='Image {} was downloaded successfully, '
+                            'but it cannot be found locally due to unhandled error %s'.format(
+                                image_spec
+                            ),
+                        )
+                    else:
+                        status = self._image_availability_state(
+                            image_spec,
+                            success_message='Image {} can not be downloaded from the cloud '
+                            'but it is found locally'.format(image_spec),
+                            failure_message=self._downloading[image_spec]['message'] + ": %s",
+                        )
+                    self._downloading.remove(image_spec)
+                    return status
+        return None
+
     def _cleanup(self):
         """
         Prune and clean up images in accordance with the image cache and
@@ -181,6 +338,20 @@ class ImageManager:
         """
         raise NotImplementedError
 
+    def _normalize_image_spec(self, image_spec: str) -> str:
+        """
+        Return image_spec in the form that get uses as the key for downloads (e.g., with
+        a default tag added). By default, image specs are used as is.
+        """
+        return image_spec
+
+    def _image_exists_locally(self, image_spec: str) -> bool:
+        """
+        Return whether the image specified by image_spec is present on the host machine.
+        Subclasses that support pre-pulling need to implement this function.
+        """
+        raise NotImplementedError
+
     def _image_availability_state(
         self, image_spec: str, success_message: str, failure_message: str
     ) -> ImageAvailabilityState:
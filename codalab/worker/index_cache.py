@@ -0,0 +1,228 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from apache_beam.io.filesystem import CompressionTypes
+from apache_beam.io.filesystems import FileSystems
+
+from codalab.common import parse_linked_bundle_url
+from codalab.worker.block_cache import blob_version, open_cached_blob
+from codalab.lib.beam.SQLiteIndexedTar import SQLiteIndexedTar  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+class _CachedIndex(object):
+    """An index file in the cache, along with open handles to it that aren't in use."""
+
+    def __init__(self, version: str, path: str, size: int):
+        self.version = version
+        self.path = path
+        self.size = size
+        # Open SQLiteIndexedTar handles that aren't in use, by the ID of the thread that opened
+        # them. SQLite connections can only be used by the thread that created them.
+        self.idle_handles = {}  # type: Dict[int, List[SQLiteIndexedTar]]
+
+
+class IndexCache(object):
+    """
+    A cache on local disk of the index.sqlite files of bundles stored on blob storage.
+
+    Index files are keyed by bundle UUID and the version (ETag and last-modified time) of the
+    index blob, so an index that is rewritten on blob storage is downloaded again. The cache is
+    an LRU bounded by the total size of the index files. Files in the cache directory are kept
+    across restarts of the process.
+
+    Opening an index also requires opening the archive on blob storage and reading the index
+    metadata, so handles that are released are kept open for reuse by later lookups of the same
+    bundle from the same thread.
+    """
+
+    DEFAULT_MAX_SIZE_BYTES = int(
+        os.environ.get('CODALAB_INDEX_CACHE_MAX_SIZE_BYTES', 10 * 1024 * 1024 * 1024)
+    )
+    DEFAULT_CACHE_DIR = os.environ.get(
+        'CODALAB_INDEX_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'codalab-index-cache')
+    )
+    # Maximum number of idle handles kept open per index and thread.
+    MAX_IDLE_HANDLES = 2
+    # Log the cache statistics every this many lookups.
+    LOG_STATS_EVERY = 100
+    # Temporary files of downloads older than this are left over from a crashed process.
+    STALE_DOWNLOAD_SECS = 60 * 60
+
+    def __init__(
+        self, cache_dir: str = DEFAULT_CACHE_DIR, max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES
+    ):
+        self._cache_dir = cache_dir
+        self._max_size_bytes = max_size_bytes
+        # Bundle UUID => _CachedIndex, in least recently used order.
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.handle_hits = 0
+        os.makedirs(self._cache_dir, exist_ok=True)
+        self._load_existing_entries()
+
+    def _load_existing_entries(self):
+        """Add the index files left in the cache directory by previous processes."""
+        files = []
+        for name in os.listdir(self._cache_dir):
+            path = os.path.join(self._cache_dir, name)
+            try:
+                stat = os.stat(path)
+                if not name.endswith('.sqlite'):
+                    # Download in progress, possibly by another process sharing the cache directory.
+                    if stat.st_mtime < time.time() - self.STALE_DOWNLOAD_SECS:
+                        os.remove(path)
+                    continue
+            except OSError:
+                continue
+            bundle_uuid, _, version = name[: -len('.sqlite')].rpartition('-')
+            files.append((stat.st_atime, bundle_uuid, version, path, stat.st_size))
+        for _, bundle_uuid, version, path, size in sorted(files):
+            self._add_entry(bundle_uuid, _CachedIndex(version, path, size))
+
+    def _add_entry(self, bundle_uuid: str, entry: _CachedIndex):
+        """Adds entry to the cache, replacing any other version of the index. Must hold self._lock."""
+        if bundle_uuid in self._entries:
+            self._remove_entry(bundle_uuid)
+        self._entries[bundle_uuid] = entry
+        self._size += entry.size
+        while self._size > self._max_size_bytes and len(self._entries) > 1:
+            self._remove_entry(next(iter(self._entries)))
+
+    def _remove_entry(self, bundle_uuid: str):
+        """Evicts the index of the given bundle. Must hold self._lock.
+        Handles in use keep working, since the file is only unlinked; they're closed on release."""
+        entry = self._entries.pop(bundle_uuid)
+        self._size -= entry.size
+        for handles in entry.idle_handles.values():
+            for handle in handles:
+                _close_handle(handle)
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+    def _get_index_file(self, bundle_uuid: str, index_path: str) -> _CachedIndex:
+        """Returns the cache entry for the current version of the index, downloading it if needed."""
+        version = blob_version(index_path)
+        with self._lock:
+            self._maybe_log_stats()
+            entry = self._entries.get(bundle_uuid)
+            # Other processes sharing the cache directory may have evicted the file.
+            if entry is not None and entry.version == version and os.path.exists(entry.path):
+                self._entries.move_to_end(bundle_uuid)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Download without holding the lock, so that lookups of other bundles aren't blocked.
+        # Index files are downloaded to a temporary name first, so that a partial download is
+        # never mistaken for a cached index.
+        with tempfile.NamedTemporaryFile(dir=self._cache_dir, delete=False) as f:
+            with FileSystems.open(
+                index_path, compression_type=CompressionTypes.UNCOMPRESSED
+            ) as index_fileobj:
+                shutil.copyfileobj(index_fileobj, f)
+        path = os.path.join(self._cache_dir, '%s-%s.sqlite' % (bundle_uuid, version))
+        os.replace(f.name, path)
+
+        with self._lock:
+            entry = self._entries.get(bundle_uuid)
+            if entry is None or entry.version != version:
+                entry = _CachedIndex(version, path, os.path.getsize(path))
+                self._add_entry(bundle_uuid, entry)
+            return entry
+
+    def open(self, bundle_path: str) -> Tuple[SQLiteIndexedTar, Tuple[str, int]]:
+        """Returns an open SQLiteIndexedTar for the archive at bundle_path, along with a token to
+        pass to release() once the handle is no longer used."""
+        linked_bundle_path = parse_linked_bundle_url(bundle_path)
+        entry = self._get_index_file(linked_bundle_path.bundle_uuid, linked_bundle_path.index_path)
+        token = (entry.version, threading.get_ident())
+        with self._lock:
+            idle_handles = entry.idle_handles.get(threading.get_ident())
+            if idle_handles:
+                self.handle_hits += 1
+                return idle_handles.pop(), token
+        handle = SQLiteIndexedTar(
+            fileObject=open_cached_blob(bundle_path),
+            tarFileName="contents",
+            writeIndex=False,
+            clearIndexCache=False,
+            indexFilePath=entry.path,
+        )
+        return handle, token
+
+    def release(self, bundle_path: str, handle: SQLiteIndexedTar, token: Tuple[str, int]):
+        """Returns a handle obtained from open() so that it can be reused. May be called from
+        any thread; the handle is only reused by the thread that opened it."""
+        version, thread_id = token
+        bundle_uuid = parse_linked_bundle_url(bundle_path).bundle_uuid
+        with self._lock:
+            entry = self._entries.get(bundle_uuid)
+            if entry is not None and entry.version == version:
+                idle_handles = entry.idle_handles.setdefault(thread_id, [])
+                if len(idle_handles) < self.MAX_IDLE_HANDLES:
+                    idle_handles.append(handle)
+                    return
+        _close_handle(handle)
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        """Fraction of lookups whose index file was already in the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate,
+                'handle_hits': self.handle_hits,
+                'num_indexes': len(self._entries),
+                'size_bytes': self._size,
+            }
+
+    def _maybe_log_stats(self):
+        """Must hold self._lock."""
+        lookups = self.hits + self.misses
+        if lookups and lookups % self.LOG_STATS_EVERY == 0:
+            logger.info(
+                "Index cache: %d lookups, hit rate %.2f, %d handle reuses, %d indexes (%d bytes)",
+                lookups,
+                self.hit_rate,
+                self.handle_hits,
+                len(self._entries),
+                self._size,
+            )
+
+
+def _close_handle(handle: SQLiteIndexedTar):
+    try:
+        handle.__exit__(None, None, None)
+    except Exception:
+        logger.warning("Failed to close index handle", exc_info=True)
+
+
+_index_cache = None  # type: Optional[IndexCache]
+_index_cache_lock = threading.Lock()
+
+
+def get_index_cache() -> IndexCache:
+    """Returns the index cache shared by the process, creating it on first use."""
+    global _index_cache
+    with _index_cache_lock:
+        if _index_cache is None:
+            _index_cache = IndexCache()
+        return _index_cache
@@ -19,11 +19,12 @@ from codalab.common import SingularityError
 from codalab.common import BundleRuntime
 from codalab.lib.formatting import parse_size
 from codalab.lib.telemetry_util import initialize_sentry, load_sentry_data, using_sentry
+from codalab.worker import compression
 from .bundle_service_client import BundleServiceClient, BundleAuthException
 from .worker import Worker
 from codalab.worker.docker_utils import DockerRuntime, DockerException
 from codalab.worker.dependency_manager import DependencyManager
-from codalab.worker.docker_image_manager import DockerImageManager
+from codalab.worker.docker_image_manager import DockerImageManager, DEFAULT_MAX_CONCURRENT_PULLS
 from codalab.worker.singularity_image_manager import SingularityImageManager
 from codalab.worker.noop_image_manager import NoOpImageManager
 from codalab.worker.runtime.kubernetes_runtime import KubernetesRuntime
@@ -109,6 +110,22 @@ def parse_args():
         'If running an image on the singularity runtime, there is no size '
         'check because singularity hub does not support the querying of image size',
     )
+    parser.add_argument(
+        '--image-prepull-top-n',
+        type=int,
+        default=0,
+        help='Number of most frequently used Docker images (and images of staged bundles '
+        'hinted by the server) to pull ahead of time while the worker is idle. '
+        'Images are kept in the cache in frequency-weighted LRU order. '
+        'Defaults to 0, which disables pre-pulling.',
+    )
+    parser.add_argument(
+        '--max-concurrent-image-pulls',
+        type=int,
+        default=DEFAULT_MAX_CONCURRENT_PULLS,
+        help='Maximum number of Docker images to pull at the same time '
+        '(defaults to %d).' % DEFAULT_MAX_CONCURRENT_PULLS,
+    )
     parser.add_argument(
         '--max-memory',
         type=parse_size,
@@ -286,6 +303,7 @@ def main():
     logging.basicConfig(format=log_format, level=log_level)
 
     logging.getLogger('urllib3').setLevel(logging.INFO)
+    compression.use_all_cores()
     # Initialize sentry logging
     if using_sentry():
         initialize_sentry()
@@ -351,6 +369,8 @@ def main():
             os.path.join(args.work_dir, 'images-state.json'),
             args.max_image_cache_size,
             args.max_image_size,
+            args.image_prepull_top_n,
+            args.max_concurrent_image_pulls,
         )
         bundle_runtime_class = DockerRuntime()
         docker_runtime = bundle_runtime_class.get_available_runtime()
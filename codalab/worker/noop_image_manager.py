@@ -8,9 +8,14 @@ class NoOpImageManager:
     a pod is launched later.
     """
 
+    worker_idle = False
+
     def start(self):
         pass
 
+    def update_hints(self, image_specs):
+        pass
+
     def stop(self):
         pass
 
@@ -5,7 +5,7 @@ import urllib.parse
 import urllib.error
 from typing import Dict
 
-from .un_gzip_stream import un_gzip_stream
+from .compression import get_codec
 from codalab.common import URLOPEN_TIMEOUT_SECONDS, urlopen_with_retry
 from codalab.worker.upload_util import upload_with_chunked_encoding
 
@@ -91,16 +91,16 @@ class RestClient(object):
         request.get_method = lambda: method
         if return_response:
             # Return a file-like object containing the contents of the response
-            # body, transparently decoding gzip streams if indicated by the
-            # Content-Encoding header.
+            # body, transparently decoding gzip and zstd streams if indicated by
+            # the Content-Encoding header.
             response = urlopen_with_retry(request, timeout=timeout_seconds)
             encoding = response.headers.get('Content-Encoding')
             if not encoding or encoding == 'identity':
                 return response
-            elif encoding == 'gzip':
-                return un_gzip_stream(response)
-            else:
+            codec = get_codec(encoding)
+            if codec is None or not codec.is_available():
                 raise RestClientException('Unsupported Content-Encoding: ' + encoding, False)
+            return codec.decompress_stream(response)
 
         with closing(urlopen_with_retry(request, timeout=timeout_seconds)) as response:
             # If the response is a JSON document, as indicated by the
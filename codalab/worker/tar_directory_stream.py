@@ -0,0 +1,182 @@
+import fnmatch
+import logging
+import os
+import tarfile
+from io import BytesIO
+from typing import Iterator, List, Optional, Set, Tuple
+
+from codalab.worker.un_gzip_stream import BytesBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class _CountingWriter(object):
+    """A file-like object that only counts the bytes written to it."""
+
+    def __init__(self):
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+
+    def tell(self):
+        return self.count
+
+
+class TarDirectoryStream(BytesIO):
+    """Streams a directory on local disk as an uncompressed tar archive, without a subprocess.
+
+    The directory is walked with os.scandir, and whenever .read() is called on this class, the
+    archive is generated up to the specified number of bytes: the header of each entry followed
+    by its contents, read in chunks. Entries are archived in order of name, with the same names
+    as `tar cf - -C <directory> .` would give them. Closing the stream stops the generation and
+    closes the file being read, so nothing is left behind when a download is cancelled.
+
+    Entries are excluded the way tar's --exclude and --exclude-ignore options exclude them:
+    - exclude_patterns are matched against the path of each entry, and any trailing
+      part of it, at any depth;
+    - exclude_names are the names of top-level entries to exclude;
+    - if ignore_file is set, the patterns in the file with that name in each directory
+      are matched the same way, but only against the entries in that directory.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(
+        self,
+        directory_path: str,
+        follow_symlinks: bool = False,
+        exclude_patterns: Optional[List[str]] = None,
+        exclude_names: Optional[List[str]] = None,
+        ignore_file: Optional[str] = None,
+    ):
+        self.directory_path = directory_path
+        self.follow_symlinks = follow_symlinks
+        self.exclude_patterns = exclude_patterns or []
+        self.exclude_names = set(exclude_names or [])
+        self.ignore_file = ignore_file
+        self._buffer = BytesBuffer()
+        self._chunks = self._generate()
+        self._finished = False
+
+    def _is_excluded(self, arcname: str, ignore_patterns: List[str]) -> bool:
+        if arcname[2:] in self.exclude_names:
+            return True
+        parts = arcname.split('/')
+        candidates = ['/'.join(parts[i:]) for i in range(len(parts))]
+        return any(
+            fnmatch.fnmatchcase(candidate, pattern)
+            for pattern in self.exclude_patterns + ignore_patterns
+            for candidate in candidates
+        )
+
+    def _read_ignore_patterns(self, path: str) -> List[str]:
+        if not self.ignore_file:
+            return []
+        try:
+            with open(os.path.join(path, self.ignore_file)) as f:
+                lines = [line.strip() for line in f]
+        except OSError:
+            return []
+        return [line for line in lines if line and not line.startswith('#')]
+
+    def _entries(self, output: tarfile.TarFile) -> Iterator[Tuple[str, tarfile.TarInfo]]:
+        """Yields the path and TarInfo of each entry to archive, depth first."""
+        root = output.gettarinfo(self.directory_path, '.')
+        yield self.directory_path, root
+        # Directories being walked, to avoid cycles when following symlinks.
+        ancestors = set()  # type: Set[Tuple[int, int]]
+
+        def walk(path: str, arcname: str):
+            stat_result = os.stat(path)
+            key = (stat_result.st_dev, stat_result.st_ino)
+            if key in ancestors:
+                logger.warning("Not archiving %s again, which would be a cycle", path)
+                return
+            ancestors.add(key)
+            ignore_patterns = self._read_ignore_patterns(path)
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+            for entry in entries:
+                entry_arcname = arcname + '/' + entry.name
+                if self._is_excluded(entry_arcname, ignore_patterns):
+                    continue
+                try:
+                    tinfo = output.gettarinfo(entry.path, entry_arcname)
+                except OSError as e:
+                    # For example, a broken symlink that is followed. tar skips these too.
+                    logger.warning("Not archiving %s: %s", entry.path, e)
+                    continue
+                if tinfo is None:
+                    # Sockets can't be archived.
+                    continue
+                yield entry.path, tinfo
+                if tinfo.isdir():
+                    yield from walk(entry.path, entry_arcname)
+            ancestors.remove(key)
+
+        yield from walk(self.directory_path, '.')
+
+    def _open_output(self, fileobj) -> tarfile.TarFile:
+        return tarfile.open(
+            fileobj=fileobj, mode='w:', format=tarfile.GNU_FORMAT, dereference=self.follow_symlinks
+        )
+
+    def _generate(self) -> Iterator[None]:
+        """Writes the archive into self._buffer, yielding after each header and chunk of data."""
+        output = self._open_output(self._buffer)
+        for path, tinfo in self._entries(output):
+            output.addfile(tinfo)
+            yield
+            if not tinfo.isreg():
+                continue
+            remaining = tinfo.size
+            with open(path, 'rb') as f:
+                while remaining > 0:
+                    chunk = f.read(min(self.CHUNK_SIZE, remaining))
+                    if not chunk:
+                        # The file was truncated while it was read. Pad it like tar does.
+                        logger.warning("%s shrank while it was archived", path)
+                        chunk = tarfile.NUL * min(self.CHUNK_SIZE, remaining)
+                    self._buffer.write(chunk)
+                    remaining -= len(chunk)
+                    yield
+            blocks, remainder = divmod(tinfo.size, tarfile.BLOCKSIZE)
+            if remainder > 0:
+                self._buffer.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                blocks += 1
+            # We're ignoring types here because the TarFile.offset type is missing.
+            output.offset += blocks * tarfile.BLOCKSIZE  # type: ignore
+        # Writes the end-of-archive blocks.
+        output.close()
+
+    def compute_size(self) -> int:
+        """Returns the size of the archive, for a Content-Length. It is computed by walking the
+        directory without reading any files, so it only matches the archive if the directory
+        doesn't change in between (like the contents of a bundle that is ready)."""
+        counter = _CountingWriter()
+        output = self._open_output(counter)
+        for _, tinfo in self._entries(output):
+            output.addfile(tinfo)
+            if tinfo.isreg():
+                padded_size = -(-tinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                counter.count += padded_size
+                output.offset += padded_size  # type: ignore
+        output.close()
+        return counter.count
+
+    def read(self, num_bytes=None):
+        while not self._finished and (num_bytes is None or len(self._buffer) < num_bytes):
+            try:
+                next(self._chunks)
+            except StopIteration:
+                self._finished = True
+        if num_bytes is None:
+            num_bytes = len(self._buffer)
+        return self._buffer.read(num_bytes)
+
+    def close(self):
+        # Stops the generator, which closes the file that it is reading.
+        self._chunks.close()
+        self._finished = True
+        self._buffer = BytesBuffer()
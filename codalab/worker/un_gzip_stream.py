@@ -23,6 +23,11 @@ from zipfile import (  # type: ignore
 
 from codalab.lib.beam.streamingzipfile import StreamingZipFile
 
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None  # type: ignore
+
 
 class GenericUncompressStream(BytesIO):
     """Generic base class that uncompresses a stream.
@@ -78,6 +83,15 @@ class UnBz2Stream(GenericUncompressStream):
         self.decoder = bz2.BZ2Decompressor()
 
 
+class UnZstdStream(GenericUncompressStream):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if zstandard is None:
+            raise IOError('The zstandard package is required to decompress zstd streams.')
+        self.decoder = zstandard.ZstdDecompressor().decompressobj()
+        self.seekable = lambda: False
+
+
 class ZipToTarDecompressor:
     def __init__(self, buffer):
         self.output = tarfile.open(fileobj=buffer, mode="w:")
@@ -9,8 +9,8 @@ def un_tar_directory(fileobj, directory_path, compression='', force=False):
     and `force` is `False`, an error is raised. If it already exists, and `force` is `True`,
     the directory is removed and recreated.
 
-    compression specifies the compression scheme and can be one of '', 'gz' or
-    'bz2'.
+    compression specifies the compression scheme and can be one of '', 'gz',
+    'bz2' or 'zst'.
 
     Raises tarfile.TarError if the archive is not valid.
     """
@@ -20,6 +20,12 @@ def un_tar_directory(fileobj, directory_path, compression='', force=False):
 
         remove_path(directory_path)
     os.mkdir(directory_path)
+    if compression == 'zst':
+        # tarfile doesn't support zstd, so decompress the stream before handing it over.
+        from codalab.worker.un_gzip_stream import UnZstdStream
+
+        fileobj = UnZstdStream(fileobj)
+        compression = ''
     with tarfile.open(fileobj=fileobj, mode='r|' + compression) as tar:
         for member in tar:
             # Make sure that there is no trickery going on (see note in
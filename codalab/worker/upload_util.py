@@ -3,8 +3,94 @@ import urllib.parse
 import http.client
 import logging
 import socket
+import threading
+import time
 from io import StringIO
 
+DISK_QUOTA_EXCEEDED_MESSAGE = (
+    'Upload aborted. User disk quota exceeded. '
+    'To apply for more quota, please visit the following link: '
+    'https://codalab-worksheets.readthedocs.io/en/latest/FAQ/'
+    '#how-do-i-request-more-disk-quota-or-time-quota'
+)
+
+
+class DiskUsageReporter(object):
+    """
+    Reports the bytes uploaded by a client to the user/increment_disk_used endpoint, and checks
+    whether the user has gone over their disk quota.
+
+    Reports are batched (at most one every `report_interval_bytes` bytes or
+    `report_interval_seconds` seconds) and sent from a background thread, so the upload loop
+    never waits on REST round trips. The first chunk is reported right away, so that uploads by
+    users that are already over quota fail fast.
+
+    Usage: call add() for each uploaded chunk, which raises once the quota is exceeded,
+    and finish() at the end of the upload to report the remaining bytes.
+    """
+
+    def __init__(
+        self,
+        json_api_client,
+        bundle_uuid,
+        report_interval_bytes=256 * 1024 * 1024,
+        report_interval_seconds=10,
+    ):
+        self._client = json_api_client
+        self._bundle_uuid = bundle_uuid
+        self._report_interval_bytes = report_interval_bytes
+        self._report_interval_seconds = report_interval_seconds
+        self._pending_bytes = 0
+        self._last_report_time = None
+        self._thread = None
+        self._quota_exceeded = False
+        self._error = None
+
+    def _report(self, num_bytes):
+        try:
+            self._client.update(
+                'user/increment_disk_used',
+                {'disk_used_increment': num_bytes, 'bundle_uuid': self._bundle_uuid},
+            )
+            user_info = self._client.fetch('user')
+            if user_info['disk_used'] >= user_info['disk_quota']:
+                self._quota_exceeded = True
+        except Exception as e:
+            self._error = e
+
+    def _raise_if_failed(self):
+        if self._quota_exceeded:
+            raise Exception(DISK_QUOTA_EXCEEDED_MESSAGE)
+        if self._error is not None:
+            raise self._error
+
+    def add(self, num_bytes):
+        """Record num_bytes more uploaded bytes, starting a report in the background if due."""
+        self._raise_if_failed()
+        self._pending_bytes += num_bytes
+        if self._thread is not None and self._thread.is_alive():
+            return
+        now = time.time()
+        if (
+            self._last_report_time is None
+            or self._pending_bytes >= self._report_interval_bytes
+            or now - self._last_report_time >= self._report_interval_seconds
+        ):
+            self._last_report_time = now
+            num_bytes, self._pending_bytes = self._pending_bytes, 0
+            self._thread = threading.Thread(target=self._report, args=[num_bytes], daemon=True)
+            self._thread.start()
+
+    def finish(self):
+        """Wait for the report in flight, then report the remaining bytes synchronously."""
+        if self._thread is not None:
+            self._thread.join()
+        self._raise_if_failed()
+        if self._pending_bytes > 0:
+            self._report(self._pending_bytes)
+            self._pending_bytes = 0
+            self._raise_if_failed()
+
 
 def upload_with_chunked_encoding(
     method,
@@ -37,7 +123,7 @@ def upload_with_chunked_encoding(
         :param json_api_client: JsonApiClient. None when this function is run by the server.
                                                Used to update disk usage from client.
         """
-    CHUNK_SIZE = 16 * 1024
+    CHUNK_SIZE = 1024 * 1024
     TIMEOUT = 60
     # Start the request.
     parsed_base_url = urllib.parse.urlparse(base_url)
@@ -65,8 +151,9 @@ def upload_with_chunked_encoding(
 
         # Use chunked transfer encoding to send the data through.
         bytes_uploaded = 0
-        ITERATIONS_PER_DISK_CHECK = 2000
-        iteration = 0
+        disk_usage_reporter = (
+            DiskUsageReporter(json_api_client, bundle_uuid) if json_api_client else None
+        )
         while True:
             to_send = fileobj.read(CHUNK_SIZE)
             if not to_send:
@@ -75,24 +162,14 @@ def upload_with_chunked_encoding(
             bytes_uploaded += len(to_send)
 
             # Update disk and check if client has gone over disk usage.
-            if json_api_client and iteration % ITERATIONS_PER_DISK_CHECK == 0:
-                json_api_client.update(
-                    'user/increment_disk_used',
-                    {'disk_used_increment': len(to_send), 'bundle_uuid': bundle_uuid},
-                )
-                user_info = json_api_client.fetch('user')
-                if user_info['disk_used'] >= user_info['disk_quota']:
-                    raise Exception(
-                        'Upload aborted. User disk quota exceeded. '
-                        'To apply for more quota, please visit the following link: '
-                        'https://codalab-worksheets.readthedocs.io/en/latest/FAQ/'
-                        '#how-do-i-request-more-disk-quota-or-time-quota'
-                    )
+            if disk_usage_reporter:
+                disk_usage_reporter.add(len(to_send))
             if progress_callback is not None:
                 should_resume = progress_callback(bytes_uploaded)
                 if not should_resume:
                     raise Exception('Upload aborted by client')
-            iteration += 1
+        if disk_usage_reporter:
+            disk_usage_reporter.finish()
         conn.send(b'0\r\n\r\n')
 
         if not need_response:
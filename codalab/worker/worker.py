@@ -558,10 +558,13 @@ class Worker:
                         'free_disk_bytes': stats['free_disk_bytes'],
                     },
                 )
+            self.image_manager.worker_idle = len(self.runs) == 0
             try:
-                self.bundle_service.checkin(self.id, request)
+                response = self.bundle_service.checkin(self.id, request)
                 logger.info('Connected! Successful check in!')
                 self.last_checkin_successful = True
+                if response:
+                    self.image_manager.update_hints(response.get('image_hints', []))
             except BundleServiceException as ex:
                 logger.warning("Disconnected from server! Failed check in: %s", ex)
                 if not self.last_checkin_successful:
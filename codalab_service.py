@@ -212,6 +212,7 @@ CODALAB_ARGUMENTS = [
     CodalabArg(name='mysql_username', help='MySQL username', default='codalab'),
     CodalabArg(name='mysql_password', help='MySQL password', default='codalab'),
     CodalabArg(name='mysql_root_password', help='MySQL root password', default='codalab'),
+    CodalabArg(name='mysql_replica_host', help='Hostname of a MySQL read replica (optional)'),
     CodalabArg(
         name='uid',
         help='UID:GID to run everything inside Docker and owns created files',
@@ -940,6 +941,17 @@ class CodalabServiceManager(object):
             self.args.mysql_port,
             self.args.mysql_database,
         )
+        mysql_replica_url = (
+            'mysql://{}:{}@{}:{}/{}'.format(
+                self.args.mysql_username,
+                self.args.mysql_password,
+                self.args.mysql_replica_host,
+                self.args.mysql_port,
+                self.args.mysql_database,
+            )
+            if self.args.mysql_replica_host
+            else None
+        )
         rest_url = 'http://rest-server:{}'.format(self.args.rest_port)
 
         if self.args.mysql_host == 'mysql':
@@ -954,6 +966,7 @@ class CodalabServiceManager(object):
                 for config_prop, value in [
                     ('cli/default_address', rest_url),
                     ('server/engine_url', mysql_url),
+                    ('server/replica_engine_url', mysql_replica_url),
                     ('server/rest_host', '0.0.0.0'),
                     ('server/rest_port', self.args.rest_port),
                     ('server/admin_email', self.args.admin_email),
@@ -0,0 +1,109 @@
+"""
+Benchmarks BundleModel.get_descendants and get_ancestors on a DAG of bundle dependencies in an
+in-memory SQLite database, with a single WITH RECURSIVE query against one query per level
+(the fallback for databases without recursive queries), and against the previous breadth-first
+search of get_self_and_descendants, which kept the visited bundles in a list.
+
+The DAG looks like a set of long pipelines: every bundle depends on one to three of the
+bundles created shortly before it.
+
+Usage:
+    python tests/benchmark/dependency_closure.py --nodes 100000
+"""
+import argparse
+import random
+import time
+from unittest.mock import patch
+
+from codalab.model.sqlite_model import SQLiteModel
+from codalab.model.tables import bundle_dependency as cl_bundle_dependency
+
+
+def create_dag(model, nodes, window):
+    uuids = ['0x%032x' % i for i in range(nodes)]
+    rows = []
+    for i in range(1, nodes):
+        for parent in random.sample(range(max(0, i - window), i), min(i, random.randint(1, 3))):
+            rows.append(
+                {
+                    'child_uuid': uuids[i],
+                    'child_path': 'dep%d' % parent,
+                    'parent_uuid': uuids[parent],
+                    'parent_path': '',
+                }
+            )
+    with model.engine.begin() as connection:
+        connection.execute(cl_bundle_dependency.insert(), rows)
+    return uuids
+
+
+def get_self_and_descendants_legacy(model, uuids, depth):
+    """The previous implementation of BundleModel.get_self_and_descendants."""
+    frontier = uuids
+    visited = list(frontier)
+    while len(frontier) > 0 and depth > 0:
+        result = model.get_children_uuids(frontier)
+        new_frontier = []
+        for v in result.values():
+            for uuid in v:
+                if uuid in visited:
+                    continue
+                new_frontier.append(uuid)
+                visited.append(uuid)
+        frontier = new_frontier
+        depth -= 1
+    return visited
+
+
+def time_call(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, len(result)
+
+
+def main(args):
+    random.seed(0)
+    model = SQLiteModel({'time_quota': 0, 'disk_quota': 0, 'parallel_run_quota': 0}, '0', '-1')
+    print("Creating a DAG of %d bundles ..." % args.nodes)
+    uuids = create_dag(model, args.nodes, args.window)
+    print("%-40s %12s %10s" % ('traversal', 'seconds', 'bundles'))
+    for recursive in [True, False]:
+        mode = 'recursive' if recursive else 'per level'
+        with patch.object(model, '_supports_recursive_queries', return_value=recursive):
+            for name, function, seeds, depth in [
+                ('get_descendants', model.get_descendants, uuids[:1], None),
+                ('get_ancestors', model.get_ancestors, uuids[-1:], None),
+                ('get_descendants, depth 10', model.get_descendants, uuids[:1], 10),
+            ]:
+                seconds, count = time_call(function, seeds, depth)
+                print("%-40s %12.3f %10d" % ('%s (%s)' % (name, mode), seconds, count))
+    if args.nodes <= args.legacy_max_nodes:
+        seconds, count = time_call(get_self_and_descendants_legacy, model, uuids[:1], args.nodes)
+        print("%-40s %12.3f %10d" % ('get_self_and_descendants (previous)', seconds, count - 1))
+    else:
+        print("Skipping the previous implementation, which is quadratic, for this many bundles.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks traversing bundle dependencies with recursive queries.'
+    )
+    parser.add_argument(
+        '--nodes',
+        type=int,
+        help='Number of bundles in the DAG (defaults to 100000)',
+        default=100000,
+    )
+    parser.add_argument(
+        '--window',
+        type=int,
+        help='Bundles depend on bundles among this many created before them (defaults to 50)',
+        default=50,
+    )
+    parser.add_argument(
+        '--legacy-max-nodes',
+        type=int,
+        help='Largest DAG to run the previous implementation on (defaults to 20000)',
+        default=20000,
+    )
+    main(parser.parse_args())
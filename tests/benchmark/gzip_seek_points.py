@@ -0,0 +1,156 @@
+"""
+Benchmarks reading the last file of a large .tar.gz bundle archive through its index, using the
+gzip seek points that are computed while the archive is uploaded, against inflating the archive
+from the start (which is what reads did without seek points).
+
+The index is built the same way BlobStorageUploader.write_fileobj builds it, by reading the
+archive through a MultiReaderFileStream. The archive is generated on local disk.
+
+Usage:
+    python tests/benchmark/gzip_seek_points.py --size-gb 50
+"""
+import argparse
+import io
+import os
+import tarfile
+import tempfile
+import time
+from io import BytesIO
+
+from codalab.lib.beam.MultiReaderFileStream import MultiReaderFileStream
+from codalab.lib.beam.SQLiteIndexedTar import SQLiteIndexedTar
+from codalab.lib.upload_manager import GZIP_SEEK_POINT_SPACING
+
+FILE_SIZE = 64 * 1024 * 1024
+
+
+class CountingFile(io.RawIOBase):
+    """A file that counts the bytes read from it. Like a file on blob storage, it has no file
+    descriptor, so all reads go through Python."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb', buffering=0)
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def readinto(self, b):
+        num_bytes = self._file.readinto(b)
+        self.bytes_read += num_bytes
+        return num_bytes
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def create_archive(path, size_bytes):
+    """Writes a .tar.gz archive of incompressible files with about size_bytes of contents."""
+    block = os.urandom(FILE_SIZE)
+    with tarfile.open(path, mode='w:gz', compresslevel=1) as tf:
+        for i in range(max(size_bytes // FILE_SIZE, 1)):
+            tinfo = tarfile.TarInfo('file%06d' % i)
+            tinfo.size = FILE_SIZE
+            tf.addfile(tinfo, BytesIO(block))
+    return 'file%06d' % i
+
+
+def create_index(archive_path, index_path, spacing):
+    """Indexes the archive like the upload path does, and returns the time it took."""
+    start = time.time()
+    with open(archive_path, 'rb') as f:
+        stream = MultiReaderFileStream(f, lookbehind_size=6 * spacing)
+        stream.readers[0].close()
+        SQLiteIndexedTar(
+            fileObject=stream.readers[1],
+            tarFileName="contents.tar.gz",
+            writeIndex=True,
+            clearIndexCache=True,
+            indexFilePath=index_path,
+            gzipSeekPointSpacing=spacing,
+        )
+    return time.time() - start
+
+
+def read_file(archive_path, index_path, name):
+    """Reads the given file through the index. Returns the time it took and the number of
+    compressed bytes read."""
+    start = time.time()
+    with CountingFile(archive_path) as counting_file:
+        tf = SQLiteIndexedTar(
+            fileObject=counting_file,
+            tarFileName="contents.tar.gz",
+            writeIndex=False,
+            clearIndexCache=False,
+            indexFilePath=index_path,
+        )
+        finfo = tf.getFileInfo('/' + name)
+        tf.read(fileInfo=finfo, size=finfo.size, offset=0)
+    return time.time() - start, counting_file.bytes_read
+
+
+def read_file_sequentially(archive_path, name):
+    """Reads the given file by inflating the archive from the start. Returns the time it took and
+    the number of compressed bytes read."""
+    start = time.time()
+    with CountingFile(archive_path) as counting_file:
+        with tarfile.open(fileobj=counting_file, mode='r|gz') as tf:
+            for tinfo in tf:
+                if tinfo.name == name:
+                    tf.extractfile(tinfo).read()
+                    break
+    return time.time() - start, counting_file.bytes_read
+
+
+def main(args):
+    work_dir = tempfile.mkdtemp(dir=args.work_dir)
+    archive_path = os.path.join(work_dir, 'contents.tar.gz')
+    print("Creating a %g GB archive in %s ..." % (args.size_gb, work_dir))
+    last_file = create_archive(archive_path, int(args.size_gb * 1024 ** 3))
+    archive_size = os.path.getsize(archive_path)
+
+    spacing = args.spacing_mb * 1024 * 1024
+    index_path = os.path.join(work_dir, 'index.sqlite')
+    index_seconds = create_index(archive_path, index_path, spacing)
+    print(
+        "Indexing with seek points every %d MiB took %.1fs; index is %.1f MiB"
+        % (args.spacing_mb, index_seconds, os.path.getsize(index_path) / 1024 ** 2)
+    )
+    for label, (read_seconds, bytes_read) in [
+        ('without seek points', read_file_sequentially(archive_path, last_file)),
+        ('with seek points', read_file(archive_path, index_path, last_file)),
+    ]:
+        print(
+            "Reading the last file %s: %.2fs, read %.1f%% of the archive"
+            % (label, read_seconds, 100.0 * bytes_read / archive_size)
+        )
+    print("Results are in %s; delete it when done." % work_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks reading a file at the end of a large .tar.gz bundle archive.'
+    )
+    parser.add_argument(
+        '--size-gb', type=float, help='Size of the archive in GB (defaults to 50)', default=50
+    )
+    parser.add_argument(
+        '--spacing-mb',
+        type=int,
+        help='Spacing of the gzip seek points in MiB (defaults to the spacing used for uploads)',
+        default=GZIP_SEEK_POINT_SPACING // (1024 * 1024),
+    )
+    parser.add_argument(
+        '--work-dir', type=str, help='Directory to create the archive in', default=None
+    )
+    main(parser.parse_args())
@@ -0,0 +1,100 @@
+"""
+Benchmarks the throughput of gzipping a directory with tar_compress_directory for increasing
+numbers of compression threads, with pigz (if installed) and with the in-process parallel
+gzip stream that is used when pigz is not installed. One thread is plain `tar czf`.
+
+The directory is generated on local disk, from files with about the compressibility of
+typical run outputs (text and half-random binary data).
+
+Usage:
+    python tests/benchmark/parallel_gzip.py --size-gb 2 --threads 1,2,4,8
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+from codalab.worker import compression
+from codalab.worker.compression import GZIP
+from codalab.worker.file_util import tar_compress_directory
+
+FILE_SIZE = 64 * 1024 * 1024
+
+
+def create_directory(path, size_bytes):
+    os.makedirs(path)
+    text = b''.join(b'step %d loss %.6f\n' % (i, 1.0 / (i + 1)) for i in range(FILE_SIZE // 32))
+    for i in range(max(size_bytes // FILE_SIZE, 1)):
+        with open(os.path.join(path, 'file%04d' % i), 'wb') as f:
+            if i % 2:
+                f.write(os.urandom(FILE_SIZE // 2) + bytes(FILE_SIZE // 2))
+            else:
+                f.write(text[:FILE_SIZE])
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def time_tar(path, threads, pigz):
+    """Returns the time it took to read the whole archive, and its size."""
+    with patch.dict(os.environ, {'CODALAB_COMPRESSION_THREADS': str(threads)}), patch(
+        'codalab.worker.file_util.pigz_path', lambda: pigz
+    ):
+        start = time.time()
+        fileobj = tar_compress_directory(path, GZIP)
+        archive_size = 0
+        for chunk in iter(lambda: fileobj.read(1024 * 1024), b''):
+            archive_size += len(chunk)
+        fileobj.close()
+    return time.time() - start, archive_size
+
+
+def main(args):
+    work_dir = tempfile.mkdtemp(dir=args.work_dir)
+    try:
+        path = os.path.join(work_dir, 'contents')
+        print("Creating a %g GB directory in %s ..." % (args.size_gb, work_dir))
+        create_directory(path, int(args.size_gb * 1024 ** 3))
+        size_mb = directory_size(path) / 1024 ** 2
+
+        modes = [('python', None)]
+        if compression.pigz_path():
+            modes.append(('pigz', compression.pigz_path()))
+        else:
+            print("pigz is not installed; only benchmarking the in-process parallel gzip.")
+        print("%-8s %8s %10s %8s" % ('mode', 'threads', 'MB/s', 'ratio'))
+        for threads in [int(t) for t in args.threads.split(',')]:
+            for mode, pigz in modes if threads > 1 else [('tar czf', None)]:
+                seconds, archive_size = time_tar(path, threads, pigz)
+                print(
+                    "%-8s %8d %10.1f %8.3f"
+                    % (mode, threads, size_mb / seconds, archive_size / (size_mb * 1024 ** 2))
+                )
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks parallel gzip compression of a directory.'
+    )
+    parser.add_argument(
+        '--size-gb', type=float, help='Size of the directory in GB (defaults to 2)', default=2
+    )
+    parser.add_argument(
+        '--threads',
+        type=str,
+        help='Comma-separated numbers of threads to benchmark (defaults to 1,2,4,8,...,cores)',
+        default=','.join(
+            str(2 ** i)
+            for i in range((os.cpu_count() or 1).bit_length())
+            if 2 ** i <= (os.cpu_count() or 1)
+        ),
+    )
+    parser.add_argument(
+        '--work-dir', type=str, help='Directory to create the files in', default=None
+    )
+    main(parser.parse_args())
@@ -0,0 +1,92 @@
+"""
+Benchmarks generating a gzipped archive of a directory with tar_compress_directory, in this
+process with a TarDirectoryStream against a tar subprocess (CODALAB_TAR_SUBPROCESS=1).
+
+The directory is generated on local disk, with a few large files and many small ones, which
+tar handles with less per-file overhead. The time to the first byte, which is what a client
+waits for before a download starts, and the total time are reported.
+
+Usage:
+    python tests/benchmark/tar_directory.py --size-gb 1 --small-files 20000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+from codalab.worker.compression import GZIP
+from codalab.worker.file_util import tar_compress_directory
+
+FILE_SIZE = 64 * 1024 * 1024
+
+
+def create_directory(path, size_bytes, small_files):
+    os.makedirs(path)
+    text = b''.join(b'step %d loss %.6f\n' % (i, 1.0 / (i + 1)) for i in range(FILE_SIZE // 32))
+    for i in range(max(size_bytes // FILE_SIZE, 1)):
+        with open(os.path.join(path, 'file%04d' % i), 'wb') as f:
+            f.write(text[:FILE_SIZE])
+    for i in range(small_files):
+        directory = os.path.join(path, 'small', 'dir%03d' % (i % 100))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'file%06d' % i), 'wb') as f:
+            f.write(text[: 100 + i % 4000])
+
+
+def time_tar(path, subprocess, level):
+    """Returns the time to the first byte, the total time and the size of the archive."""
+    with patch.dict(
+        os.environ,
+        {
+            'CODALAB_TAR_SUBPROCESS': '1' if subprocess else '0',
+            'CODALAB_COMPRESSION_THREADS': '1',
+            'CODALAB_GZIP_LEVEL': str(level),
+        },
+    ):
+        start = time.time()
+        fileobj = tar_compress_directory(path, GZIP)
+        archive_size = len(fileobj.read(1))
+        first_byte_seconds = time.time() - start
+        for chunk in iter(lambda: fileobj.read(1024 * 1024), b''):
+            archive_size += len(chunk)
+        fileobj.close()
+    return first_byte_seconds, time.time() - start, archive_size
+
+
+def main(args):
+    work_dir = tempfile.mkdtemp(dir=args.work_dir)
+    try:
+        path = os.path.join(work_dir, 'contents')
+        print("Creating a %g GB directory in %s ..." % (args.size_gb, work_dir))
+        create_directory(path, int(args.size_gb * 1024 ** 3), args.small_files)
+        print("%-12s %6s %14s %10s %10s" % ('mode', 'level', 'first byte (s)', 'total (s)', 'MB'))
+        for level in [1, 6]:
+            for mode, subprocess in [('subprocess', True), ('in-process', False)]:
+                if subprocess and level != 6:
+                    # tar czf always compresses at gzip's default level.
+                    continue
+                first_byte_seconds, seconds, archive_size = time_tar(path, subprocess, level)
+                print(
+                    "%-12s %6d %14.3f %10.1f %10.1f"
+                    % (mode, level, first_byte_seconds, seconds, archive_size / 1024 ** 2)
+                )
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks generating directory archives in process and with tar.'
+    )
+    parser.add_argument(
+        '--size-gb', type=float, help='Size of the large files in GB (defaults to 1)', default=1
+    )
+    parser.add_argument(
+        '--small-files', type=int, help='Number of small files (defaults to 20000)', default=20000
+    )
+    parser.add_argument(
+        '--work-dir', type=str, help='Directory to create the files in', default=None
+    )
+    main(parser.parse_args())
@@ -0,0 +1,94 @@
+import os
+import threading
+import unittest
+
+from io import BytesIO
+
+from codalab.lib.beam.MultiReaderFileStream import MultiReaderFileStream
+
+
+class MultiReaderFileStreamTest(unittest.TestCase):
+    def read_all(self, reader, chunk_size, results, index):
+        parts = []
+        while True:
+            s = reader.read(chunk_size)
+            if not s:
+                break
+            parts.append(s)
+        results[index] = b''.join(parts)
+
+    def test_readers_read_everything(self):
+        contents = os.urandom(1024 * 1024)
+        stream = MultiReaderFileStream(BytesIO(contents), max_buffer_size=64 * 1024)
+        results = [None, None]
+        threads = [
+            threading.Thread(target=self.read_all, args=(stream.readers[0], 1000, results, 0)),
+            threading.Thread(target=self.read_all, args=(stream.readers[1], 7777, results, 1)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [contents, contents])
+
+    def test_buffer_is_bounded(self):
+        """A fast reader blocks instead of buffering the whole file for a slow reader."""
+        max_buffer_size = 64 * 1024
+        contents = os.urandom(1024 * 1024)
+        stream = MultiReaderFileStream(BytesIO(contents), max_buffer_size=max_buffer_size)
+        results = [None, None]
+        fast = threading.Thread(target=self.read_all, args=(stream.readers[0], 4096, results, 0))
+        fast.start()
+        fast.join(timeout=0.5)
+        # The fast reader can't finish until the slow reader catches up.
+        self.assertTrue(fast.is_alive())
+        self.read_all(stream.readers[1], 100, results, 1)
+        fast.join()
+        self.assertEqual(results, [contents, contents])
+        self.assertLessEqual(
+            stream.high_water_mark, max_buffer_size + MultiReaderFileStream.READ_CHUNK_SIZE
+        )
+
+    def test_large_read(self):
+        """Reads larger than the buffer return all the requested bytes."""
+        contents = os.urandom(300 * 1024)
+        stream = MultiReaderFileStream(BytesIO(contents), max_buffer_size=64 * 1024)
+        stream.readers[1].close()
+        self.assertEqual(stream.readers[0].read(), contents)
+
+    def test_closed_reader_does_not_block(self):
+        contents = os.urandom(256 * 1024)
+        stream = MultiReaderFileStream(BytesIO(contents), max_buffer_size=1024)
+        self.assertEqual(stream.readers[1].read(10), contents[:10])
+        stream.readers[1].close()
+        self.assertEqual(stream.readers[0].read(), contents)
+
+    def test_peek(self):
+        stream = MultiReaderFileStream(BytesIO(b'hello world'))
+        self.assertEqual(stream.readers[0].peek(5), b'hello')
+        self.assertEqual(stream.readers[0].read(6), b'hello ')
+        self.assertEqual(stream.readers[0].peek(5), b'world')
+        self.assertEqual(stream.readers[1].read(), b'hello world')
+
+    def test_seek_back_within_lookbehind(self):
+        contents = os.urandom(256 * 1024)
+        stream = MultiReaderFileStream(
+            BytesIO(contents), max_buffer_size=1024, lookbehind_size=64 * 1024
+        )
+        stream.readers[0].close()
+        reader = stream.readers[1]
+        reader.read(100 * 1024)
+        reader.seek(50 * 1024)
+        self.assertEqual(reader.tell(), 50 * 1024)
+        self.assertEqual(reader.read(10), contents[50 * 1024 : 50 * 1024 + 10])
+        reader.seek(0)
+        with self.assertRaises(OSError):
+            reader.read(10)
+
+    def test_seek_forward(self):
+        contents = os.urandom(256 * 1024)
+        stream = MultiReaderFileStream(BytesIO(contents), max_buffer_size=1024 * 1024)
+        stream.readers[0].seek(100 * 1024)
+        self.assertEqual(stream.readers[0].read(10), contents[100 * 1024 : 100 * 1024 + 10])
+        # The other reader still sees the data that was skipped.
+        self.assertEqual(stream.readers[1].read(), contents)
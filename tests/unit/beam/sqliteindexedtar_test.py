@@ -0,0 +1,87 @@
+import gzip
+import os
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+from io import BytesIO
+
+from codalab.lib.beam.SQLiteIndexedTar import SQLiteIndexedTar  # type: ignore
+
+
+class SQLiteIndexedTarTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def create_archive(self, num_files):
+        """Returns a .tar.gz archive with num_files files spread over nested directories."""
+        data = BytesIO()
+        with tarfile.open(fileobj=data, mode='w:gz') as tf:
+            for i in range(num_files):
+                contents = b'file %d' % i
+                tinfo = tarfile.TarInfo('dir%d/sub%d/file%d' % (i % 7, i % 3, i))
+                tinfo.size = len(contents)
+                tf.addfile(tinfo, BytesIO(contents))
+        return data.getvalue()
+
+    def create_index(self, archive, parallelization):
+        index_path = os.path.join(self.work_dir.name, 'index-%d.sqlite' % parallelization)
+        tf = SQLiteIndexedTar(
+            fileObject=BytesIO(archive),
+            tarFileName="contents.tar.gz",
+            writeIndex=True,
+            clearIndexCache=True,
+            indexFilePath=index_path,
+            parallelization=parallelization,
+        )
+        return tf, index_path
+
+    def read_rows(self, index_path):
+        with sqlite3.connect(index_path) as connection:
+            return connection.execute('SELECT * FROM "files" ORDER BY path, name').fetchall()
+
+    def test_same_index_with_parallelization(self):
+        # More files than fit in one batch of inserts.
+        archive = self.create_archive(SQLiteIndexedTar.INSERT_BATCH_SIZE + 10)
+        tf, serial_index_path = self.create_index(archive, parallelization=1)
+        self.assertEqual(tf.getFileInfo('/dir3/sub1/file10').size, len(b'file 10'))
+        self.assertTrue(tf.getFileInfo('/dir3').mode & 0o040000)
+        self.assertGreater(tf.indexingEntriesPerSecond, 0)
+
+        _, parallel_index_path = self.create_index(archive, parallelization=2)
+        rows = self.read_rows(serial_index_path)
+        self.assertEqual(len(rows), SQLiteIndexedTar.INSERT_BATCH_SIZE + 10 + 7 + 7 * 3)
+        self.assertEqual(rows, self.read_rows(parallel_index_path))
+
+    def test_incomplete_archive(self):
+        archive = self.create_archive(100)
+        # Cut off the end of the TAR, but keep a valid gzip stream.
+        truncated = gzip.compress(gzip.decompress(archive)[: 50 * 1024])
+        for parallelization in [1, 2]:
+            tf, _ = self.create_index(truncated, parallelization)
+            self.assertEqual(tf.getFileInfo('/dir0/sub0/file0').size, len(b'file 0'))
+
+    def test_prefetch_stops_when_consumer_fails(self):
+        """The consumer can stop while the prefetching thread waits to hand over the end."""
+        errors = []
+
+        def consume():
+            batches = SQLiteIndexedTar._prefetchInThread(iter(range(3)), maxBatches=2)
+            try:
+                for _ in batches:
+                    # Give the producer time to fill the queue and wait on the end sentinel.
+                    time.sleep(0.5)
+                    raise ValueError('indexing failed')
+            except ValueError as e:
+                errors.append(e)
+
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+        consumer.join(timeout=10)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(len(errors), 1)
@@ -2,6 +2,7 @@
 Unit tests for the static methods of the JsonApiClient
 """
 import unittest
+from unittest.mock import patch
 
 from codalab.client.json_api_client import (
     EmptyJsonApiRelationship,
@@ -131,3 +132,19 @@ class JsonApiClientTest(unittest.TestCase):
             client.fetch_one(2)
         with self.assertRaises(PreconditionViolation):
             client.fetch_one(10)
+
+    def test_iter_bundles(self):
+        pages = {
+            '': {'data': [{'type': 'bundles', 'id': '1'}], 'meta': {'next_cursor': 'a'}},
+            'a': {'data': [{'type': 'bundles', 'id': '2'}], 'meta': {'next_cursor': None}},
+        }
+
+        def make_request(method, path, query_params):
+            cursor = [value for key, value in query_params if value.startswith('.cursor=')]
+            return pages[cursor[0][len('.cursor=') :]]
+
+        with patch.object(self.client, '_make_request', side_effect=make_request) as request:
+            bundles = list(self.client.iter_bundles(['.mine', '.limit=1']))
+        self.assertEqual([bundle['id'] for bundle in bundles], ['1', '2'])
+        self.assertEqual(request.call_count, 2)
+        self.assertIn(('keywords', '.mine'), request.call_args[1]['query_params'])
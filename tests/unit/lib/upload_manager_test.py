@@ -11,7 +11,7 @@ from apache_beam.io.filesystem import CompressionTypes
 from apache_beam.io.filesystems import FileSystems
 from io import BytesIO
 from typing import IO, cast
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from urllib.response import addinfourl
 
 from codalab.worker.file_util import gzip_bytestring, remove_path, tar_gzip_directory
@@ -200,6 +200,19 @@ class UploadManagerBlobStorageTest(UploadManagerTestBase, unittest.TestCase):
                         expected_contents,
                     )
 
+    def test_index_upload_error(self):
+        """Errors uploading the index fail the upload, even though it happens in another thread."""
+        create = FileSystems.create
+
+        def create_failing_index(path, *args, **kwargs):
+            if path.endswith('index.sqlite'):
+                raise OSError('index upload failed')
+            return create(path, *args, **kwargs)
+
+        with patch.object(FileSystems, 'create', side_effect=create_failing_index):
+            with self.assertRaisesRegex(OSError, 'index upload failed'):
+                self.do_upload(('source', BytesIO(b'testing')))
+
     def listdir(self):
         with FileSystems.open(
             self.bundle_location, compression_type=CompressionTypes.UNCOMPRESSED
@@ -0,0 +1,154 @@
+import unittest
+from unittest.mock import patch
+
+from codalab.model.bundle_cache import (
+    BundleCache,
+    LRUBundleCacheBackend,
+    RedisBundleCacheBackend,
+)
+from codalab.objects.dependency import Dependency
+from codalab.worker.bundle_state import State
+from tests.unit.server.bundle_manager import TestBase
+
+
+class FakeRedis(object):
+    """In-memory stand-in for a redis.Redis client."""
+
+    def __init__(self):
+        self.values = {}
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+
+class LRUBundleCacheBackendTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        backend = LRUBundleCacheBackend(max_entries=2)
+        backend.set_many({'a': 1, 'b': 2})
+        backend.get_many(['a'])
+        backend.set_many({'c': 3})
+        self.assertEqual(backend.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+
+    def test_expires(self):
+        backend = LRUBundleCacheBackend(ttl_seconds=-1)
+        backend.set_many({'a': 1})
+        self.assertEqual(backend.get_many(['a']), {})
+
+    def test_copies(self):
+        backend = LRUBundleCacheBackend()
+        value = {'metadata': []}
+        backend.set_many({'a': value})
+        value['metadata'].append('modified')
+        backend.get_many(['a'])['a']['metadata'].append('modified')
+        self.assertEqual(backend.get_many(['a']), {'a': {'metadata': []}})
+
+
+class BundleCacheTest(TestBase, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.model = self.bundle_manager._model
+        self.parent = self.create_run_bundle(State.READY, {'name': 'parent'})
+        self.save_bundle(self.parent)
+        self.bundle = self.create_run_bundle(State.READY, {'name': 'cached'})
+        self.bundle.dependencies = [self.create_dependency(self.parent.uuid, 'parent')]
+        self.save_bundle(self.bundle)
+
+    def create_dependency(self, parent_uuid, child_path):
+        return Dependency(
+            {
+                'parent_uuid': parent_uuid,
+                'parent_path': '',
+                'child_uuid': self.bundle.uuid,
+                'child_path': child_path,
+            }
+        )
+
+    def count_queries(self, function):
+        """Returns the result of function() and the number of queries it made."""
+        self.model.request_cache.begin()
+        try:
+            result = function()
+        finally:
+            queries = self.model.request_cache.end()['queries']
+        return result, queries
+
+    def assert_served_from_cache(self):
+        bundle, queries = self.count_queries(lambda: self.model.get_bundle(self.bundle.uuid))
+        self.assertEqual(queries, 0)
+        self.assertEqual(bundle.to_dict(), self.model.get_bundle(self.bundle.uuid).to_dict())
+        self.assertEqual(bundle.metadata.name, 'cached')
+        self.assertEqual([dep.parent_uuid for dep in bundle.dependencies], [self.parent.uuid])
+        return bundle
+
+    def test_final_bundles_cached(self):
+        self.model.get_bundle(self.bundle.uuid)
+        self.assert_served_from_cache()
+        infos, queries = self.count_queries(
+            lambda: self.model.get_bundle_storage_infos([self.bundle.uuid])
+        )
+        self.assertEqual(queries, 0)
+        self.assertEqual(infos, {self.bundle.uuid: (None, False)})
+        # Only the bundles that aren't cached are queried.
+        bundles, queries = self.count_queries(
+            lambda: self.model.batch_get_bundles(uuid=[self.bundle.uuid, self.parent.uuid])
+        )
+        self.assertEqual([bundle.uuid for bundle in bundles], [self.parent.uuid, self.bundle.uuid])
+        self.assertGreater(queries, 0)
+
+    def test_running_bundles_not_cached(self):
+        running = self.create_run_bundle(State.RUNNING)
+        self.save_bundle(running)
+        self.model.get_bundle(running.uuid)
+        _, queries = self.count_queries(lambda: self.model.get_bundle(running.uuid))
+        self.assertGreater(queries, 0)
+
+    def test_invalidated_on_update(self):
+        bundle = self.model.get_bundle(self.bundle.uuid)
+        self.model.update_bundle(bundle, {'metadata': {'name': 'renamed'}})
+        self.assertEqual(self.model.get_bundle(self.bundle.uuid).metadata.name, 'renamed')
+
+    def test_invalidated_after_commit(self):
+        """Updates made in a larger transaction only invalidate the bundle once it's committed."""
+        bundle = self.model.get_bundle(self.bundle.uuid)
+        with patch.object(self.model.bundle_cache, 'invalidate') as invalidate:
+            with self.model._begin_bundle_update(bundle) as connection:
+                self.model.update_bundle(bundle, {'metadata': {'name': 'renamed'}}, connection)
+                invalidate.assert_not_called()
+            invalidate.assert_called_once_with([bundle.uuid])
+            self.model.update_bundle_data_size(bundle, 10)
+            self.assertEqual(invalidate.call_count, 2)
+
+    def test_invalidated_on_delete(self):
+        self.model.get_bundle(self.bundle.uuid)
+        self.model.delete_bundles([self.bundle.uuid])
+        self.assertEqual(self.model.batch_get_bundles(uuid=[self.bundle.uuid]), [])
+
+    def test_redis_backend(self):
+        client = FakeRedis()
+        self.model.bundle_cache = BundleCache(RedisBundleCacheBackend(client))
+        self.model.get_bundle(self.bundle.uuid)
+        self.assertEqual(list(client.values), ['codalab:bundle:' + self.bundle.uuid])
+        self.assert_served_from_cache()
+        # Another process sharing the server sees the invalidation.
+        other_cache = BundleCache(RedisBundleCacheBackend(client))
+        other_cache.invalidate([self.bundle.uuid])
+        self.assertEqual(client.values, {})
+
+    def test_backend_errors_ignored(self):
+        class BrokenBackend(object):
+            def get_many(self, keys):
+                raise ConnectionError()
+
+            set_many = delete_many = get_many
+
+        self.model.bundle_cache = BundleCache(BrokenBackend())
+        self.assertEqual(self.model.get_bundle(self.bundle.uuid).metadata.name, 'cached')
+        self.model.delete_bundles([self.bundle.uuid])
+        self.assertEqual(self.model.batch_get_bundles(uuid=[self.bundle.uuid]), [])
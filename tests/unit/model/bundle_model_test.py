@@ -1,7 +1,13 @@
+import json
 import unittest
+from unittest.mock import patch
+from codalab.common import UsageError
+from codalab.lib.spec_util import generate_uuid
+from codalab.objects.dependency import Dependency
 from tests.unit.server.bundle_manager import TestBase
 from codalab.worker.bundle_state import State
-from codalab.model.bundle_model import is_academic_email
+from codalab.model.bundle_model import encode_search_cursor, is_academic_email
+from codalab.objects.worksheet import item_sort_key, Worksheet
 
 
 class BundleModelTest(TestBase, unittest.TestCase):
@@ -23,6 +29,288 @@ class BundleModelTest(TestBase, unittest.TestCase):
         bundle = self.bundle_manager._model.get_bundle(bundle.uuid)
         self.assertEqual(bundle.state, State.WORKER_OFFLINE)
 
+    def test_get_staged_docker_images(self):
+        """get_staged_docker_images returns images of staged bundles, most requested first."""
+        for state, image in [
+            (State.STAGED, 'a:latest'),
+            (State.STAGED, 'b:latest'),
+            (State.STAGED, 'b:latest'),
+            (State.STAGED, ''),
+            (State.RUNNING, 'c:latest'),
+        ]:
+            self.save_bundle(self.create_run_bundle(state, {'request_docker_image': image}))
+        model = self.bundle_manager._model
+        self.assertEqual(model.get_staged_docker_images(5), ['b:latest', 'a:latest'])
+        self.assertEqual(model.get_staged_docker_images(1), ['b:latest'])
+
+    def test_search_bundles_by_name(self):
+        """Bare keywords and name patterns match names (with the full-text index) or uuids."""
+        model = self.bundle_manager._model
+        names = ['train-resnet', 'Eval-ResNet', 'mnist', 'x']
+        bundles = [self.create_run_bundle(State.READY, {'name': name}) for name in names]
+        for bundle in bundles:
+            self.save_bundle(bundle)
+
+        def search(*keywords):
+            result = model.search_bundles(model.root_user_id, list(keywords))['result']
+            return sorted(names[[b.uuid for b in bundles].index(uuid)] for uuid in result)
+
+        self.assertEqual(search('resnet'), ['Eval-ResNet', 'train-resnet'])
+        self.assertEqual(search('.*net.*'), ['Eval-ResNet', 'train-resnet'])
+        self.assertEqual(search('name=.*res.*'), ['Eval-ResNet', 'train-resnet'])
+        self.assertEqual(search('name=train.*'), ['train-resnet'])
+        self.assertEqual(search('name=mnist'), ['mnist'])
+        self.assertEqual(search('name=.*x.*'), ['x'])
+        self.assertEqual(search('n-r'), ['train-resnet'])
+        self.assertEqual(search(bundles[2].uuid[3:10]), ['mnist'])
+        self.assertEqual(search('resnet', 'eval'), ['Eval-ResNet'])
+
+        # The index is kept up to date when bundles are renamed and deleted.
+        model.update_bundle(bundles[2], {'metadata': {'name': 'mnist-resnet'}})
+        model.delete_bundles([bundles[0].uuid])
+        self.assertEqual(search('resnet'), ['Eval-ResNet', 'mnist'])
+        self.assertEqual(search('mnist'), ['mnist'])
+        self.assertEqual(search('train'), [])
+
+    def test_search_bundles_by_typed_metadata(self):
+        """Searches on data_size, created and time use the typed columns of bundle_search."""
+        model = self.bundle_manager._model
+        bundles = []
+        for name, data_size, created in [('a', 100, 1000), ('b', 20, 3000), ('c', 3, 2000)]:
+            bundle = self.create_run_bundle(State.READY, {'name': name, 'data_size': data_size})
+            self.save_bundle(bundle)
+            model.update_bundle(bundle, {'metadata': {'created': created}})
+            model.update_bundle(bundle, {'metadata': {'time': None}}, delete=True)
+            bundles.append(bundle)
+        bundle = self.create_run_bundle(State.READY, {'name': 'd'})
+        self.save_bundle(bundle)
+        model.update_bundle(bundle, {'metadata': {'created': 4000}})
+        # This bundle has no data_size or time, so it isn't sorted or summed on them.
+        model.update_bundle(bundle, {'metadata': {'data_size': None, 'time': None}}, delete=True)
+
+        def search(*keywords):
+            return model.search_bundles(model.root_user_id, list(keywords))['result']
+
+        def names(*keywords):
+            return [model.get_bundle(uuid).metadata.name for uuid in search(*keywords)]
+
+        # Sizes are compared as numbers, not as text.
+        self.assertEqual(names('size=.sort'), ['c', 'b', 'a'])
+        self.assertEqual(names('size=.sort-'), ['a', 'b', 'c'])
+        self.assertEqual(names('created=.sort-'), ['d', 'b', 'c', 'a'])
+        self.assertEqual(search('size=.sum'), 123)
+        self.assertEqual(names('size=20'), ['b'])
+        self.assertEqual(sorted(names('.after=1970-01-01T00:40:00+00:00')), ['b', 'd'])
+
+        model.update_bundle(bundles[0], {'metadata': {'data_size': 1, 'time': 2.5}})
+        self.assertEqual(names('size=.sort'), ['a', 'c', 'b'])
+        self.assertEqual(search('size=.sum'), 24)
+        self.assertEqual(names('time=.sort'), ['a'])
+        model.update_bundle(bundles[0], {'metadata': {'time': None}}, delete=True)
+        self.assertEqual(names('time=.sort'), [])
+
+    def test_search_bundles_with_cursor(self):
+        """Pages of search results found with cursors cover all bundles in order."""
+        model = self.bundle_manager._model
+        uuids = []
+        for data_size in [5, 3, 5, 1, 5, 4, 2]:
+            bundle = self.create_run_bundle(State.READY, {'data_size': data_size})
+            self.save_bundle(bundle)
+            uuids.append(bundle.uuid)
+
+        def pages(*keywords):
+            result = []
+            cursor = ''
+            while cursor is not None:
+                page = model.search_bundles(
+                    model.root_user_id, list(keywords) + ['.limit=2', '.cursor=' + cursor]
+                )
+                self.assertLessEqual(len(page['result']), 2)
+                result.extend(page['result'])
+                cursor = page['next_cursor']
+            return result
+
+        self.assertEqual(pages(), uuids)
+        self.assertEqual(pages('.last'), uuids[::-1])
+        # Bundles with the same size are ordered by id.
+        by_size = sorted(
+            range(len(uuids)), key=lambda i: (model.get_bundle(uuids[i]).metadata.data_size, i)
+        )
+        self.assertEqual(pages('size=.sort'), [uuids[i] for i in by_size])
+        by_size = sorted(
+            range(len(uuids)), key=lambda i: (-model.get_bundle(uuids[i]).metadata.data_size, i)
+        )
+        self.assertEqual(pages('size=.sort-'), [uuids[i] for i in by_size])
+        self.assertEqual(pages('size=5'), [uuids[0], uuids[2], uuids[4]])
+        # Without .cursor, there is no next cursor.
+        self.assertNotIn('next_cursor', model.search_bundles(model.root_user_id, ['.limit=2']))
+        for cursor in [
+            'invalid',
+            'NQ==',
+            encode_search_cursor(5, 'id'),
+            encode_search_cursor([], 1),
+        ]:
+            with self.assertRaises(UsageError):
+                model.search_bundles(model.root_user_id, ['.cursor=' + cursor])
+
+    def test_iter_bundles(self):
+        """iter_bundles yields the same bundles as batch_get_bundles, in chunks."""
+        model = self.bundle_manager._model
+        for state in [State.READY, State.RUNNING, State.READY, State.READY, State.READY]:
+            self.save_bundle(self.create_run_bundle(state))
+        expected = [bundle.uuid for bundle in model.batch_get_bundles(state=State.READY)]
+        with patch.object(model, 'batch_get_bundles', wraps=model.batch_get_bundles) as get:
+            bundles = model.iter_bundles(chunk_size=2, state=State.READY)
+            self.assertEqual([bundle.uuid for bundle in bundles], expected)
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(list(model.iter_bundles(uuid=[])), [])
+
+    def test_get_descendants_and_ancestors(self):
+        """get_descendants and get_ancestors follow dependencies with and without WITH RECURSIVE."""
+        # a -> b -> d, a -> c -> d, d -> e
+        parents = {'a': [], 'b': ['a'], 'c': ['a'], 'd': ['b', 'c'], 'e': ['d']}
+        bundles = {}
+        for name, parent_names in parents.items():
+            bundle = self.create_run_bundle(State.READY, {'name': name})
+            bundle.dependencies = [
+                Dependency(
+                    {
+                        'parent_uuid': bundles[parent_name].uuid,
+                        'parent_path': '',
+                        'child_uuid': bundle.uuid,
+                        'child_path': parent_name,
+                    }
+                )
+                for parent_name in parent_names
+            ]
+            self.save_bundle(bundle)
+            bundles[name] = bundle
+        model = self.bundle_manager._model
+        names = {bundle.uuid: name for name, bundle in bundles.items()}
+
+        def descendants(depth, *seeds):
+            uuids = [bundles[name].uuid for name in seeds]
+            return [names[uuid] for uuid in model.get_descendants(uuids, depth)]
+
+        def ancestors(depth, *seeds):
+            uuids = [bundles[name].uuid for name in seeds]
+            return [names[uuid] for uuid in model.get_ancestors(uuids, depth)]
+
+        def by_uuid(*names):
+            return sorted(names, key=lambda name: bundles[name].uuid)
+
+        # Bundles are ordered by depth and then uuid, or only by uuid without a depth.
+        b_and_c = by_uuid('b', 'c')
+        for recursive in [True, False]:
+            with patch.object(model, '_supports_recursive_queries', return_value=recursive):
+                self.assertEqual(descendants(None, 'a'), by_uuid('b', 'c', 'd', 'e'))
+                self.assertEqual(descendants(2, 'a'), b_and_c + ['d'])
+                self.assertEqual(descendants(0, 'a'), [])
+                self.assertEqual(descendants(None, 'e'), [])
+                self.assertEqual(descendants(None, 'b', 'd'), ['e'])
+                self.assertEqual(ancestors(None, 'e'), by_uuid('a', 'b', 'c', 'd'))
+                self.assertEqual(ancestors(3, 'e'), ['d'] + b_and_c + ['a'])
+                self.assertEqual(ancestors(1, 'd'), b_and_c)
+                self.assertEqual(
+                    model.get_self_and_descendants([bundles['c'].uuid], 1),
+                    [bundles['c'].uuid, bundles['d'].uuid],
+                )
+
+    def test_get_memoized_bundles(self):
+        """get_memoized_bundles finds the user's run bundles with the same command and dependencies."""
+        model = self.bundle_manager._model
+
+        def save_run(command, dependencies, owner_id=None):
+            bundle = self.create_run_bundle(State.READY)
+            bundle.command = command
+            bundle.owner_id = owner_id or self.user_id
+            bundle.dependencies = [
+                Dependency(
+                    {
+                        'parent_uuid': parent_uuid,
+                        'parent_path': '',
+                        'child_uuid': bundle.uuid,
+                        'child_path': child_path,
+                    }
+                )
+                for child_path, parent_uuid in dependencies
+            ]
+            self.save_bundle(bundle)
+            return bundle.uuid
+
+        def memoized(command, dependencies):
+            dependencies = [
+                {'child_path': child_path, 'parent_uuid': parent_uuid}
+                for child_path, parent_uuid in dependencies
+            ]
+            return model.get_memoized_bundles(self.user_id, command, json.dumps(dependencies))
+
+        parent1, parent2, parent3 = (generate_uuid() for _ in range(3))
+        first = save_run('python train.py', [('data', parent1), ('code', parent2)])
+        second = save_run('python train.py', [('code', parent2), ('data', parent1)])
+        save_run('python train.py', [('data', parent1)])
+        save_run('python train.py', [('data', parent1), ('code', parent3)])
+        save_run('python train.py', [('data', parent1), ('code', parent2)], owner_id='other')
+        no_dependencies = save_run('python train.py', [])
+
+        self.assertEqual(
+            memoized('python train.py', [('data', parent1), ('code', parent2)]), [first, second]
+        )
+        self.assertEqual(memoized('python train.py', []), [no_dependencies])
+        self.assertEqual(memoized('python test.py', [('data', parent1), ('code', parent2)]), [])
+
+    def test_add_worksheet_items_sort_keys(self):
+        """Items inserted between others get sort keys in the gap, without shifting the others."""
+        model = self.bundle_manager._model
+        worksheet = Worksheet(
+            {'name': 'items', 'title': None, 'frozen': None, 'items': [], 'owner_id': self.user_id}
+        )
+        model.new_worksheet(worksheet)
+
+        def add(values, after_sort_key=None):
+            items = [(None, None, value, 'markup') for value in values]
+            model.add_worksheet_items(worksheet.uuid, items, after_sort_key)
+
+        def get_items():
+            items = model.get_worksheet(worksheet.uuid, fetch_items=True).items
+            return [(item['value'], item_sort_key(item)) for item in items]
+
+        def sort_key_of(value):
+            return dict(get_items())[value]
+
+        identity = lambda value: value  # noqa: E731
+        with patch.object(model, 'encode_str', identity), patch.object(
+            model, 'decode_str', identity
+        ):
+            # Appended items have no sort key and sort by their id.
+            add(['a', 'b', 'c'])
+            appended = get_items()
+            self.assertEqual([value for value, _ in appended], ['a', 'b', 'c'])
+
+            add(['x', 'y'], sort_key_of('a'))
+            items = get_items()
+            self.assertEqual([value for value, _ in items], ['a', 'x', 'y', 'b', 'c'])
+            self.assertEqual([item for item in items if item[0] in 'abc'], appended)
+
+            # Filling the same gap over and over eventually rebalances the worksheet.
+            for i in range(20):
+                add(['z%d' % i], sort_key_of('a'))
+            values = [value for value, _ in get_items()]
+            self.assertEqual(
+                values, ['a'] + ['z%d' % i for i in reversed(range(20))] + ['x', 'y', 'b', 'c']
+            )
+            sort_keys = [sort_key for _, sort_key in get_items()]
+            self.assertEqual(sort_keys, sorted(set(sort_keys)))
+
+            model.fill_worksheet_item_sort_keys(worksheet.uuid)
+            self.assertEqual([value for value, _ in get_items()], values)
+            self.assertTrue(
+                all(
+                    item['sort_key'] is not None
+                    for item in model.get_worksheet(worksheet.uuid, fetch_items=True).items
+                )
+            )
+
     def test_is_academic_email(self):
         """Unit test to check is_academic_email function."""
         test_cases = {
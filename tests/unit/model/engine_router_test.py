@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from codalab.model.sqlite_model import SQLiteModel
+from codalab.worker.bundle_state import State
+from tests.unit.server.bundle_manager import TestBase
+
+
+class EngineRouterTest(TestBase, unittest.TestCase):
+    """Uses two SQLite databases, the replica being a copy of the primary at some point."""
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        primary_path = os.path.join(temp_dir, 'primary.sqlite')
+        replica_path = os.path.join(temp_dir, 'replica.sqlite')
+        SQLiteModel(
+            self.codalab_manager.default_user_info(), self.root_user_id, '-1', primary_path
+        ).engine.dispose()
+        shutil.copyfile(primary_path, replica_path)
+        self.model = SQLiteModel(
+            self.codalab_manager.default_user_info(),
+            self.root_user_id,
+            '-1',
+            primary_path,
+            replica_path,
+        )
+        self.bundle_manager._model = self.model
+        # The replica hasn't caught up with this bundle yet.
+        self.bundle = self.create_run_bundle(State.RUNNING)
+        self.save_bundle(self.bundle)
+
+    def catch_up_replica(self):
+        primary = self.model.engine_router.primary.raw_connection()
+        replica = self.model.engine_router.replica.raw_connection()
+        primary.connection.backup(replica.connection)
+
+    def search(self, keywords):
+        return self.model.search_bundles(self.root_user_id, keywords)['result']
+
+    def begin_request(self):
+        self.model.engine_router.begin()
+        self.addCleanup(self.model.engine_router.end)
+
+    def test_primary_outside_of_requests(self):
+        self.assertEqual(self.model.get_bundle(self.bundle.uuid).uuid, self.bundle.uuid)
+        self.assertEqual(self.search(['.count']), 1)
+
+    def test_read_only_queries_routed_to_replica(self):
+        self.begin_request()
+        self.assertEqual(self.model.batch_get_bundles(uuid=[self.bundle.uuid]), [])
+        self.assertEqual(self.search(['.count']), 0)
+        # Methods that aren't marked as read-only use the primary.
+        self.assertEqual(self.model.get_bundle_state(self.bundle.uuid), State.RUNNING)
+
+    def test_read_your_writes(self):
+        self.begin_request()
+        self.assertEqual(self.search(['.count']), 0)
+        bundle = self.create_run_bundle(State.RUNNING)
+        self.save_bundle(bundle)
+        self.assertEqual(self.model.get_bundle(bundle.uuid).uuid, bundle.uuid)
+        self.assertEqual(self.search(['.count']), 2)
+        # The next request reads from the replica again.
+        self.model.engine_router.end()
+        self.begin_request()
+        self.assertEqual(self.search(['.count']), 0)
+
+    def test_queries_counted(self):
+        self.model.request_cache.begin()
+        self.begin_request()
+        self.model.batch_get_bundles(uuid=[self.bundle.uuid])
+        self.assertEqual(self.model.request_cache.end()['queries'], 1)
+
+    def test_replica_reads_not_cached(self):
+        bundle = self.create_run_bundle(State.READY, {'name': 'old'})
+        self.save_bundle(bundle)
+        self.catch_up_replica()
+        self.model.update_bundle(bundle, {'metadata': {'name': 'new'}})
+        self.begin_request()
+        # The replica hasn't caught up with the update yet...
+        self.assertEqual(self.model.get_bundle(bundle.uuid).metadata.name, 'old')
+        self.model.engine_router.end()
+        # ...but what it returned wasn't cached for later reads.
+        self.assertEqual(self.model.get_bundle(bundle.uuid).metadata.name, 'new')
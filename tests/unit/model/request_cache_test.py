@@ -0,0 +1,48 @@
+import unittest
+
+from codalab.worker.bundle_state import State
+from tests.unit.server.bundle_manager import TestBase
+
+
+class RequestCacheTest(TestBase, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.model = self.bundle_manager._model
+        self.bundle = self.create_run_bundle(State.READY, {'name': 'cached'})
+        self.save_bundle(self.bundle)
+        self.model.request_cache.begin()
+        self.addCleanup(self.model.request_cache.end)
+
+    def test_reads_cached(self):
+        """Repeated reads in a request are only queried once."""
+        self.model.get_bundle(self.bundle.uuid)
+        queries = self.model.request_cache.end()['queries']
+        self.model.request_cache.begin()
+        for _ in range(3):
+            self.assertEqual(self.model.get_bundle(self.bundle.uuid).metadata.name, 'cached')
+            self.model.get_bundle_owner_ids([self.bundle.uuid])
+        stats = self.model.request_cache.end()
+        self.assertEqual(stats['hits'], 4)
+        self.assertLessEqual(stats['queries'], queries + 1)
+
+    def test_copies(self):
+        """Modifying a result doesn't modify the cached one."""
+        self.model.get_bundle(self.bundle.uuid).metadata.name = 'modified'
+        self.assertEqual(self.model.get_bundle(self.bundle.uuid).metadata.name, 'cached')
+
+    def test_invalidated_on_write(self):
+        """Reads after a write in the same request see it."""
+        bundle = self.model.get_bundle(self.bundle.uuid)
+        self.model.update_bundle(bundle, {'metadata': {'name': 'renamed'}})
+        self.assertEqual(self.model.get_bundle(self.bundle.uuid).metadata.name, 'renamed')
+        self.assertEqual(
+            self.model.get_bundle_metadata([bundle.uuid], 'name')[bundle.uuid], 'renamed'
+        )
+
+    def test_inactive(self):
+        """Outside of requests, nothing is cached."""
+        self.model.request_cache.end()
+        self.model.get_bundle(self.bundle.uuid)
+        self.model.get_bundle(self.bundle.uuid)
+        self.assertFalse(self.model.request_cache.active)
+        self.assertEqual(self.model.request_cache.end()['hits'], 0)
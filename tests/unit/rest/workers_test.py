@@ -21,7 +21,7 @@ class WorkersTest(BaseTestCase):
         }
         response = self.app.post_json('/rest/workers/test_worker/checkin', body)
         self.assertEqual(response.status_int, 200)
-        # self.assertEqual(response.body, b'')
+        self.assertEqual(response.json['accept_encoding'], 'gzip')
 
     @unittest.skip("not implemented yet")
     def test_checkin_with_run(self):
@@ -0,0 +1,35 @@
+from codalab.worker.bundle_state import State
+from freezegun import freeze_time
+from tests.unit.server.bundle_manager import BaseBundleManagerTest
+
+
+class BundleManagerReconcileDiskUsedTest(BaseBundleManagerTest):
+    def get_disk_used(self):
+        return self.bundle_manager._model.get_user_info(self.user_id)['disk_used']
+
+    def test_no_drift(self):
+        """Disk used that is kept up to date incrementally should not be repaired."""
+        bundle = self.create_run_bundle(State.READY, {'data_size': 0})
+        self.save_bundle(bundle)
+        self.bundle_manager._model.update_bundle_data_size(bundle, 1000)
+        self.assertEqual(self.get_disk_used(), 1000)
+        self.bundle_manager._model.update_bundle_data_size(bundle, 200)
+        self.assertEqual(self.get_disk_used(), 200)
+        self.assertEqual(self.bundle_manager._model.reconcile_user_disk_used(), {})
+
+    @freeze_time("2020-02-12", as_kwarg='frozen_time')
+    def test_repair_drift(self, frozen_time):
+        """Disk used that drifted from the size of the user's bundles should be repaired
+        periodically."""
+        for data_size in [1000, 234]:
+            self.save_bundle(self.create_run_bundle(State.READY, {'data_size': data_size}))
+        self.bundle_manager._reconcile_disk_used()
+        self.assertEqual(self.get_disk_used(), 1234)
+
+        # The next reconciliation is only an hour later.
+        self.bundle_manager._model.increment_user_disk_used(self.user_id, 10)
+        self.bundle_manager._reconcile_disk_used()
+        self.assertEqual(self.get_disk_used(), 1244)
+        frozen_time.tick(60 * 60)
+        self.bundle_manager._reconcile_disk_used()
+        self.assertEqual(self.get_disk_used(), 1234)
@@ -9,7 +9,9 @@ import unittest
 from io import BytesIO
 
 from codalab.common import NotFoundError, StorageType
+from codalab.lib.download_manager import FileSection
 from codalab.lib.spec_util import generate_uuid
+from codalab.worker.bundle_state import State
 from codalab.worker.download_util import BundleTarget
 from codalab.worker.file_util import tar_gzip_directory
 from tests.unit.server.bundle_manager import TestBase
@@ -232,6 +234,66 @@ class BaseUploadDownloadBundleTest(TestBase):
         self.assertEqual(str(info["resolved_target"]), f"{bundle.uuid}:src/item2.txt")
         self.check_file_target_contents(target)
 
+    def test_gzipping_requires_recompression(self):
+        """Only files within directories on blob storage are decompressed to be read."""
+        bundle = self.create_run_bundle()
+        self.save_bundle(bundle)
+        self.upload_folder(bundle, [("item.txt", b"hello world")])
+        self.assertEqual(
+            self.download_manager.gzipping_requires_recompression(
+                BundleTarget(bundle.uuid, "item.txt")
+            ),
+            self.use_azure_blob_beta,
+        )
+
+        bundle = self.create_run_bundle()
+        self.save_bundle(bundle)
+        self.upload_file(bundle, b"hello world")
+        self.assertFalse(
+            self.download_manager.gzipping_requires_recompression(BundleTarget(bundle.uuid, ""))
+        )
+
+    def test_local_file_section(self):
+        """Only files on local disk are sent with sendfile, in sections of the requested size."""
+        bundle = self.create_run_bundle()
+        self.save_bundle(bundle)
+        self.upload_folder(bundle, [("item.txt", b"hello world")])
+        file_path = self.download_manager.get_local_file_path(BundleTarget(bundle.uuid, "item.txt"))
+        if self.use_azure_blob_beta:
+            self.assertIsNone(file_path)
+            return
+        self.assertIsNone(self.download_manager.get_local_file_path(BundleTarget(bundle.uuid, "")))
+
+        for offset, length, expected in [
+            (0, None, b"hello world"),
+            (6, 3, b"wor"),
+            (6, 100, b"world"),
+            (100, 3, b""),
+        ]:
+            section = FileSection(file_path, offset, length)
+            self.assertEqual(section.length, len(expected))
+            self.assertEqual(os.lseek(section.fileno(), 0, os.SEEK_CUR), min(offset, 11))
+            self.assertEqual(b"".join(iter(lambda: section.read(2), b"")), expected)
+            section.close()
+
+    def test_stream_tarred_directory(self):
+        """Directories of ready bundles on local disk are streamed uncompressed, with their size."""
+        bundle = self.create_run_bundle()
+        self.save_bundle(bundle)
+        self.upload_folder(bundle, [("item.txt", b"hello world"), ("src/item2.txt", b"hi")])
+        target = BundleTarget(bundle.uuid, "")
+        self.assertIsNone(self.download_manager.stream_tarred_directory(target))
+        self.bundle_manager._model.update_bundle(bundle, {'state': State.READY})
+        tarred_directory = self.download_manager.stream_tarred_directory(target)
+        if self.use_azure_blob_beta:
+            self.assertIsNone(tarred_directory)
+            return
+        fileobj, size = tarred_directory
+        contents = fileobj.read()
+        self.assertEqual(len(contents), size)
+        with tarfile.open(fileobj=BytesIO(contents), mode='r:') as f:
+            self.assertEqual(sorted(f.getnames()), ['.', './item.txt', './src', './src/item2.txt'])
+
 
 class RegularBundleStoreTest(BaseUploadDownloadBundleTest, unittest.TestCase):
     """Test uploading and downloading from / to a regular, file-based bundle store."""
@@ -0,0 +1,93 @@
+import tests.unit.azure_blob_mock  # noqa: F401
+import io
+import os
+import unittest
+
+from apache_beam.io.filesystem import CompressionTypes
+from apache_beam.io.filesystems import FileSystems
+
+from codalab.worker.block_cache import BlockCache, CachedBlobFile, open_cached_blob
+from tests.unit.worker.download_util_test import AzureBlobTestBase
+
+BLOCK_SIZE = 1024
+
+
+class CountingFile(io.BytesIO):
+    """A file that records the (offset, length) of each read made from it."""
+
+    def __init__(self, contents):
+        super().__init__(contents)
+        self.reads = []
+
+    def read(self, size=-1):
+        offset = self.tell()
+        result = super().read(size)
+        self.reads.append((offset, len(result)))
+        return result
+
+
+class CachedBlobFileTest(unittest.TestCase):
+    def setUp(self):
+        self.contents = os.urandom(64 * BLOCK_SIZE + 100)
+        self.cache = BlockCache(max_size_bytes=32 * BLOCK_SIZE, block_size=BLOCK_SIZE)
+
+    def open(self, fileobj=None):
+        self.fileobj = fileobj or CountingFile(self.contents)
+        return CachedBlobFile(self.fileobj, 'key', self.cache)
+
+    def test_random_reads(self):
+        f = self.open()
+        for offset, length in [(10, 20), (5000, 3000), (64 * BLOCK_SIZE + 50, 1000), (0, 1)]:
+            f.seek(offset)
+            self.assertEqual(f.read(length), self.contents[offset : offset + length])
+        f.seek(0, io.SEEK_END)
+        self.assertEqual(f.read(), b'')
+
+    def test_reads_are_aligned_and_cached(self):
+        f = self.open()
+        f.seek(1500)
+        f.read(10)
+        f.seek(1600)
+        f.read(10)
+        self.assertEqual(self.fileobj.reads, [(BLOCK_SIZE, BLOCK_SIZE)])
+        # A new file object for the same blob shares the cache.
+        f = self.open()
+        f.seek(1200)
+        self.assertEqual(f.read(100), self.contents[1200:1300])
+        self.assertEqual(self.fileobj.reads, [])
+
+    def test_sequential_read_ahead(self):
+        f = self.open()
+        data = b''.join(iter(lambda: f.read(100), b''))
+        self.assertEqual(data, self.contents)
+        # Read-ahead grows, so fetches are few and get larger.
+        self.assertLess(len(self.fileobj.reads), 10)
+        self.assertEqual(
+            self.fileobj.reads[-2][1],
+            CachedBlobFile.MAX_READ_AHEAD_BLOCKS * BLOCK_SIZE + BLOCK_SIZE,
+        )
+
+    def test_no_read_ahead_on_random_access(self):
+        f = self.open()
+        for offset in [40 * BLOCK_SIZE, 10 * BLOCK_SIZE, 20 * BLOCK_SIZE]:
+            f.seek(offset)
+            f.read(10)
+        self.assertEqual([length for _, length in self.fileobj.reads], [BLOCK_SIZE] * 3)
+
+    def test_size_bounded(self):
+        f = self.open()
+        f.read()
+        self.assertLessEqual(self.cache.stats()['size_bytes'], 32 * BLOCK_SIZE)
+
+
+class OpenCachedBlobTest(AzureBlobTestBase, unittest.TestCase):
+    def test_rewritten_blob_is_read_again(self):
+        _, path = self.create_txt_file(b"hello world")
+        with open_cached_blob(path) as f:
+            self.assertEqual(f.read(), b"hello world")
+
+        # Same size, different contents, like a bundle that is uploaded again.
+        with FileSystems.create(path, compression_type=CompressionTypes.UNCOMPRESSED) as f:
+            f.write(b"HELLO WORLD")
+        with open_cached_blob(path) as f:
+            self.assertEqual(f.read(), b"HELLO WORLD")
@@ -0,0 +1,153 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from unittest.mock import patch
+
+from codalab.worker import compression
+from codalab.worker.compression import (
+    GZIP,
+    ZSTD,
+    ParallelGzipStream,
+    accept_encoding_header,
+    codec_for_content_type,
+    enabled_codecs,
+    negotiate_codec,
+    upload_codec,
+)
+from codalab.worker.file_util import tar_compress_directory
+from codalab.worker.un_tar_directory import un_tar_directory
+
+ENABLE_ZSTD = {'CODALAB_COMPRESSION_CODECS': 'zstd,gzip'}
+
+
+class CompressionTest(unittest.TestCase):
+    def test_gzip_only_by_default(self):
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(enabled_codecs(), [GZIP])
+            self.assertEqual(accept_encoding_header(), 'gzip')
+            self.assertIs(negotiate_codec('zstd, gzip'), GZIP)
+
+    def test_gzip_always_enabled(self):
+        with patch.dict(os.environ, {'CODALAB_COMPRESSION_CODECS': 'zstd,unknown'}):
+            self.assertIn(GZIP, enabled_codecs())
+
+    @patch.dict(os.environ, ENABLE_ZSTD)
+    def test_negotiate(self):
+        if not ZSTD.is_available():
+            self.skipTest('zstandard is not installed')
+        self.assertIs(negotiate_codec('zstd, gzip'), ZSTD)
+        self.assertIs(negotiate_codec('gzip, deflate'), GZIP)
+        self.assertIs(negotiate_codec('gzip;q=1.0, zstd;q=0.5'), GZIP)
+        self.assertIs(negotiate_codec('zstd;q=0, gzip'), GZIP)
+        self.assertIs(negotiate_codec('*'), ZSTD)
+        self.assertIsNone(negotiate_codec('gzip;q=0'))
+        self.assertIsNone(negotiate_codec(None))
+
+    @patch.dict(os.environ, ENABLE_ZSTD)
+    def test_upload_codec(self):
+        """Uploads only use zstd when the server has advertised it."""
+        if not ZSTD.is_available():
+            self.skipTest('zstandard is not installed')
+        self.assertIs(upload_codec('zstd, gzip'), ZSTD)
+        self.assertIs(upload_codec('gzip'), GZIP)
+        self.assertIs(upload_codec(None), GZIP)
+
+    def test_codec_unavailable(self):
+        with patch.dict(os.environ, ENABLE_ZSTD), patch.object(compression, 'zstandard', None):
+            self.assertEqual(enabled_codecs(), [GZIP])
+            self.assertIs(negotiate_codec('zstd'), None)
+
+    def test_codec_for_content_type(self):
+        self.assertIs(codec_for_content_type('application/zstd'), ZSTD)
+        self.assertIs(codec_for_content_type('application/gzip'), GZIP)
+        self.assertIs(codec_for_content_type(None), GZIP)
+
+    def test_round_trip(self):
+        contents = os.urandom(1024) * 3000
+        for codec in [GZIP, ZSTD]:
+            if not codec.is_available():
+                continue
+            compressed = codec.compress_stream(BytesIO(contents)).read()
+            self.assertLess(len(compressed), len(contents))
+            stream = codec.decompress_stream(BytesIO(compressed))
+            self.assertEqual(b''.join(iter(lambda: stream.read(4096), b'')), contents)
+
+    def test_level(self):
+        contents = b''.join(b'line %d of the file\n' % (i % 5000) for i in range(100000))
+        for codec in [GZIP, ZSTD]:
+            if not codec.is_available():
+                continue
+            fast = codec.compress_stream(BytesIO(contents), level=1).read()
+            with patch.dict(os.environ, {'CODALAB_%s_LEVEL' % codec.name.upper(): '1'}):
+                self.assertEqual(codec.level(), 1)
+                self.assertEqual(codec.compress_stream(BytesIO(contents)).read(), fast)
+            self.assertEqual(codec.level(), codec.default_level)
+            self.assertLess(len(codec.compress_stream(BytesIO(contents)).read()), len(fast))
+
+    def test_tar_directory(self):
+        source = tempfile.mkdtemp()
+        dest = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, dest)
+        os.mkdir(os.path.join(source, 'dir'))
+        with open(os.path.join(source, 'dir', 'file'), 'wb') as f:
+            f.write(b'hello world')
+        for codec in [GZIP, ZSTD]:
+            if not codec.is_available():
+                continue
+            dest_path = os.path.join(dest, codec.name)
+            un_tar_directory(
+                tar_compress_directory(source, codec), dest_path, codec.tar_compression
+            )
+            with open(os.path.join(dest_path, 'dir', 'file'), 'rb') as f:
+                self.assertEqual(f.read(), b'hello world')
+
+    def test_parallel_gzip(self):
+        # Compressible contents, so that blocks refer back into the blocks before them.
+        contents = b''.join(b'line %d of the file\n' % (i % 5000) for i in range(300000))
+        for size in [0, 100, ParallelGzipStream.BLOCK_SIZE, len(contents)]:
+            stream = ParallelGzipStream(BytesIO(contents[:size]), threads=4)
+            compressed = b''.join(iter(lambda: stream.read(10000), b''))
+            self.assertEqual(gzip.decompress(compressed), contents[:size])
+            self.assertEqual(GZIP.decompress_stream(BytesIO(compressed)).read(), contents[:size])
+        # Using the previous block as dictionary keeps the ratio close to that of gzip.
+        self.assertLess(len(compressed), 1.1 * len(gzip.compress(contents)))
+
+    def test_threads(self):
+        """Streams are compressed with one thread unless all cores are used, as in the worker."""
+        with patch.dict(os.environ, {}, clear=True), patch.object(
+            compression, '_default_threads', 1
+        ), patch('os.cpu_count', lambda: 8):
+            self.assertEqual(compression.compression_threads(), 1)
+            self.assertNotIsInstance(GZIP.compress_stream(BytesIO(b'')), ParallelGzipStream)
+            compression.use_all_cores()
+            self.assertEqual(compression.compression_threads(), 8)
+            with patch.dict(os.environ, {'CODALAB_COMPRESSION_THREADS': '2'}):
+                self.assertEqual(compression.compression_threads(), 2)
+
+    def test_close(self):
+        for stream in [GZIP.compress_stream(BytesIO(b'')), ParallelGzipStream(BytesIO(b''), 2)]:
+            stream.close()
+            self.assertTrue(stream.closed)
+
+    def test_tar_directory_threads(self):
+        source = tempfile.mkdtemp()
+        dest = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, dest)
+        with open(os.path.join(source, 'file'), 'wb') as f:
+            f.write(os.urandom(3 * 1024 * 1024))
+        configurations = [('1', None), ('4', None), ('4', compression.pigz_path())]
+        for i, (threads, pigz) in enumerate(configurations):
+            with patch.dict(os.environ, {'CODALAB_COMPRESSION_THREADS': threads}), patch(
+                'codalab.worker.file_util.pigz_path', lambda: pigz
+            ):
+                dest_path = os.path.join(dest, str(i))
+                un_tar_directory(tar_compress_directory(source, GZIP), dest_path, 'gz')
+            with open(os.path.join(source, 'file'), 'rb') as f, open(
+                os.path.join(dest_path, 'file'), 'rb'
+            ) as g:
+                self.assertEqual(f.read(), g.read())
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from codalab.lib import path_util
+from codalab.worker import download_util
+from codalab.worker.directory_manifest import DirectoryManifest, get_manifest_path
+from codalab.worker.download_util import BundleTarget, _compute_target_info_local
+
+
+def sort_contents(info):
+    """Sorts the contents of a target info recursively, since listing order is not defined."""
+    if 'contents' in info:
+        info['contents'] = sorted(
+            (sort_contents(child) for child in info['contents']), key=lambda child: child['name']
+        )
+    return info
+
+
+class DirectoryManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.bundle_path = os.path.join(self.temp_dir, 'bundle')
+        os.makedirs(os.path.join(self.bundle_path, 'dir', 'sub'))
+        with open(os.path.join(self.bundle_path, 'dir', 'sub', 'file'), 'wb') as f:
+            f.write(b'hello world')
+        with open(os.path.join(self.bundle_path, 'file'), 'wb') as f:
+            f.write(b'x' * 1000)
+        os.symlink('dir/sub', os.path.join(self.bundle_path, 'link'))
+
+    def test_same_as_directory(self):
+        with DirectoryManifest.write(self.bundle_path) as manifest:
+            self.assertEqual(manifest.get_total_size(), path_util.get_size(self.bundle_path))
+            for path in ['', 'dir', 'dir/sub/file', 'link']:
+                self.assertEqual(
+                    sort_contents(manifest.get_target_info(path, float('inf'))),
+                    sort_contents(
+                        _compute_target_info_local(
+                            os.path.join(self.bundle_path, path).rstrip('/'), float('inf')
+                        )
+                    ),
+                )
+            self.assertEqual(
+                [child['name'] for child in manifest.get_target_info('', 1)['contents']],
+                ['dir', 'file', 'link'],
+            )
+            self.assertNotIn('contents', manifest.get_target_info('dir', 1)['contents'][0])
+            self.assertIsNone(manifest.get_target_info('missing', 1))
+
+    def test_get_target_info_from_manifest(self):
+        DirectoryManifest.write(self.bundle_path).close()
+        with patch.object(download_util, '_compute_target_info_local') as compute:
+            info = download_util.get_target_info(
+                self.bundle_path, BundleTarget('uuid', 'dir/sub/file'), 0
+            )
+            compute.assert_not_called()
+        self.assertEqual(info['name'], 'file')
+        self.assertEqual(info['size'], len(b'hello world'))
+        self.assertEqual(info['type'], 'file')
+
+    def test_invalidated(self):
+        DirectoryManifest.write(self.bundle_path).close()
+        self.assertIsNotNone(DirectoryManifest.open(self.bundle_path))
+        # Make sure that the modification time changes.
+        stat_result = os.stat(self.bundle_path)
+        with open(os.path.join(self.bundle_path, 'new'), 'wb') as f:
+            f.write(b'new')
+        os.utime(self.bundle_path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(DirectoryManifest.open(self.bundle_path))
+        self.assertFalse(os.path.exists(get_manifest_path(self.bundle_path)))
+        info = download_util.get_target_info(self.bundle_path, BundleTarget('uuid', 'new'), 0)
+        self.assertEqual(info['size'], len(b'new'))
@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from docker.errors import APIError
+
+from codalab.worker.docker_image_manager import (
+    canonical_image_ref,
+    DockerImageManager,
+    ImagePullCoordinator,
+)
+
+
+class CanonicalImageRefTest(unittest.TestCase):
+    def test_canonical_image_ref(self):
+        for image_spec in [
+            'ubuntu:latest',
+            'library/ubuntu:latest',
+            'docker.io/library/ubuntu:latest',
+            'index.docker.io/library/ubuntu:latest',
+        ]:
+            self.assertEqual(canonical_image_ref(image_spec), 'ubuntu:latest')
+        self.assertEqual(
+            canonical_image_ref('docker.io/codalab/default-cpu:latest'),
+            'codalab/default-cpu:latest',
+        )
+        self.assertEqual(canonical_image_ref('gcr.io/foo/bar:1'), 'gcr.io/foo/bar:1')
+
+
+class ImagePullCoordinatorTest(unittest.TestCase):
+    def test_concurrency_cap(self):
+        coordinator = ImagePullCoordinator(max_concurrent_pulls=2)
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def pull_fn():
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return 100
+
+        threads = [
+            threading.Thread(target=coordinator.pull, args=['image%d:latest' % i, pull_fn])
+            for i in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max_running[0], 2)
+        self.assertEqual(len(coordinator.stats), 6)
+        self.assertEqual(coordinator.stats['image0:latest'].bytes_downloaded, 100)
+
+    def test_dedupe_in_flight_pulls(self):
+        """Pulls of the same image under different names while a pull is in flight are done once."""
+        coordinator = ImagePullCoordinator()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def pull_fn():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 0
+
+        first = threading.Thread(target=coordinator.pull, args=['ubuntu:latest', pull_fn])
+        first.start()
+        started.wait()
+        statuses = []
+        second = threading.Thread(
+            target=coordinator.pull,
+            args=['docker.io/library/ubuntu:latest', pull_fn, statuses.append],
+        )
+        second.start()
+        time.sleep(0.05)
+        release.set()
+        first.join()
+        second.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(statuses, ['Waiting for another pull of the same image'])
+
+    def test_error_raised_to_waiters(self):
+        coordinator = ImagePullCoordinator()
+
+        def pull_fn():
+            raise APIError('pull failed')
+
+        with self.assertRaises(APIError):
+            coordinator.pull('ubuntu:latest', pull_fn)
+        # A failed pull doesn't block later pulls of the same image
+        coordinator.pull('ubuntu:latest', lambda: 0)
+
+
+def mock_image(image_id, layers, tags=()):
+    """Return a mock Docker image with the given [(diff ID, size)] layers, oldest first."""
+    image = MagicMock()
+    image.id = image_id
+    image.tags = list(tags)
+    image.attrs = {
+        'RootFS': {'Layers': [diff_id for diff_id, _ in layers]},
+        'VirtualSize': sum(size for _, size in layers),
+        'RepoDigests': [],
+    }
+    # History is newest first, and includes entries that don't add a layer
+    image.history.return_value = [{'Size': size} for _, size in reversed(layers)] + [{'Size': 0}]
+    return image
+
+
+class DockerImageManagerCacheUseTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        with patch('docker.from_env'):
+            self.manager = DockerImageManager(
+                os.path.join(self.work_dir, 'images-state.json'), 1000, 0
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_shared_layers_counted_once(self):
+        base = [('sha256:base', 100)]
+        images = [
+            mock_image('a', base + [('sha256:a', 10)]),
+            mock_image('b', base + [('sha256:b', 20)]),
+        ]
+        self.manager._docker.images.list.return_value = images
+        self.assertEqual(self.manager._get_cache_use(), 130)
+
+    def test_unmatched_history_falls_back_to_virtual_size(self):
+        image = mock_image('a', [('sha256:a', 10), ('sha256:b', 20)])
+        image.history.return_value = [{'Size': 30}]
+        self.manager._docker.images.list.return_value = [image]
+        self.assertEqual(self.manager._get_cache_use(), 30)
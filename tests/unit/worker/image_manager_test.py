@@ -0,0 +1,124 @@
+import threading
+import time
+import unittest
+
+from codalab.worker.fsm import DependencyStage
+from codalab.worker.image_manager import (
+    ImageAvailabilityState,
+    ImageManager,
+    USAGE_SCORE_HALF_LIFE_SECS,
+)
+
+
+class FakeImageManager(ImageManager):
+    """An ImageManager whose downloads complete instantly, for testing."""
+
+    def __init__(self, prepull_top_n=0):
+        super().__init__(
+            max_image_size=None, max_image_cache_size=None, prepull_top_n=prepull_top_n
+        )
+        self.local_images = set()
+        self.downloaded = []
+
+    def _download(self, image_spec):
+        self.downloaded.append(image_spec)
+        self.local_images.add(image_spec)
+        self._downloading[image_spec]['success'] = True
+
+    def _image_exists_locally(self, image_spec):
+        return image_spec in self.local_images
+
+    def _image_availability_state(self, image_spec, success_message, failure_message):
+        return ImageAvailabilityState(
+            digest=image_spec, stage=DependencyStage.READY, message=success_message
+        )
+
+    def wait_for_downloads(self):
+        for image_spec in list(self._downloading):
+            self._downloading[image_spec].join()
+
+
+class ImageManagerTest(unittest.TestCase):
+    def test_usage_score_decays(self):
+        """A request is worth half as much after one half-life."""
+        manager = FakeImageManager()
+        now = time.time()
+        manager.record_usage('a', now=now - USAGE_SCORE_HALF_LIFE_SECS)
+        self.assertAlmostEqual(manager.usage_score('a', now), 0.5)
+        manager.record_usage('a', now=now)
+        self.assertAlmostEqual(manager.usage_score('a', now), 1.5)
+        self.assertEqual(manager.usage_score('never-used', now), 0.0)
+
+    def test_most_used_images(self):
+        """Frequently used images rank above images that were only used once, recently."""
+        manager = FakeImageManager()
+        now = time.time()
+        for _ in range(3):
+            manager.record_usage('popular', now=now - 60)
+        manager.record_usage('recent', now=now)
+        self.assertEqual(manager.most_used_images(2), ['popular', 'recent'])
+        self.assertEqual(manager.most_used_images(1), ['popular'])
+
+    def test_get_counts_each_request_once(self):
+        """Polling get while an image is downloading doesn't inflate its usage."""
+        manager = FakeImageManager()
+        manager.get('a')
+        manager.wait_for_downloads()
+        state = manager.get('a')
+        self.assertEqual(state.stage, DependencyStage.READY)
+        self.assertAlmostEqual(manager.usage_score('a'), 1.0, places=3)
+
+    def test_size_checked_without_lock(self):
+        """Other lookups don't wait while the size of an image is checked with the registry."""
+        manager = FakeImageManager()
+        lock_free = []
+
+        def try_lock():
+            acquired = manager._lock.acquire(blocking=False)
+            if acquired:
+                manager._lock.release()
+            lock_free.append(acquired)
+
+        def check_image_size(image_spec):
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            return None
+
+        manager._check_image_size = check_image_size
+        self.assertEqual(manager.get('a').stage, DependencyStage.DOWNLOADING)
+        self.assertEqual(lock_free, [True])
+
+    def test_prepull_only_when_idle(self):
+        manager = FakeImageManager(prepull_top_n=2)
+        manager.record_usage('popular')
+        manager._prepull()
+        self.assertEqual(manager.downloaded, [])
+
+        manager.worker_idle = True
+        manager._prepull()
+        manager.wait_for_downloads()
+        self.assertEqual(manager.downloaded, ['popular'])
+
+    def test_prepull_hints_first(self):
+        """Hinted images are pulled before popular ones, one at a time, and only once."""
+        manager = FakeImageManager(prepull_top_n=2)
+        manager.worker_idle = True
+        manager.record_usage('popular')
+        manager.update_hints(['hinted'])
+        for _ in range(4):
+            manager._prepull()
+            manager.wait_for_downloads()
+        self.assertEqual(manager.downloaded, ['hinted', 'popular'])
+        self.assertEqual(len(manager._downloading), 0)
+
+    def test_get_after_prepull(self):
+        """A run requesting a pre-pulled image gets it and counts as a use."""
+        manager = FakeImageManager(prepull_top_n=1)
+        manager.worker_idle = True
+        manager.update_hints(['hinted'])
+        manager._prepull()
+        manager.wait_for_downloads()
+        state = manager.get('hinted')
+        self.assertEqual(state.stage, DependencyStage.READY)
+        self.assertAlmostEqual(manager.usage_score('hinted'), 1.0, places=3)
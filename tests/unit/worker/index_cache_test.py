@@ -0,0 +1,82 @@
+import tests.unit.azure_blob_mock  # noqa: F401
+import shutil
+import tempfile
+import threading
+import unittest
+
+from apache_beam.io.filesystems import FileSystems
+
+from codalab.common import parse_linked_bundle_url
+from codalab.worker.file_util import update_file_size
+from codalab.worker.index_cache import IndexCache
+from tests.unit.worker.download_util_test import AzureBlobTestBase
+
+
+class IndexCacheTest(AzureBlobTestBase, unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_index_downloaded_once(self):
+        cache = IndexCache(self.cache_dir)
+        _, bundle_path = self.create_directory()
+        for _ in range(3):
+            tf, token = cache.open(bundle_path)
+            self.assertEqual(tf.getFileInfo("/README.md").size, 11)
+            cache.release(bundle_path, tf, token)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(cache.handle_hits, 2)
+        self.assertAlmostEqual(cache.hit_rate, 2 / 3)
+
+    def test_handles_not_shared_across_threads(self):
+        cache = IndexCache(self.cache_dir)
+        _, bundle_path = self.create_directory()
+        tf, token = cache.open(bundle_path)
+        cache.release(bundle_path, tf, token)
+
+        def open_in_other_thread():
+            other_tf, other_token = cache.open(bundle_path)
+            self.assertIsNot(other_tf, tf)
+            cache.release(bundle_path, other_tf, other_token)
+
+        thread = threading.Thread(target=open_in_other_thread)
+        thread.start()
+        thread.join()
+        self.assertEqual(cache.handle_hits, 0)
+
+    def test_rewritten_index_is_downloaded_again(self):
+        cache = IndexCache(self.cache_dir)
+        _, bundle_path = self.create_file(b"hello world")
+        tf, token = cache.open(bundle_path)
+        self.assertEqual(tf.getFileInfo("/contents").size, 11)
+        cache.release(bundle_path, tf, token)
+
+        update_file_size(bundle_path, 1234)
+        tf, token = cache.open(bundle_path)
+        self.assertEqual(tf.getFileInfo("/contents").size, 1234)
+        cache.release(bundle_path, tf, token)
+        self.assertEqual(cache.misses, 2)
+
+    def test_size_budget(self):
+        _, bundle_path = self.create_directory()
+        index_path = parse_linked_bundle_url(bundle_path).index_path
+        index_size = FileSystems.get_filesystem(index_path).size(index_path)
+        cache = IndexCache(self.cache_dir, max_size_bytes=index_size * 2)
+        bundle_paths = [bundle_path] + [self.create_directory()[1] for _ in range(2)]
+        for path in bundle_paths:
+            cache.release(path, *cache.open(path))
+        self.assertEqual(cache.stats()['num_indexes'], 2)
+        # The least recently used index was evicted.
+        cache.release(bundle_paths[0], *cache.open(bundle_paths[0]))
+        self.assertEqual(cache.misses, 4)
+
+    def test_persisted_across_instances(self):
+        _, bundle_path = self.create_directory()
+        cache = IndexCache(self.cache_dir)
+        cache.release(bundle_path, *cache.open(bundle_path))
+
+        cache = IndexCache(self.cache_dir)
+        cache.release(bundle_path, *cache.open(bundle_path))
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from io import BytesIO
+from unittest.mock import patch
+
+from codalab.worker.compression import GZIP
+from codalab.worker.file_util import tar_compress_directory
+from codalab.worker.tar_directory_stream import TarDirectoryStream
+
+
+class TarDirectoryStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        os.makedirs(os.path.join(self.directory, 'dir', 'sub'))
+        with open(os.path.join(self.directory, 'dir', 'sub', 'file'), 'wb') as f:
+            f.write(b'hello world')
+        with open(os.path.join(self.directory, 'big'), 'wb') as f:
+            f.write(os.urandom(3 * TarDirectoryStream.CHUNK_SIZE + 100))
+        os.symlink('dir/sub/file', os.path.join(self.directory, 'symlink'))
+        # Following this symlink would be a cycle.
+        os.symlink('..', os.path.join(self.directory, 'dir', 'parent'))
+
+    def read_archive(self, stream, read_size=10000):
+        return b''.join(iter(lambda: stream.read(read_size), b''))
+
+    def test_same_members_as_tar(self):
+        archive = self.read_archive(TarDirectoryStream(self.directory))
+        with patch.dict(os.environ, {'CODALAB_TAR_SUBPROCESS': '1'}):
+            expected = tar_compress_directory(self.directory, GZIP).read()
+        with tarfile.open(fileobj=BytesIO(archive)) as tf, tarfile.open(
+            fileobj=BytesIO(expected)
+        ) as expected_tf:
+            self.assertEqual(sorted(tf.getnames()), sorted(expected_tf.getnames()))
+            for member in tf.getmembers():
+                expected_member = expected_tf.getmember(member.name)
+                self.assertEqual(member.type, expected_member.type, member.name)
+                self.assertEqual(member.size, expected_member.size, member.name)
+                self.assertEqual(member.linkname, expected_member.linkname, member.name)
+                if member.isreg():
+                    self.assertEqual(
+                        tf.extractfile(member).read(),
+                        expected_tf.extractfile(expected_member).read(),
+                    )
+
+    def test_follow_symlinks(self):
+        archive = self.read_archive(TarDirectoryStream(self.directory, follow_symlinks=True))
+        with tarfile.open(fileobj=BytesIO(archive)) as tf:
+            self.assertEqual(tf.extractfile('./symlink').read(), b'hello world')
+            self.assertTrue(tf.getmember('./dir/parent').isdir())
+            self.assertNotIn('./dir/parent/dir', tf.getnames())
+
+    def test_exclude(self):
+        stream = TarDirectoryStream(self.directory, exclude_patterns=['sub'], exclude_names=['big'])
+        with tarfile.open(fileobj=stream, mode='r|') as tf:
+            self.assertEqual(tf.getnames(), ['.', './dir', './dir/parent', './symlink'])
+
+    def test_hardlink(self):
+        os.link(os.path.join(self.directory, 'big'), os.path.join(self.directory, 'hardlink'))
+        with tarfile.open(fileobj=TarDirectoryStream(self.directory), mode='r|') as tf:
+            members = {member.name: member for member in tf}
+        self.assertTrue(members['./big'].isreg())
+        self.assertTrue(members['./hardlink'].islnk())
+        self.assertEqual(members['./hardlink'].linkname, './big')
+
+    def test_compute_size(self):
+        for read_size in [100, 10000, None]:
+            stream = TarDirectoryStream(self.directory)
+            size = stream.compute_size()
+            if read_size is None:
+                self.assertEqual(len(stream.read()), size)
+            else:
+                self.assertEqual(len(self.read_archive(stream, read_size)), size)
+
+    def test_close(self):
+        stream = TarDirectoryStream(self.directory)
+        stream.read(tarfile.BLOCKSIZE * 4)
+        # The first chunk of ./big has been read, so it is open.
+        self.assertIsNotNone(stream._chunks.gi_frame.f_locals.get('f'))
+        f = stream._chunks.gi_frame.f_locals['f']
+        stream.close()
+        self.assertTrue(f.closed)
+        self.assertEqual(stream.read(10), b'')
@@ -0,0 +1,46 @@
+import unittest
+from unittest.mock import MagicMock
+
+from codalab.worker.upload_util import DiskUsageReporter
+
+
+def mock_client(disk_quota):
+    """A mock JsonApiClient that tracks the disk used reported to it."""
+    client = MagicMock()
+    user_info = {'disk_used': 0, 'disk_quota': disk_quota}
+
+    def update(resource, data):
+        user_info['disk_used'] += data['disk_used_increment']
+
+    client.update.side_effect = update
+    client.fetch.side_effect = lambda resource: dict(user_info)
+    return client, user_info
+
+
+class DiskUsageReporterTest(unittest.TestCase):
+    def test_reports_all_bytes_in_batches(self):
+        client, user_info = mock_client(disk_quota=10 ** 9)
+        reporter = DiskUsageReporter(
+            client, '0x1', report_interval_bytes=1000, report_interval_seconds=3600
+        )
+        for _ in range(100):
+            reporter.add(100)
+        reporter.finish()
+        self.assertEqual(user_info['disk_used'], 100 * 100)
+        # Much fewer reports than chunks
+        self.assertLess(client.update.call_count, 20)
+
+    def test_small_upload_over_quota_fails(self):
+        client, _ = mock_client(disk_quota=2)
+        reporter = DiskUsageReporter(client, '0x1')
+        reporter.add(100)
+        with self.assertRaisesRegex(Exception, 'disk quota exceeded'):
+            reporter.finish()
+
+    def test_add_raises_once_over_quota(self):
+        client, _ = mock_client(disk_quota=2)
+        reporter = DiskUsageReporter(client, '0x1')
+        reporter.add(100)
+        reporter._thread.join()
+        with self.assertRaisesRegex(Exception, 'disk quota exceeded'):
+            reporter.add(100)